@@ -0,0 +1,45 @@
+"""daily_total
+
+Revision ID: 4c7e2a9d1f30
+Revises: 9a3f8e1c2b7d
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = '4c7e2a9d1f30'
+down_revision = '9a3f8e1c2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'daily_total',
+        sa.Column('user_id', sa.Integer, primary_key=True),
+        sa.Column('date', sa.Date, primary_key=True),
+        sa.Column('count', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('calories', sa.Float, nullable=False, server_default='0'),
+        sa.Column('fat', sa.Float, nullable=False, server_default='0'),
+        sa.Column('carbs', sa.Float, nullable=False, server_default='0'),
+        sa.Column('protein', sa.Float, nullable=False, server_default='0'),
+    )
+    op.create_foreign_key(
+        'fk-daily_total-user',
+        'daily_total', 'user',
+        ['user_id'], ['id'],
+        onupdate='restrict',
+        ondelete='cascade',
+    )
+    session = sa.orm.Session(bind=op.get_bind())
+    session.execute(text('INSERT INTO daily_total(user_id, date, count, calories, fat, carbs, protein) \
+        SELECT user_id, date, count(*), sum(calories), sum(fat), sum(carbs), sum(protein) \
+        FROM food_log GROUP BY user_id, date'))
+
+
+def downgrade():
+    op.drop_table('daily_total')
@@ -0,0 +1,38 @@
+"""food_log_command_log
+
+Revision ID: b81f5d3c6a92
+Revises: 4c7e2a9d1f30
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81f5d3c6a92'
+down_revision = '4c7e2a9d1f30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('food_log', sa.Column('command_log_id', sa.Integer, nullable=True))
+    op.create_index(
+        'idx-food_log-command_log_id',
+        'food_log',
+        ['command_log_id'],
+    )
+    op.create_foreign_key(
+        'fk-food_log-command_log',
+        'food_log', 'command_log',
+        ['command_log_id'], ['id'],
+        onupdate='restrict',
+        ondelete='set null',
+    )
+
+
+def downgrade():
+    op.drop_constraint('fk-food_log-command_log', 'food_log', type_='foreignkey')
+    op.drop_index('idx-food_log-command_log_id', 'food_log')
+    op.drop_column('food_log', 'command_log_id')
@@ -0,0 +1,35 @@
+"""
+Benchmarks of the hot paths, not collected by plain `pytest`, see README
+"""
+from pathlib import Path
+
+import pytest
+from pytest_benchmark.utils import parse_compare_fail
+
+from tests.conftest import *  # noqa: F401,F403 the same database fixtures as the tests
+
+# the committed baseline, a --benchmark-json report of `DB_BACKEND=sqlite pytest benchmarks`
+BENCHMARK_BASELINE = Path(__file__).parent / 'baseline.json'
+# --benchmark-compare fails if a benchmark got slower than the baseline by more than this
+BENCHMARK_REGRESSION_THRESHOLD = 'mean:15%'
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    option = config.option
+    if getattr(option, 'benchmark_disable', False) or getattr(option, 'benchmark_skip', False):
+        return
+    compare = config.getoption('benchmark_compare', None)
+    if compare and not config.getoption('benchmark_compare_fail', None):
+        option.benchmark_compare_fail = [parse_compare_fail(BENCHMARK_REGRESSION_THRESHOLD)]
+    if compare in (None, [], True) and BENCHMARK_BASELINE.exists():
+        # every run is compared with the committed baseline, it fails only with --benchmark-compare:
+        # timings of another machine are just for reference
+        option.benchmark_compare = str(BENCHMARK_BASELINE)
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    # --benchmark-json keeps the time of every round, the baseline needs only the stats
+    if not config.getoption('benchmark_save_data', False):
+        for bench in output_json['benchmarks']:
+            bench['stats'].pop('data', None)
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import i18n
+
+from commands.food_entry_command import parse_food_entries, parse_food_entry_message
+from commands.router import _route, router
+from models import date_now
+from models.core import create_food, create_unit, daily_report_message, define_unit_for_food, food_log_message, \
+    get_or_create_user, log_food
+
+MESSAGES = [
+    'Chicken soup 1.5 bowl',
+    'Yoghurt 3% 200 g',
+    'Egg 1/2',
+    '/weight 70.5',
+    'today',
+    '/cancel',
+    '+Vacation',
+]
+
+
+def test_parse_food_entry_message(benchmark):
+    assert benchmark(parse_food_entry_message, 'Chicken soup 1.5 bowl') == ('Chicken soup', 1.5, 'bowl')
+
+
+def test_parse_food_entries(benchmark):
+    entries = benchmark(parse_food_entries, 'Oatmeal 60 g, milk 200 ml, banana 1')
+    assert len(entries) == 3
+
+
+def test_router_cached(benchmark):
+    benchmark(lambda: [router(message) for message in MESSAGES])
+
+
+def test_router_uncached(benchmark):
+    def route_all():
+        _route.cache_clear()
+        return [router(message) for message in MESSAGES]
+
+    benchmark(route_all)
+
+
+def test_log_food(benchmark, db_session, no_users, no_food, default_units):
+    food = create_food(db_session, i18n.get('locale'), 'Chicken soup', 0.36, 0.012, 0.035, 0.025)
+    unit = create_unit(db_session, i18n.get('locale'), 'bowl')
+    define_unit_for_food(db_session, food, unit, 350, False)
+    user = get_or_create_user(db_session, 12345)
+
+    def log_and_reply():
+        food_log = log_food(db_session, i18n.get('locale'), user, 'Chicken soup', 'bowl', 1)
+        return food_log_message(db_session, food_log)
+
+    assert benchmark(log_and_reply)
+
+
+def test_daily_report_message(benchmark, db_session, no_users, no_food, default_units):
+    create_food(db_session, i18n.get('locale'), 'Apple', 0.52, 0.002, 0.14, 0.003)
+    user = get_or_create_user(db_session, 12345)
+    today = date_now()
+    yesterday = (datetime.strptime(today, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    for _ in range(20):
+        log_food(db_session, i18n.get('locale'), user, 'Apple', 'g', 100, date=yesterday)
+
+    assert benchmark(daily_report_message, db_session, user, today)
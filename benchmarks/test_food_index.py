@@ -0,0 +1,43 @@
+import random
+import string
+from itertools import cycle
+
+import pytest
+
+from models.food_index import FoodNameIndex
+
+INDEX_SIZE = 100000
+
+
+def generate_names(alphabet: str, count: int, rng: random.Random) -> list:
+    """
+    :return: names of 1-3 random words, 3-10 letters each
+    """
+    return [' '.join(''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 10)))
+                     for _ in range(rng.randint(1, 3)))
+            for _ in range(count)]
+
+
+def misspell(name: str, alphabet: str, rng: random.Random) -> str:
+    """
+    :return: name with one letter replaced
+    """
+    i = rng.choice([i for i, c in enumerate(name) if c != ' '])
+    return name[:i] + rng.choice(alphabet) + name[i + 1:]
+
+
+@pytest.mark.parametrize('letters', [26, 20])
+def test_food_name_match(benchmark, letters):
+    """
+    One lookup of a misspelled name in 100k names, fewer letters mean more names per trigram
+    """
+    alphabet = string.ascii_lowercase[:letters]
+    rng = random.Random(1)
+    names = generate_names(alphabet, INDEX_SIZE, rng)
+    index = FoodNameIndex((name, food_id) for food_id, name in enumerate(names))
+    queries = [misspell(rng.choice(names), alphabet, rng) for _ in range(1000)]
+    for query in queries:
+        index.match(query)
+
+    queries = cycle(queries)
+    benchmark(lambda: index.match(next(queries)))
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import i18n
+from sqlalchemy import insert
+
+from jobs.daily_report_job import queue_daily_reports_batch
+from jobs.future_message_job import delete_future_messages, lock_future_messages
+from models import DailyReport, FutureMessage, date_now
+from models.core import create_food, get_or_create_user, log_food
+
+MESSAGES = 500
+USERS = 100
+
+
+def test_future_message_claim(benchmark, db_session, no_users):
+    user = get_or_create_user(db_session, telegram_id='12345')
+
+    def queue():
+        db_session.query(FutureMessage).delete()
+        db_session.execute(insert(FutureMessage), [{
+            'user_id': user.id, 'created_at': datetime(2000, 1, 1), 'expires_at': datetime(2100, 1, 1),
+            'send_at': datetime(2000, 1, 1), 'locked_until': datetime(2000, 1, 1), 'message': str(i),
+        } for i in range(MESSAGES)])
+        db_session.commit()
+
+    def claim_all():
+        claimed = 0
+        while messages := lock_future_messages(db_session):
+            delete_future_messages(db_session, [m[0] for m in messages])
+            claimed += len(messages)
+        return claimed
+
+    assert benchmark.pedantic(claim_all, setup=queue, rounds=5) == MESSAGES
+
+
+def test_daily_report_batch(benchmark, db_session, no_users, no_food, default_units):
+    create_food(db_session, 'en', 'Apple', calories=0.52, fat=0.002, carbs=0.14, protein=0.003)
+    today = date_now()
+    yesterday = (datetime.strptime(today, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    for telegram_id in range(USERS):
+        user = get_or_create_user(db_session, telegram_id=telegram_id + 1)
+        log_food(db_session, i18n.get('locale'), user, 'Apple', 'g', 100, date=yesterday)
+
+    def reset():
+        db_session.query(FutureMessage).delete()
+        db_session.query(DailyReport).update({DailyReport.last_report_date: yesterday})
+        db_session.commit()
+
+    assert benchmark.pedantic(queue_daily_reports_batch, args=(db_session, today), setup=reset, rounds=5) == USERS
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from weight_charts import render_weight_chart
+
+
+@pytest.mark.parametrize('points', [10, 365, 3650])
+def test_render_weight_chart(benchmark, points):
+    now = datetime(2026, 6, 11, 12)
+    weights = [((now - timedelta(days=points - i)).timestamp(), 70 + (i % 30) / 10) for i in range(points)]
+    date_labels = [((now - timedelta(days=20)).date(), 'Vacation')]
+
+    png = benchmark.pedantic(render_weight_chart, args=(weights, date_labels, now), rounds=5, warmup_rounds=1)
+    assert png
+
+
+@pytest.mark.parametrize('points', [1000, 10000, 100000])
+def test_render_dense_weight_chart(benchmark, points):
+    """
+    A year of frequent weigh-ins: lines are downsampled to the figure width, render time stays flat
+    """
+    now = datetime(2026, 6, 11, 12)
+    step = timedelta(days=364) / points
+    weights = [((now - step * (points - i)).timestamp(), 70 + (i % 97) / 50) for i in range(points)]
+
+    png = benchmark.pedantic(render_weight_chart, args=(weights, [], now), rounds=5, warmup_rounds=1)
+    assert png
@@ -0,0 +1,61 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', '256'))
+CHART_CACHE_MAX_BYTES = int(os.getenv('CHART_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+
+class ChartCache:
+    """
+    LRU cache of rendered charts. An entry keeps PNG bytes until the chart is uploaded,
+    then only Telegram file_id, which is enough to send the same chart again
+    """
+
+    def __init__(self, max_size: int = CHART_CACHE_SIZE, max_bytes: int = CHART_CACHE_MAX_BYTES):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()  # key: {'png': bytes or None, 'file_id': str or None}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key) -> Optional[dict]:
+        """
+        :param key:
+        :return: copy of the entry {png, file_id} or None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return dict(entry)
+
+    def put(self, key, png: bytes = None, file_id: str = None) -> None:
+        if png is None and file_id is None:
+            return
+        with self.lock:
+            self._remove(key)
+            if file_id is not None:
+                png = None
+            self.entries[key] = {'png': png, 'file_id': file_id}
+            self.total_bytes += len(png or b'')
+            while self.entries and (len(self.entries) > self.max_size or self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, key) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= len(entry['png'] or b'')
+
+
+weight_chart_cache = ChartCache()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from exc import ChartRendererBusy
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# fewer weigh-ins than this in a year: no chart
+MIN_CHART_POINTS = 2
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+# charts rendering or waiting for a worker; new requests above this are rejected
+CHART_QUEUE_LIMIT = int(os.getenv('CHART_QUEUE_LIMIT', '8'))
+
+_executor = None
+_slots = asyncio.Semaphore(CHART_QUEUE_LIMIT)
+_in_flight = 0
+
+
+def _init_worker():
+    """
+    Import the chart stack once per worker process instead of once per chart
+    :return:
+    """
+    import weight_charts  # noqa: F401
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _render_weight_chart(weights, date_labels, current_time):
+    from weight_charts import render_weight_chart as render
+    return render(weights, date_labels, current_time)
+
+
+def get_chart_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: don't inherit database connections and threads of the bot process
+        _executor = ProcessPoolExecutor(max_workers=CHART_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker)
+    return _executor
+
+
+async def start_chart_renderer() -> None:
+    """
+    Start worker processes in advance, so the first weigh-in doesn't pay for it
+    :return:
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_chart_executor()
+    pids = await asyncio.gather(*[loop.run_in_executor(executor, _warm_up) for _ in range(CHART_WORKERS)])
+    logger.info("Chart renderer started, workers: {}".format(sorted(set(pids))))
+
+
+def stop_chart_renderer() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def render_weight_chart(chart_data: dict, wait: bool = False) -> Optional[bytes]:
+    """
+    Render weight chart in the worker pool
+    :param chart_data: see get_user_weight_chart_data
+    :param wait: wait for a free slot instead of failing when the pool is saturated
+    :return: PNG image bytes or None if there is nothing to draw
+    :raises: ChartRendererBusy if the pool is saturated and wait is False
+    """
+    global _in_flight
+    if not wait and _slots.locked():
+        metrics.inc('charts_rejected_total')
+        raise ChartRendererBusy
+    _in_flight += 1
+    started_at = time.monotonic()
+    try:
+        async with _slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                get_chart_executor(), _render_weight_chart,
+                chart_data['weights'], chart_data['date_labels'], chart_data['current_time'])
+    finally:
+        _in_flight -= 1
+        metrics.observe('chart_render_seconds', time.monotonic() - started_at)
+
+
+def stats() -> dict:
+    """
+    :return: charts rendering or waiting for a worker right now, limits
+    """
+    return {
+        'in_flight': _in_flight,
+        'queue_limit': CHART_QUEUE_LIMIT,
+        'workers': CHART_WORKERS,
+    }
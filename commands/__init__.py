@@ -8,6 +8,7 @@ from commands.weight_entry_command import weight_entry_command
 from commands.date_label_command import date_label_command
 from commands.settings_command import settings_command
 from commands.cancel_command import cancel_command
+from commands.botstats_command import botstats_command
 
 __all__ = [
     "help_command",
@@ -20,4 +21,5 @@ __all__ = [
     "date_label_command",
     "settings_command",
     "cancel_command",
+    "botstats_command",
 ]
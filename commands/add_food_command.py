@@ -4,14 +4,15 @@ import shlex
 
 import i18n
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from commands.food_entry_command import food_entry
-from db import db_engine
+from commands.common import run_user_command
 from models import FoodRequest, User
-from models.core import get_food_by_name, create_food, define_unit_for_food, get_gram_unit, get_or_create_user
+from models.core import get_food_by_name, create_food, define_unit_for_food, get_gram_unit, get_or_create_user, \
+    update_food
 from argumentparser import ArgumentParser
 
 logger = logging.getLogger(__name__)
@@ -95,12 +96,11 @@ def add_food(db_session: Session, user: User, input_message: str) -> dict:
                 return messages
         return {user_tid: i18n.t('Food added')}
     else:
-        food.calories = params['calories'] / 100
-        food.fat = params['fat'] / 100
-        food.carbs = params['carbs'] / 100
-        food.protein = params['protein'] / 100
-        db_session.add(food)
-        db_session.commit()
+        update_food(db_session, food,
+                    calories=params['calories'] / 100,
+                    fat=params['fat'] / 100,
+                    carbs=params['carbs'] / 100,
+                    protein=params['protein'] / 100)
         return {user_tid: i18n.t('Food updated')}
 
 
@@ -115,15 +115,13 @@ async def add_food_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     :param context:
     :return:
     """
-    db_session = sessionmaker(bind=db_engine)()
     from_user = update.message.from_user
 
     info = "{} {}: {}".format(from_user.id, from_user.username, update.message.text)
     logger.info(info)
 
-    user = get_or_create_user(db_session, from_user.id)
-    if user is None:
+    messages = await run_user_command(from_user.id, add_food, update.message.text)
+    if messages is None:
         return
-    messages = add_food(db_session, user, update.message.text)
     for tid in messages.keys():
         await context.bot.send_message(tid, messages[tid])
@@ -5,12 +5,12 @@ import shlex
 
 import i18n
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from commands.food_entry_command import food_entry
-from db import db_engine
+from commands.common import run_user_command
 from exc import FoodNotFound
 from models import UnitName, Unit, FoodName, Food, FoodUnit, FoodRequest, User
 from models.core import log_food, get_food_by_name, create_food, define_unit_for_food, get_gram_unit, \
@@ -75,15 +75,13 @@ async def add_unit_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     :param context:
     :return:
     """
-    db_session = sessionmaker(bind=db_engine)()
     from_user = update.message.from_user
 
     info = "{} {}: {}".format(from_user.id, from_user.username, update.message.text)
     logger.info(info)
 
-    user = get_or_create_user(db_session, from_user.id)
-    if user is None:
+    messages = await run_user_command(from_user.id, add_unit, update.message.text)
+    if messages is None:
         return
-    messages = add_unit(db_session, user, update.message.text)
     for tid in messages.keys():
         await context.bot.send_message(tid, messages[tid])
@@ -0,0 +1,97 @@
+import logging
+import os
+
+import i18n
+from sqlalchemy.orm import Session
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from commands.common import run_user_command
+from jobs.metrics_job import update_queue_stats
+from metrics import metrics
+from models import User
+
+logger = logging.getLogger(__name__)
+
+
+def format_latency(histogram) -> str:
+    """
+    :param histogram: metrics.Histogram
+    :return: count and mean latency
+    """
+    return '{} × {:.0f} ms'.format(histogram.count, histogram.sum / histogram.count * 1000)
+
+
+def format_bot_stats(samples: list) -> str:
+    """
+    :param samples: see Metrics.collect
+    :return: summary for the owner
+    """
+    values = {}
+    histograms = {}
+    for name, metric_type, labels, value in samples:
+        if metric_type == 'histogram':
+            histograms.setdefault(name, {})[dict(labels).get('handler') or dict(labels).get('job')] = value
+        else:
+            values[(name, tuple(labels))] = value
+
+    def value(name, **labels):
+        return values.get((name, tuple(sorted(labels.items()))), 0)
+
+    lines = ['Handlers:']
+    for handler, histogram in sorted(histograms.get('handler_seconds', {}).items()):
+        lines.append('  {}: {}, errors: {}'.format(handler, format_latency(histogram),
+                                                   value('handler_errors_total', handler=handler)))
+    lines.append('Jobs:')
+    for job, histogram in sorted(histograms.get('job_seconds', {}).items()):
+        lines.append('  {}: {}, errors: {}'.format(job, format_latency(histogram),
+                                                   value('job_errors_total', job=job)))
+    lines.extend([
+        'Future messages due: {}, oldest: {:.0f} s'.format(
+            value('future_message_backlog'), value('future_message_oldest_seconds')),
+        'Daily reports due: {}, lag: {} days'.format(value('daily_report_due_users'), value('daily_report_lag_days')),
+        'Messages sent: {}, failed: {}, dropped: {}, retried: {}'.format(
+            value('messages_sent_total'), value('messages_failed_total'),
+            value('messages_dropped_total'), value('messages_retried_total')),
+        'DB pool: {}/{} checked out, overflow: {}, timeouts: {}, max wait: {:.2f} s'.format(
+            value('db_pool_checked_out'), value('db_pool_size'), value('db_pool_overflow'),
+            value('db_pool_timeouts_total'), value('db_pool_max_wait_seconds')),
+        'Charts: {}/{} in flight, rejected: {}{}'.format(
+            value('charts_in_flight'), value('chart_queue_limit'), value('charts_rejected_total'),
+            ', rendered: ' + format_latency(histograms['chart_render_seconds'][None])
+            if 'chart_render_seconds' in histograms else ''),
+        'Caches: {} charts ({} KB), {} users'.format(
+            value('chart_cache_entries'), value('chart_cache_bytes') // 1024, value('user_cache_entries')),
+    ])
+    return '\n'.join(lines)
+
+
+def botstats(db_session: Session, user: User, input_message: str) -> dict:
+    """
+    :param db_session:
+    :param user:
+    :param input_message:
+    :return: dictionary {telegram_id: message}
+    """
+    user_tid = str(user.telegram_id)
+    owner_tid = os.getenv('OWNER_TELEGRAM_ID')
+    if user_tid != owner_tid:
+        return {user_tid: i18n.t('Invalid user id')}
+
+    update_queue_stats(db_session)
+    return {user_tid: format_bot_stats(metrics.collect())}
+
+
+async def botstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Performance summary (only for owner), the same as the metrics exporter shows
+    :param update:
+    :param context:
+    :return:
+    """
+    from_user = update.message.from_user
+    messages = await run_user_command(from_user.id, botstats, update.message.text)
+    if messages is None:
+        return
+    for tid, message in messages.items():
+        await context.bot.send_message(tid, message)
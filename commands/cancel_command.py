@@ -2,39 +2,48 @@ import logging
 import os
 import re
 import time
+from functools import lru_cache
 
 import i18n
 from sqlalchemy import desc
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from db import db_engine
+from commands.common import run_user_command
+from jobs.owner_digest_job import notify_owner
 from exc import FoodNotFound, UnitNotFound, UnitNotDefined
 from models import FoodRequest, User, WeightLog, CommandLog, FoodLog
-from models.core import get_or_create_user, log_food, food_log_message
+from models.core import update_daily_total
 
 logger = logging.getLogger(__name__)
 
 
-def get_cancel_pattern():
+def get_cancel_pattern(locale: str = None):
     """
-    This depends on locale
+    This depends on locale, compiled once per locale
+    :param locale: default: current locale
     :return:
     """
-    return re.compile('^(/cancel|{})$'.format(i18n.t('cancel')), re.I)
+    return _compile_cancel_pattern(locale or i18n.get('locale'))
 
 
-def cancel(db_session: Session, user: User, input_message: str) -> dict:
+@lru_cache(maxsize=None)
+def _compile_cancel_pattern(locale: str):
+    return re.compile('^(/cancel|{})$'.format(i18n.t('cancel', locale=locale)), re.I)
+
+
+def cancel(db_session: Session, user: User, input_message: str, match: re.Match = None) -> dict:
     """
     :param db_session:
     :param user:
     :param input_message:
+    :param match: input_message already matched against cancel pattern (see router)
     :return: dictionary {telegram_id: message}
     """
     user_tid = str(user.telegram_id)
     owner_tid = os.getenv('OWNER_TELEGRAM_ID')
-    m = get_cancel_pattern().match(input_message)
+    m = match or get_cancel_pattern().match(input_message)
     invalid_reply = {user_tid: i18n.t('I don\'t understand')}
     if not m:
         return invalid_reply
@@ -44,15 +53,20 @@ def cancel(db_session: Session, user: User, input_message: str) -> dict:
         return {user_tid: i18n.t('Nothing to cancel')}
 
     if command_log.command_type == CommandLog.FOOD_ENTRY:
+        # a message with several foods logged all of them
         entry = db_session.query(FoodLog).filter_by(
-            user_id=user.id).order_by(desc('id')).first()
+            user_id=user.id, command_log_id=command_log.id).all()
     elif command_log.command_type == CommandLog.WEIGHT_ENTRY:
         entry = db_session.query(WeightLog).filter_by(
             user_id=user.id).order_by(desc('id')).first()
     else:
         return {user_tid: i18n.t('Invalid command type')}
 
-    if entry:
+    if isinstance(entry, list):
+        update_daily_total(db_session, entry, sign=-1)
+        for food_log in entry:
+            db_session.delete(food_log)
+    elif entry:
         db_session.delete(entry)
 
     db_session.delete(command_log)
@@ -68,17 +82,14 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     :param context:
     :return:
     """
-    db_session = sessionmaker(bind=db_engine)()
     from_user = update.message.from_user
-    owner_tid = os.getenv('OWNER_TELEGRAM_ID')
 
     info = "{} {}: {}".format(from_user.id, from_user.username, update.message.text)
     logger.info(info)
-    await context.bot.send_message(owner_tid, info)
+    notify_owner(context, info)
 
-    user = get_or_create_user(db_session, from_user.id)
-    if user is None:
+    messages = await run_user_command(from_user.id, cancel, update.message.text, context.match)
+    if messages is None:
         return
-    messages = cancel(db_session, user, update.message.text)
     for tid in messages.keys():
         await context.bot.send_message(tid, messages[tid])
@@ -0,0 +1,29 @@
+from sqlalchemy.orm import Session
+
+from db import run_in_db_session
+from models.core import get_cached_user
+
+
+def call_user_command(db_session: Session, telegram_id, func, *args):
+    """
+    Find (or create) the user and call func(db_session, user, *args). The user is a cached
+    copy (see get_cached_user) with id, telegram_id and profile
+    :param db_session:
+    :param telegram_id:
+    :param func:
+    :return: func result or None if there is no such user and new users are not allowed
+    """
+    user = get_cached_user(db_session, telegram_id)
+    if user is None:
+        return None
+    return func(db_session, user, *args)
+
+
+async def run_user_command(telegram_id, func, *args):
+    """
+    Run blocking user command off the event loop, see call_user_command
+    :param telegram_id:
+    :param func:
+    :return:
+    """
+    return await run_in_db_session(call_user_command, telegram_id, func, *args)
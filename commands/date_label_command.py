@@ -6,14 +6,14 @@ from datetime import datetime
 
 import i18n
 from sqlalchemy import desc
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import Session
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from commands.weight_entry_command import create_user_weight_chart
-from db import db_engine
+from commands.weight_entry_command import get_user_weight_chart_data, send_weight_replies
+from commands.common import run_user_command
+from jobs.owner_digest_job import notify_owner
 from models import DateLabel, User
-from models.core import get_or_create_user
 
 logger = logging.getLogger(__name__)
 
@@ -21,27 +21,32 @@ DATE_FORMAT = '%Y-%m-%d'
 MAX_LABEL_LENGTH = 32
 
 
+ADD_DATE_LABEL_PATTERN = re.compile(
+    '^/(label|date_label|add_label|add_date_label)'
+    '\\s+(\\d{4}-\\d{2}-\\d{2})\\s+(.+)$',
+    re.I,
+)
+REMOVE_DATE_LABEL_PATTERN = re.compile(
+    '^/(unlabel|remove_label|remove_date_label|delete_label)'
+    '\\s+(\\d{4}-\\d{2}-\\d{2})\\s*$',
+    re.I,
+)
+DATE_LABEL_PATTERN = re.compile(
+    '^/(label|date_label|add_label|add_date_label|unlabel|remove_label|remove_date_label|delete_label)\\b',
+    re.I,
+)
+
+
 def get_add_date_label_pattern():
-    return re.compile(
-        '^/(label|date_label|add_label|add_date_label)'
-        '\\s+(\\d{4}-\\d{2}-\\d{2})\\s+(.+)$',
-        re.I,
-    )
+    return ADD_DATE_LABEL_PATTERN
 
 
 def get_remove_date_label_pattern():
-    return re.compile(
-        '^/(unlabel|remove_label|remove_date_label|delete_label)'
-        '\\s+(\\d{4}-\\d{2}-\\d{2})\\s*$',
-        re.I,
-    )
+    return REMOVE_DATE_LABEL_PATTERN
 
 
 def get_date_label_pattern():
-    return re.compile(
-        '^/(label|date_label|add_label|add_date_label|unlabel|remove_label|remove_date_label|delete_label)\\b',
-        re.I,
-    )
+    return DATE_LABEL_PATTERN
 
 
 def parse_label_date(date_string):
@@ -56,10 +61,10 @@ def date_label_replies(db_session: Session, user: User, message: str) -> dict:
         owner_tid: {'message': message},
     }
 
-    plot_filename = create_user_weight_chart(db_session, user)
-    if plot_filename:
-        replies[user_tid]['plot_file'] = plot_filename
-        replies[owner_tid]['plot_file'] = plot_filename
+    chart_data = get_user_weight_chart_data(db_session, user)
+    if chart_data:
+        replies[user_tid]['chart'] = chart_data
+        replies[owner_tid]['chart'] = chart_data
 
     return replies
 
@@ -150,21 +155,13 @@ def date_label(db_session: Session, user: User, input_message: str) -> dict:
 
 
 async def date_label_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    db_session = sessionmaker(bind=db_engine)()
     from_user = update.message.from_user
-    owner_tid = os.getenv('OWNER_TELEGRAM_ID')
 
     info = "{} {}: {}".format(from_user.id, from_user.username, update.message.text)
     logger.info(info)
-    await context.bot.send_message(owner_tid, info)
+    notify_owner(context, info)
 
-    user = get_or_create_user(db_session, from_user.id)
-    if user is None:
+    messages = await run_user_command(from_user.id, date_label, update.message.text)
+    if messages is None:
         return
-
-    messages = date_label(db_session, user, update.message.text)
-    for tid in messages.keys():
-        await context.bot.send_message(tid, messages[tid]['message'])
-        if 'plot_file' in messages[tid]:
-            with open(messages[tid]['plot_file'], 'rb') as f:
-                await context.bot.send_photo(tid, f)
+    await send_weight_replies(context, messages)
@@ -4,12 +4,12 @@ import shlex
 
 import i18n
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from commands.food_entry_command import food_entry
-from db import db_engine
+from commands.common import run_user_command
 from models import FoodRequest, User, FoodUnit
 from models.core import get_food_by_name, define_unit_for_food, get_gram_unit, get_or_create_user, \
     get_unit_by_name
@@ -100,15 +100,13 @@ async def define_unit_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     :param context:
     :return:
     """
-    db_session = sessionmaker(bind=db_engine)()
     from_user = update.message.from_user
 
     info = "{} {}: {}".format(from_user.id, from_user.username, update.message.text)
     logger.info(info)
 
-    user = get_or_create_user(db_session, from_user.id)
-    if user is None:
+    messages = await run_user_command(from_user.id, define_unit, update.message.text)
+    if messages is None:
         return
-    messages = define_unit(db_session, user, update.message.text)
     for tid in messages.keys():
         await context.bot.send_message(tid, messages[tid])
@@ -5,18 +5,24 @@ from typing import Tuple
 
 import i18n
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import sessionmaker, Session
-from telegram import Update
+from sqlalchemy.orm import Session
+from telegram import ReplyKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
-from db import db_engine
+from commands.common import run_user_command
+from jobs.owner_digest_job import notify_owner
 from exc import FoodNotFound, UnitNotFound, UnitNotDefined
 from models import FoodRequest, User, CommandLog
-from models.core import get_or_create_user, log_food, food_log_message, get_unit_by_name
+from models.catalog import get_food_catalog
+from models.core import log_foods, food_logs_message, get_unit_by_name
+from models.food_index import is_confident_match
 
 logger = logging.getLogger(__name__)
 
 FOOD_ENTRY_PATTERN = re.compile('^(.+?)(\\s+([0-9.,/]+)(\\s?[^%]+)?)?\\s*$')
+# foods in one message are separated by ; or new lines, or by a comma and a name after a quantity
+FOOD_ENTRIES_SEPARATOR_PATTERN = re.compile('[;\\n]')
+FOOD_ENTRIES_COMMA_PATTERN = re.compile(',\\s+(?=[^\\W\\d_])')
 
 
 def parse_food_entry_message(message: str) -> tuple([str, float, str]):
@@ -54,46 +60,140 @@ def parse_food_entry_message(message: str) -> tuple([str, float, str]):
     return food_name, qty, unit_name
 
 
+def parse_food_entries(message: str) -> list:
+    """
+    "Oatmeal 60 g, milk 200 ml, banana 1" is three foods, "Bread, white 1 slice" is one
+    :param message:
+    :return: list of (food_name, qty, unit_name), see parse_food_entry_message
+    """
+    segments = []
+    for part in FOOD_ENTRIES_SEPARATOR_PATTERN.split(message):
+        segment = None
+        for piece in FOOD_ENTRIES_COMMA_PATTERN.split(part):
+            if segment is None:
+                segment = piece
+                continue
+            m = FOOD_ENTRY_PATTERN.match(segment)
+            if m and m.group(3) is not None:
+                segments.append(segment)
+                segment = piece
+            else:
+                segment = ', '.join([segment, piece])
+        segments.append(segment)
+
+    entries = [parse_food_entry_message(segment) for segment in segments]
+    return [entry for entry in entries if entry[0] is not None]
+
+
+def format_food_entry(food_name: str, qty: float, unit_name: str) -> str:
+    return ' '.join([food_name, '{:g}'.format(qty)] + ([unit_name] if unit_name else []))
+
+
+def food_not_found_replies(db_session: Session, user: User, input_message: str,
+                           food_name: str, qty: float, unit_name: str, matches: list) -> Tuple[dict, list]:
+    """
+    Forward the food request to the owner, suggest similar foods to the user
+    :param db_session:
+    :param user:
+    :param input_message:
+    :param food_name:
+    :param qty:
+    :param unit_name:
+    :param matches: list of FoodMatch
+    :return: dictionary {telegram_id: message} and suggestions, each is a food entry message to send
+    """
+    user_tid = str(user.telegram_id)
+    owner_tid = os.getenv('OWNER_TELEGRAM_ID')
+    food_request = FoodRequest(user_id=user.id, request=input_message)
+    db_session.add(food_request)
+    db_session.commit()
+    owner_message = [
+        i18n.t('Please add new food (values per 100 g)'),
+        '/add_food "{}" --calories=0.0 --fat=0.0 --carbs=0.0 --protein=0.0 --request={}'.format(
+            food_name, food_request.id),
+    ]
+    try:
+        get_unit_by_name(db_session, i18n.get('locale'), unit_name)
+    except NoResultFound:
+        owner_message.extend([
+            i18n.t('or (if default unit is different from grams)'),
+            '/add_food "{}" --calories=0.0 --fat=0.0 --carbs=0.0 --protein=0.0'.format(food_name),
+            '/add_unit "{}"'.format(unit_name),
+            '/define_unit "{}" "{}" --grams=100 --default=true --request={}'.format(
+                food_name, unit_name, food_request.id),
+        ])
+
+    user_message = i18n.t('The food was not found, forwarding request to the owner')
+    if matches:
+        user_message = '\n'.join([user_message, i18n.t('Did you mean one of these?')])
+    return {
+        user_tid: user_message,
+        owner_tid: '\n'.join(owner_message),
+    }, [format_food_entry(m.name, qty, unit_name) for m in matches]
+
+
 def food_entry(db_session: Session, user: User, input_message: str) -> dict:
     """
+    Log one or several foods, see food_entry_replies. Suggestions are listed in the user's message
     :param db_session:
     :param user:
     :param input_message:
     :return: dictionary {telegram_id: message}
     """
+    messages, suggestions = food_entry_replies(db_session, user, input_message)
+    if suggestions:
+        user_tid = str(user.telegram_id)
+        messages[user_tid] = '\n'.join([messages[user_tid]] + suggestions)
+    return messages
+
+
+def food_entry_replies(db_session: Session, user: User, input_message: str) -> Tuple[dict, list]:
+    """
+    Log one or several foods, see parse_food_entries. Nothing is logged if one of them isn't found
+    :param db_session:
+    :param user:
+    :param input_message:
+    :return: dictionary {telegram_id: message} and suggestions for the user, see food_not_found_replies
+    """
     user_tid = str(user.telegram_id)
     owner_tid = os.getenv('OWNER_TELEGRAM_ID')
-    food_name, qty, unit_name = parse_food_entry_message(input_message)
-    if food_name is None:
-        return {user_tid: i18n.t('I don\'t understand')}
+    entries = parse_food_entries(input_message)
+    if not entries:
+        return {user_tid: i18n.t('I don\'t understand')}, []
 
-    try:
-        food_log = log_food(db_session, i18n.get('locale'), user, food_name, unit_name, qty)
-    except FoodNotFound:
-        food_request = FoodRequest(user_id=user.id, request=input_message)
-        db_session.add(food_request)
-        db_session.commit()
-        owner_message = [
-            i18n.t('Please add new food (values per 100 g)'),
-            '/add_food "{}" --calories=0.0 --fat=0.0 --carbs=0.0 --protein=0.0 --request={}'.format(
-                food_name, food_request.id),
-        ]
+    locale = i18n.get('locale')
+    catalog = get_food_catalog(db_session)
+    matched_food_names = []
+    for i, (food_name, qty, unit_name) in enumerate(entries):
         try:
-            get_unit_by_name(db_session, i18n.get('locale'), unit_name)
+            catalog.get_food(locale, food_name)
         except NoResultFound:
-            owner_message.extend([
-                i18n.t('or (if default unit is different from grams)'),
-                '/add_food "{}" --calories=0.0 --fat=0.0 --carbs=0.0 --protein=0.0'.format(food_name),
-                '/add_unit "{}"'.format(unit_name),
-                '/define_unit "{}" "{}" --grams=100 --default=true --request={}'.format(
-                    food_name, unit_name, food_request.id),
-            ])
+            # typo or inflection? use the similar food if there is only one, otherwise ask
+            matches = catalog.match_food(locale, food_name)
+            if not is_confident_match(matches):
+                replies, suggestions = food_not_found_replies(db_session, user, input_message,
+                                                              food_name, qty, unit_name, matches)
+                if len(entries) > 1:
+                    # suggest the whole message with this food replaced
+                    suggestions = [
+                        ', '.join(format_food_entry(*entry) for entry in
+                                  entries[:i] + [(m.name, qty, unit_name)] + entries[i + 1:])
+                        for m in matches]
+                return replies, suggestions
+            matched_food_names.append(matches[0].name)
+            entries[i] = (matches[0].name, qty, unit_name)
 
-        return {
-            user_tid: i18n.t('The food was not found, forwarding request to the owner'),
-            owner_tid: '\n'.join(owner_message),
-        }
-    except UnitNotFound:
+    command_log = CommandLog(user_id=user.id, command_type=CommandLog.FOOD_ENTRY,
+                             command=input_message)
+    try:
+        food_logs = log_foods(db_session, locale, user,
+                              [(food_name, unit_name, qty) for food_name, qty, unit_name in entries],
+                              command_log=command_log)
+    except FoodNotFound as e:
+        food_name, qty, unit_name = next(entry for entry in entries if entry[0] == e.args[0])
+        return food_not_found_replies(db_session, user, input_message, food_name, qty, unit_name, [])
+    except UnitNotFound as e:
+        food_name, unit_name = e.args
         food_request = FoodRequest(user_id=user.id, request=input_message)
         db_session.add(food_request)
         db_session.commit()
@@ -106,8 +206,9 @@ def food_entry(db_session: Session, user: User, input_message: str) -> dict:
         return {
             user_tid: i18n.t('The food was not found, forwarding request to the owner'),
             owner_tid: '\n'.join(owner_message),
-        }
-    except UnitNotDefined:
+        }, []
+    except UnitNotDefined as e:
+        food_name, unit_name = e.args
         food_request = FoodRequest(user_id=user.id, request=input_message)
         db_session.add(food_request)
         db_session.commit()
@@ -119,22 +220,17 @@ def food_entry(db_session: Session, user: User, input_message: str) -> dict:
         return {
             user_tid: i18n.t('The food was not found, forwarding request to the owner'),
             owner_tid: '\n'.join(owner_message),
-        }
+        }, []
 
-    command_log = CommandLog(user_id=user.id, command_type=CommandLog.FOOD_ENTRY,
-                             command=input_message)
-    db_session.add(command_log)
-    db_session.commit()
-
-    message_lines = [
-        i18n.t('Food added'),
-        food_log_message(db_session, food_log),
-    ]
+    message_lines = [i18n.t('Food added')]
+    for matched_food_name in matched_food_names:
+        message_lines.append(i18n.t('Recognized as: %{name}', name=matched_food_name))
+    message_lines.append(food_logs_message(db_session, food_logs))
     message = '\n'.join(message_lines)
     return {
         user_tid: message,
         owner_tid: message,
-    }
+    }, []
 
 
 async def food_entry_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -144,18 +240,22 @@ async def food_entry_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     :param context:
     :return:
     """
-    db_session = sessionmaker(bind=db_engine)()
     from_user = update.message.from_user
-    owner_tid = os.getenv('OWNER_TELEGRAM_ID')
 
     info = "{} {}: {}".format(from_user.id, from_user.username, update.message.text)
     logger.info(info)
-    await context.bot.send_message(owner_tid, info)
+    notify_owner(context, info)
 
-    user = get_or_create_user(db_session, from_user.id)
-    if user is None:
+    replies = await run_user_command(from_user.id, food_entry_replies, update.message.text)
+    if replies is None:
         logger.info("User not found, new users disabled?")
         return
-    messages = food_entry(db_session, user, update.message.text)
-    for tid in messages.keys():
-        await context.bot.send_message(tid, messages[tid])
+    messages, suggestions = replies
+    user_tid = str(from_user.id)
+    for tid, message in messages.items():
+        if tid == user_tid and suggestions:
+            keyboard = ReplyKeyboardMarkup([[s] for s in suggestions],
+                                           one_time_keyboard=True, resize_keyboard=True)
+            await context.bot.send_message(tid, message, reply_markup=keyboard)
+        else:
+            await context.bot.send_message(tid, message)
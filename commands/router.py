@@ -1,12 +1,73 @@
+import os
 import re
+from functools import lru_cache
+from typing import Optional, Tuple
 
 import i18n
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from commands import weight_entry_command, food_entry_command, today_command, cancel_command, date_label_command
+from commands.cancel_command import get_cancel_pattern
 from commands.date_label_command import get_date_label_pattern
 from commands.weight_entry_command import get_weight_entry_pattern
+from metrics import observe_handler
+
+ROUTE_CACHE_SIZE = int(os.getenv('ROUTE_CACHE_SIZE', '1024'))
+
+
+class MessageRouter:
+    """
+    Dispatch table of one locale: translated keywords and compiled patterns
+    """
+
+    def __init__(self, locale: str):
+        self.locale = locale
+        self.keywords = {
+            '/today': today_command,
+            i18n.t('today', locale=locale).lower(): today_command,
+        }
+        # (pattern, handler, pass the match to the handler)
+        self.patterns = [
+            (get_cancel_pattern(locale), cancel_command, True),
+            (get_date_label_pattern(), date_label_command, False),
+            (get_weight_entry_pattern(locale), weight_entry_command, True),
+        ]
+
+    def route(self, message: str) -> Tuple[callable, Optional[re.Match]]:
+        """
+        Choose command handler based on message content
+        :param message:
+        :return: handler and the match of its pattern to pass to it (or None)
+        """
+        message = message.strip()
+        handler = self.keywords.get(message.lower())
+        if handler is not None:
+            return handler, None
+        for pattern, handler, pass_match in self.patterns:
+            m = pattern.match(message)
+            if m:
+                return handler, m if pass_match else None
+        return food_entry_command, None
+
+
+@lru_cache(maxsize=None)
+def get_message_router(locale: str) -> MessageRouter:
+    return MessageRouter(locale)
+
+
+@lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def _route(locale: str, message: str) -> Tuple[callable, Optional[re.Match]]:
+    return get_message_router(locale).route(message)
+
+
+def route(message: str) -> Tuple[callable, Optional[re.Match]]:
+    """
+    Classify and pre-parse the message for the current locale, see MessageRouter.route
+    :param message:
+    :return:
+    """
+    return _route(i18n.get('locale'), message)
 
 
 def router(command: str):
@@ -15,18 +76,11 @@ def router(command: str):
     :param command:
     :return:
     """
-    command = command.strip().lower()
-    if command in ['/today', i18n.t('today')]:
-        return today_command
-    if command in ['/cancel', i18n.t('cancel')]:
-        return cancel_command
-    if get_date_label_pattern().match(command):
-        return date_label_command
-    if get_weight_entry_pattern().match(command):
-        return weight_entry_command
-    return food_entry_command
+    return route(command)[0]
 
 
 async def router_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    func = router(update.message.text)
-    return await func(update, context)
+    func, match = route(update.message.text)
+    context.matches = [match] if match else None
+    # recorded as the command the message was routed to
+    return await observe_handler(func.__name__, func(update, context))
@@ -1,17 +1,18 @@
 import i18n
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from db import db_engine
-from models.core import get_or_create_user
+from commands.common import run_user_command
+from models import User
 
 
-async def settings_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-    db_session = sessionmaker(bind=db_engine)()
-    user = get_or_create_user(db_session, update.message.from_user.id)
-    if user is None:
-        return
+def settings(db_session: Session, user: User) -> str:
+    """
+    :param db_session:
+    :param user:
+    :return: settings message
+    """
     profile = user.profile
     strings = [
         i18n.t('Daily goal:'),
@@ -25,4 +26,11 @@ async def settings_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None
             profile.daily_carbs,
             profile.daily_protein),
     ]
-    update.message.reply_text("\n".join(strings))
+    return "\n".join(strings)
+
+
+async def settings_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+    message = await run_user_command(update.message.from_user.id, settings)
+    if message is None:
+        return
+    await update.message.reply_text(message)
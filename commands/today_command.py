@@ -1,24 +1,29 @@
 from datetime import datetime
 
 import i18n
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from db import db_engine
-from models import date_now, FoodLog
-from models.core import get_or_create_user, get_food_name, get_unit_name
+from commands.common import run_user_command
+from models import date_now, FoodLog, User
+from models.catalog import get_food_catalog
+from models.core import get_daily_total
 
 
-def today_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-    db_session = sessionmaker(bind=db_engine)()
+def today(db_session: Session, user: User) -> str:
+    """
+    :param db_session:
+    :param user:
+    :return: today statistics message
+    """
     strings = []
-    user = get_or_create_user(db_session, update.message.from_user.id)
-    if user is None:
-        return
     profile = user.profile
-    food_logs = db_session.query(FoodLog) \
-        .filter_by(user_id=user.id, date=date_now()) \
+    today_date = date_now()
+    food_logs = db_session.query(
+        FoodLog.created_at, FoodLog.food_id, FoodLog.unit_id, FoodLog.qty,
+        FoodLog.calories, FoodLog.fat, FoodLog.carbs, FoodLog.protein
+    ).filter_by(user_id=user.id, date=today_date) \
         .order_by(FoodLog.created_at) \
         .all()
     if len(food_logs) == 0:
@@ -32,14 +37,12 @@ def today_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
             i18n.t('Carbs'),
             i18n.t('Protein')))
 
-    calories_left = profile.daily_calories
-    fat_left = profile.daily_fat
-    carbs_left = profile.daily_carbs
-    protein_left = profile.daily_protein
+    # names come from the in-memory catalog, so the entries are one query however many there are
+    catalog = get_food_catalog(db_session)
+    locale = i18n.get('locale')
     for fl in food_logs:
-        food = fl.food
-        food_name = get_food_name(db_session, food)
-        unit_name = get_unit_name(db_session, fl.unit)
+        food_name = catalog.get_food_name(fl.food_id, locale)
+        unit_name = catalog.get_unit_name(fl.unit_id, locale)
         strings.append('{} | {} {:.1f} {} | {:.0f} | {:.2f} | {:.2f} | {:.2f}'.format(
             datetime.utcfromtimestamp(fl.created_at).strftime('%H:%M'),
             food_name,
@@ -49,10 +52,17 @@ def today_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
             fl.fat,
             fl.carbs,
             fl.protein))
-        calories_left -= fl.calories
-        fat_left -= fl.fat
-        carbs_left -= fl.carbs
-        protein_left -= fl.protein
+
+    calories_left = profile.daily_calories
+    fat_left = profile.daily_fat
+    carbs_left = profile.daily_carbs
+    protein_left = profile.daily_protein
+    totals = get_daily_total(db_session, user.id, today_date)
+    if totals is not None:
+        calories_left -= totals.calories
+        fat_left -= totals.fat
+        carbs_left -= totals.carbs
+        protein_left -= totals.protein
 
     strings.append('')
 
@@ -67,4 +77,11 @@ def today_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
         fat_left,
         carbs_left,
         protein_left))
-    update.message.reply_text("\n".join(strings))
+    return "\n".join(strings)
+
+
+async def today_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+    message = await run_user_command(update.message.from_user.id, today)
+    if message is None:
+        return
+    await update.message.reply_text(message)
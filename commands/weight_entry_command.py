@@ -3,78 +3,104 @@ import os
 import re
 import time
 from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional
 
 import i18n
-from sqlalchemy import desc, asc
-from sqlalchemy.orm import sessionmaker, Session
-from telegram import Update
+from sqlalchemy import desc, asc, func
+from sqlalchemy.orm import Session
+from telegram import Bot, Update
 from telegram.ext import ContextTypes
 
-import pandas as pd
-
-from db import db_engine
+from chart_cache import weight_chart_cache
+from chart_renderer import MIN_CHART_POINTS, render_weight_chart
+from commands.common import run_user_command
+from jobs.owner_digest_job import notify_owner
+from exc import ChartRendererBusy
 from models import DateLabel, User, WeightLog, CommandLog
-from models.core import get_or_create_user
-from utils import get_temp_filename
-from weight_charts import (
-    close_weight_chart_figure,
-    create_weight_chart_figure,
-    get_weight_chart_ranges,
-)
 
 logger = logging.getLogger(__name__)
 
 
-def get_weight_entry_pattern():
+def get_weight_entry_pattern(locale: str = None):
     """
-    This depends on locale
+    This depends on locale, compiled once per locale
+    :param locale: default: current locale
     :return:
     """
-    return re.compile('^((/weight|{})\\s+)?([0-9.,]+)$'.format(i18n.t('weight')), re.I)
+    return _compile_weight_entry_pattern(locale or i18n.get('locale'))
+
+
+@lru_cache(maxsize=None)
+def _compile_weight_entry_pattern(locale: str):
+    return re.compile('^((/weight|{})\\s+)?([0-9.,]+)$'.format(i18n.t('weight', locale=locale)), re.I)
 
 
-def create_user_weight_chart(db_session: Session, user: User, current_time: datetime = None) -> str:
+def get_user_weight_chart_data(db_session: Session, user: User, current_time: datetime = None) -> Optional[dict]:
+    """
+    Load everything the weight chart needs as plain picklable data. The chart is identified
+    by a key built from the weight log version, date labels and the current date; weights
+    are not loaded if the chart with this key is cached
+    :param db_session:
+    :param user:
+    :param current_time:
+    :return: dictionary {key, cached} for a cached chart, {key, weights, date_labels, current_time}
+        for a chart to render or None if there is nothing to draw
+    """
     current_time = current_time or datetime.now()
     current_timestamp = int(current_time.timestamp())
     one_year_ago = current_timestamp - 86400 * 365
 
-    query = db_session.query(WeightLog.created_at, WeightLog.weight).filter(
+    # max(id) alone is not enough: ids of cancelled entries may be reused
+    weights_version = db_session.query(
+        func.count(WeightLog.id),
+        func.max(WeightLog.id),
+        func.max(WeightLog.created_at),
+        func.sum(WeightLog.weight),
+    ).filter(
         WeightLog.user_id == user.id,
         WeightLog.created_at >= one_year_ago,
-    ).order_by(asc('created_at'))
-
-    df = pd.read_sql(query.statement, query.session.bind)
-    if df.empty:
+    ).one()
+    if weights_version[0] < MIN_CHART_POINTS:
         return None
 
-    df['created_at'] = pd.to_datetime(df['created_at'], unit='s')
     one_year_ago_date = (current_time - timedelta(days=365)).date()
     date_labels = db_session.query(DateLabel.label_date, DateLabel.label).filter(
         DateLabel.user_id == user.id,
         DateLabel.label_date >= one_year_ago_date,
         DateLabel.label_date <= current_time.date(),
     ).order_by(DateLabel.label_date, DateLabel.updated_at, DateLabel.id).all()
+    date_labels = [(label_date, label) for label_date, label in date_labels]
 
-    fig = create_weight_chart_figure(get_weight_chart_ranges(df, current_time), date_labels)
-    if not fig:
-        return None
+    key = (user.id, tuple(weights_version), tuple(date_labels), current_time.date())
+    cached = weight_chart_cache.get(key)
+    if cached:
+        return {'key': key, 'cached': cached}
 
-    plot_filename = get_temp_filename('png')
-    fig.savefig(plot_filename)
-    close_weight_chart_figure(fig)
-    return plot_filename
+    weights = db_session.query(WeightLog.created_at, WeightLog.weight).filter(
+        WeightLog.user_id == user.id,
+        WeightLog.created_at >= one_year_ago,
+    ).order_by(asc('created_at')).all()
+
+    return {
+        'key': key,
+        'weights': [(created_at, weight) for created_at, weight in weights],
+        'date_labels': date_labels,
+        'current_time': current_time,
+    }
 
 
-def weight_entry(db_session: Session, user: User, input_message: str) -> dict:
+def weight_entry(db_session: Session, user: User, input_message: str, match: re.Match = None) -> dict:
     """
     :param db_session:
     :param user:
     :param input_message:
+    :param match: input_message already matched against weight entry pattern (see router)
     :return: dictionary {telegram_id: message}
     """
     user_tid = str(user.telegram_id)
     owner_tid = os.getenv('OWNER_TELEGRAM_ID')
-    m = get_weight_entry_pattern().match(input_message)
+    m = match or get_weight_entry_pattern().match(input_message)
     invalid_reply = {user_tid: {'message': i18n.t('I don\'t understand')}}
     if not m:
         return invalid_reply
@@ -113,14 +139,78 @@ def weight_entry(db_session: Session, user: User, input_message: str) -> dict:
         owner_tid: {'message': message}
     }
 
-    plot_filename = create_user_weight_chart(db_session, user)
-    if plot_filename:
-        replies[user_tid]['plot_file'] = plot_filename
-        replies[owner_tid]['plot_file'] = plot_filename
+    chart_data = get_user_weight_chart_data(db_session, user)
+    if chart_data:
+        replies[user_tid]['chart'] = chart_data
+        replies[owner_tid]['chart'] = chart_data
 
     return replies
 
 
+async def send_weight_chart(bot: Bot, tids: list, key, chart) -> None:
+    """
+    Upload the chart once, reuse Telegram file_id for other recipients and later requests
+    :param bot:
+    :param tids:
+    :param key: chart cache key
+    :param chart: PNG image bytes or Telegram file_id
+    :return:
+    """
+    photo = chart
+    for tid in tids:
+        message = await bot.send_photo(tid, photo)
+        if message.photo:
+            photo = message.photo[-1].file_id
+    if isinstance(photo, str):
+        weight_chart_cache.put(key, file_id=photo)
+
+
+async def render_and_cache_weight_chart(chart_data: dict, wait: bool = False) -> Optional[bytes]:
+    chart = await render_weight_chart(chart_data, wait=wait)
+    if chart:
+        weight_chart_cache.put(chart_data['key'], png=chart)
+    return chart
+
+
+async def send_delayed_weight_chart(bot: Bot, tids: list, chart_data: dict) -> None:
+    chart = await render_and_cache_weight_chart(chart_data, wait=True)
+    if chart:
+        await send_weight_chart(bot, tids, chart_data['key'], chart)
+
+
+async def send_weight_replies(context: ContextTypes.DEFAULT_TYPE, messages: dict) -> None:
+    """
+    Send replies with weight chart. The chart is the same for all recipients and is taken
+    from the chart cache or rendered once in the chart renderer pool; if the pool is saturated,
+    the chart is sent later
+    :param context:
+    :param messages: dictionary {telegram_id: {message, chart}}
+    :return:
+    """
+    for tid in messages.keys():
+        await context.bot.send_message(tid, messages[tid]['message'])
+
+    chart_tids = [tid for tid in messages.keys() if 'chart' in messages[tid]]
+    if not chart_tids:
+        return
+    chart_data = messages[chart_tids[0]]['chart']
+
+    if 'cached' in chart_data:
+        chart = chart_data['cached']['file_id'] or chart_data['cached']['png']
+    else:
+        try:
+            chart = await render_and_cache_weight_chart(chart_data)
+        except ChartRendererBusy:
+            logger.warning("Chart renderer is busy, delaying chart")
+            for tid in chart_tids:
+                await context.bot.send_message(tid, i18n.t('Chart is coming shortly'))
+            context.application.create_task(send_delayed_weight_chart(context.bot, chart_tids, chart_data))
+            return
+
+    if chart:
+        await send_weight_chart(context.bot, chart_tids, chart_data['key'], chart)
+
+
 async def weight_entry_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Process weight entry, echo it to the owner for debugging
@@ -128,21 +218,14 @@ async def weight_entry_command(update: Update, context: ContextTypes.DEFAULT_TYP
     :param _:
     :return:
     """
-    db_session = sessionmaker(bind=db_engine)()
     from_user = update.message.from_user
-    owner_tid = os.getenv('OWNER_TELEGRAM_ID')
 
     info = "{} {}: {}".format(
         from_user.id, from_user.username, update.message.text)
     logger.info(info)
-    await context.bot.send_message(owner_tid, info)
+    notify_owner(context, info)
 
-    user = get_or_create_user(db_session, from_user.id)
-    if user is None:
+    messages = await run_user_command(from_user.id, weight_entry, update.message.text, context.match)
+    if messages is None:
         return
-    messages = weight_entry(db_session, user, update.message.text)
-    for tid in messages.keys():
-        await context.bot.send_message(tid, messages[tid]['message'])
-        if 'plot_file' in messages[tid]:
-            with open(messages[tid]['plot_file'], 'rb') as f:
-                await context.bot.send_photo(tid, f)
+    await send_weight_replies(context, messages)
@@ -1,11 +1,37 @@
+import asyncio
+import contextvars
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
 from dotenv import load_dotenv
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from query_stats import track_queries
 
 load_dotenv()
 
+
+def is_sqlite() -> bool:
+    """
+    DB_BACKEND=sqlite runs the bot on a local SQLite file (DB_PATH, ':memory:' for
+    an in-memory database), the default is MySQL
+    """
+    return os.getenv('DB_BACKEND', 'mysql') == 'sqlite'
+
+
 def get_db_url():
+    if is_sqlite():
+        path = os.getenv('DB_PATH', 'fatbot.sqlite')
+        return 'sqlite://' if path == ':memory:' else 'sqlite:///' + path
     return "mysql://%s:%s@%s:%s/%s?charset=utf8mb4" % (
         os.getenv("DB_USER", "fatbot"),
         os.getenv("DB_PASSWORD", "fatbot"),
@@ -15,4 +41,176 @@ def get_db_url():
     )
 
 
-db_engine = create_engine(get_db_url(), pool_size=50, max_overflow=10, pool_recycle=3600)
+class PoolStats:
+    """
+    Connection pool counters, see get_pool_stats
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def add_checkout(self, wait_seconds: float, timed_out: bool = False) -> None:
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def add_connect(self) -> None:
+        with self.lock:
+            self.connects += 1
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool which records how long checkouts wait for a connection
+    """
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.add_checkout(time.perf_counter() - started_at, timed_out=True)
+            raise
+        pool_stats.add_checkout(time.perf_counter() - started_at)
+        return connection
+
+
+def _count_connect(dbapi_connection, connection_record):
+    pool_stats.add_connect()
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL: readers don't block the writer and the writer doesn't block readers
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.execute('PRAGMA busy_timeout={}'.format(int(float(os.getenv('DB_POOL_TIMEOUT', '30')) * 1000)))
+    cursor.close()
+
+
+def create_db_engine(url: str = None) -> Engine:
+    """
+    :param url: default: get_db_url()
+    :return: engine with the pool and connection settings of the backend
+    """
+    url = url or get_db_url()
+    if url.startswith('sqlite'):
+        if url == 'sqlite://':
+            # every connection to :memory: is a new empty database, share one
+            engine = create_engine(url, poolclass=StaticPool, connect_args={'check_same_thread': False})
+        else:
+            engine = create_engine(url,
+                                   poolclass=TimedQueuePool,
+                                   pool_size=int(os.getenv('DB_POOL_SIZE', '50')),
+                                   max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '10')),
+                                   pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+                                   connect_args={'check_same_thread': False})
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    else:
+        engine = create_engine(url,
+                               poolclass=TimedQueuePool,
+                               pool_size=int(os.getenv('DB_POOL_SIZE', '50')),
+                               max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '10')),
+                               pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+                               pool_recycle=3600)
+    event.listen(engine, 'connect', _count_connect)
+    track_queries(engine)
+    return engine
+
+
+def create_schema(engine: Engine) -> None:
+    """
+    SQLite databases aren't migrated with alembic (the migrations are MySQL-specific):
+    create the tables from the models and the default units if they don't exist yet
+    :param engine:
+    :return:
+    """
+    from models import Base, Unit
+    from models.core import create_default_units
+
+    Base.metadata.create_all(engine)
+    with Session(bind=engine) as session:
+        if session.query(Unit).count() == 0:
+            create_default_units(session=session)
+
+
+db_engine = create_db_engine()
+db_sessionmaker = sessionmaker(bind=db_engine)
+
+
+def get_pool_stats() -> dict:
+    """
+    :return: pool size and usage right now, checkout counters since start
+    """
+    pool = db_engine.pool
+    is_queue_pool = isinstance(pool, QueuePool)
+    with pool_stats.lock:
+        return {
+            'size': pool.size() if is_queue_pool else 1,
+            'checked_out': pool.checkedout() if is_queue_pool else 0,
+            'overflow': max(0, pool.overflow()) if is_queue_pool else 0,
+            'checkouts': pool_stats.checkouts,
+            'connects': pool_stats.connects,
+            'timeouts': pool_stats.timeouts,
+            'wait_seconds': pool_stats.wait_seconds,
+            'max_wait_seconds': pool_stats.max_wait_seconds,
+        }
+
+
+@contextmanager
+def session_scope():
+    """
+    with session_scope() as db_session: ... the session is rolled back if the block
+    raises and always closed, so its connection goes back to the pool
+    :return:
+    """
+    db_session = db_sessionmaker()
+    try:
+        yield db_session
+    except BaseException:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+
+# Blocking database work runs here instead of on the event loop. Keep it below
+# the pool size so that workers never wait for a connection.
+db_executor = ThreadPoolExecutor(max_workers=int(os.getenv('DB_EXECUTOR_WORKERS', '20')),
+                                 thread_name_prefix='db')
+
+
+def call_in_db_session(func, *args, **kwargs):
+    """
+    Call func(db_session, *args, **kwargs) with a new session, close the session afterwards
+    :param func:
+    :return: func result
+    """
+    with session_scope() as db_session:
+        return func(db_session, *args, **kwargs)
+
+
+async def run_in_db_session(func, *args, **kwargs):
+    """
+    Async version of call_in_db_session: the call runs in db_executor,
+    so a slow query doesn't block updates of other users. The context goes along,
+    so the statements are counted for the current update (see query_stats)
+    :param func:
+    :return: func result
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, partial(context.run, call_in_db_session, func, *args, **kwargs))
@@ -13,3 +13,7 @@ class UnitNotFound(FatbotError):
 
 class UnitNotDefined(FatbotError):
     pass
+
+
+class ChartRendererBusy(FatbotError):
+    pass
@@ -1,5 +1,8 @@
 import logging
 import os
+import secrets
+from urllib.parse import urlparse
+
 import i18n
 
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, \
@@ -10,10 +13,14 @@ from telegram.constants import ParseMode, ChatAction
 
 from dotenv import load_dotenv
 
+from chart_renderer import start_chart_renderer, stop_chart_renderer
+from db import create_schema, db_engine, is_sqlite
 from commands import *
-from commands.router import router_command
+from commands.router import get_message_router, router_command
 
-from jobs import future_message_job, daily_report_job
+from jobs import future_message_job, daily_report_job, owner_digest_job, metrics_job
+from jobs.owner_digest_job import OWNER_DIGEST_INTERVAL
+from metrics import METRICS_INTERVAL, METRICS_PORT, instrument_handlers, instrument_job, start_metrics_server
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +33,27 @@ i18n.set('fallback', 'en')
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 OWNER_TELEGRAM_ID = os.getenv('OWNER_TELEGRAM_ID')
 
+# public HTTPS URL Telegram posts updates to, long polling if empty
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+# the local server behind the reverse proxy which WEBHOOK_URL points to
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+# Telegram sends it in every request, others are rejected; random per start if empty
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+# simultaneous connections Telegram opens to deliver updates
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# update types each handler class can handle; the bot reads only message fields
+# (update.message), edited messages and channel posts would fail in the handlers anyway
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: [Update.MESSAGE],
+    MessageHandler: [Update.MESSAGE],
+    ChatMemberHandler: [Update.MY_CHAT_MEMBER, Update.CHAT_MEMBER],
+    ChatJoinRequestHandler: [Update.CHAT_JOIN_REQUEST],
+}
+
+_metrics_server = None
+
 
 BOT_COMMANDS = [
     BotCommand('start', i18n.t('Start the bot')),
@@ -43,6 +71,21 @@ async def register_bot_commands(application: Application) -> None:
     await application.bot.set_my_commands(BOT_COMMANDS)
 
 
+async def post_init(application: Application) -> None:
+    global _metrics_server
+    await register_bot_commands(application)
+    get_message_router(i18n.get('locale'))
+    await start_chart_renderer()
+    if METRICS_PORT:
+        _metrics_server = await start_metrics_server(int(METRICS_PORT))
+
+
+async def post_shutdown(_: Application) -> None:
+    stop_chart_renderer()
+    if _metrics_server is not None:
+        _metrics_server.close()
+
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Greet the user on /start"""
     await update.message.reply_text(i18n.t('Hi!'))
@@ -53,15 +96,36 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
-logger = logging.getLogger(__name__)
 
 # set higher logging level for httpx to avoid all GET and POST requests being logged
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
-def main() -> None:
-
-    application = ApplicationBuilder().token(token=TELEGRAM_TOKEN).post_init(register_bot_commands).build()
+def get_allowed_updates(application: Application) -> list:
+    """
+    Update types Telegram should send: only those the registered handlers handle
+    :param application:
+    :return: list of update types, all of them if there is a handler of unknown kind
+    """
+    allowed_updates = []
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            update_types = HANDLER_UPDATE_TYPES.get(type(handler))
+            if update_types is None:
+                return Update.ALL_TYPES
+            allowed_updates.extend(t for t in update_types if t not in allowed_updates)
+    return allowed_updates
+
+
+def create_application(token: str = TELEGRAM_TOKEN) -> Application:
+    """
+    :param token:
+    :return: application with the handlers and jobs of the bot
+    """
+    application = ApplicationBuilder().token(token=token) \
+        .post_init(post_init) \
+        .post_shutdown(post_shutdown) \
+        .build()
 
     # commands
 
@@ -87,20 +151,52 @@ def main() -> None:
     application.add_handler(CommandHandler("update_food", add_food_command))
     application.add_handler(CommandHandler("add_unit", add_unit_command))
     application.add_handler(CommandHandler("define_unit", define_unit_command))
+    application.add_handler(CommandHandler("botstats", botstats_command))
 
     # default command: router
     application.add_handler(MessageHandler(
         filters.TEXT & ~filters.COMMAND, router_command))
 
+    # the router records the commands it routes to
+    instrument_handlers(application, skip=[router_command])
+
     # jobs
     for i in range(0, int(os.getenv('FUTURE_MESSAGE_JOBS'))):
-        application.job_queue.run_repeating(future_message_job, interval=10, first=0)
+        application.job_queue.run_repeating(instrument_job(future_message_job), interval=10, first=0)
+
+    application.job_queue.run_repeating(instrument_job(daily_report_job), interval=60, first=0)
+
+    application.job_queue.run_repeating(owner_digest_job, interval=OWNER_DIGEST_INTERVAL,
+                                        first=OWNER_DIGEST_INTERVAL)
+
+    if METRICS_PORT:
+        application.job_queue.run_repeating(metrics_job, interval=METRICS_INTERVAL, first=0)
+
+    return application
+
+
+def main() -> None:
+    if is_sqlite():
+        create_schema(db_engine)
 
-    application.job_queue.run_repeating(daily_report_job, interval=60, first=0)
+    application = create_application()
+    allowed_updates = get_allowed_updates(application)
+    logger.info("Allowed updates: {}".format(', '.join(allowed_updates)))
 
     # start the bot
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=urlparse(WEBHOOK_URL).path.lstrip('/'),
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        application.run_polling(allowed_updates=allowed_updates)
 
 
 if __name__ == '__main__':
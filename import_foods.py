@@ -0,0 +1,300 @@
+"""
+Import foods from CSV or JSONL into the catalog
+
+JSONL, one food per line:
+{"names": {"en": "Apple", "ru": "Яблоко"}, "calories": 52, "fat": 0.2, "carbs": 14, "protein": 0.3,
+ "units": {"pc": 180}, "default_unit": "pc"}
+
+CSV with a header, name_<language> columns and units as name=grams pairs:
+name_en,name_ru,calories,fat,carbs,protein,units,default_unit
+Apple,Яблоко,52,0.2,14,0.3,pc=180,pc
+
+Values are per 100 g, unit names are in --locale. A food which has one of the names already
+is updated, other foods are added.
+
+Usage: python import_foods.py foods.jsonl [--dry-run]
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+from itertools import islice
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, tuple_, update
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import Session
+
+from models import Food, FoodName, FoodUnit
+from models.catalog import get_food_catalog, invalidate_food_catalog, normalize_name
+
+logger = logging.getLogger(__name__)
+
+MACROS = ['calories', 'fat', 'carbs', 'protein']
+
+
+class ImportFood:
+    def __init__(self, line: int, names: dict, values: dict, units: dict, default_unit: str = None):
+        """
+        :param line: line number in the source file
+        :param names: {language: name}
+        :param values: {calories, fat, carbs, protein} per 100 g
+        :param units: {unit name: grams}
+        :param default_unit:
+        """
+        self.line = line
+        self.names = names
+        self.values = values
+        self.units = units
+        self.default_unit = default_unit
+        self.food_id = None
+
+    def merge(self, food: 'ImportFood') -> 'ImportFood':
+        """
+        The same food is listed again: add the names and units, the last values win
+        """
+        self.names.update(food.names)
+        self.values = food.values
+        self.units.update(food.units)
+        self.default_unit = food.default_unit or self.default_unit
+        return self
+
+
+class ImportReport:
+    def __init__(self):
+        self.added = 0
+        self.updated = 0
+        self.names = 0
+        self.units = 0
+        self.errors = []  # (line, message)
+
+    def __str__(self):
+        lines = ['Foods added: {}'.format(self.added),
+                 'Foods updated: {}'.format(self.updated),
+                 'Names added: {}'.format(self.names),
+                 'Units defined: {}'.format(self.units),
+                 'Errors: {}'.format(len(self.errors))]
+        lines.extend('line {}: {}'.format(line, message) for line, message in self.errors)
+        return '\n'.join(lines)
+
+
+def parse_units(units: str) -> dict:
+    """
+    :param units: pc=180;cup=125
+    :return: {'pc': 180.0, 'cup': 125.0}
+    """
+    result = {}
+    for pair in filter(None, (p.strip() for p in units.split(';'))):
+        name, grams = pair.rsplit('=', 1)
+        result[name.strip()] = float(grams)
+    return result
+
+
+def read_foods(lines, file_format: str):
+    """
+    :param lines: iterable of source lines
+    :param file_format: csv or jsonl
+    :return: generator of ImportFood or (line, error message)
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        records = ((reader.line_num, row) for row in reader)
+    else:
+        records = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+
+    for number, record in records:
+        try:
+            if file_format == 'csv':
+                names = {k[5:]: v.strip() for k, v in record.items() if k.startswith('name_') and v and v.strip()}
+                units = parse_units(record.get('units') or '')
+                default_unit = (record.get('default_unit') or '').strip() or None
+            else:
+                record = json.loads(record)
+                names = {k: v.strip() for k, v in record.get('names', {}).items() if v and v.strip()}
+                units = {k: float(v) for k, v in record.get('units', {}).items()}
+                default_unit = record.get('default_unit')
+            values = {m: float(record.get(m) or 0) for m in MACROS}
+        except (ValueError, TypeError, AttributeError) as e:
+            yield number, 'invalid record: {}'.format(e)
+            continue
+        if not names:
+            yield number, 'no names'
+            continue
+        if any(v < 0 for v in values.values()) or any(g <= 0 for g in units.values()):
+            yield number, 'negative values'
+            continue
+        if default_unit is not None and default_unit not in units and default_unit != 'g':
+            yield number, 'default unit {} is not in units'.format(default_unit)
+            continue
+        yield ImportFood(number, names, values, units, default_unit)
+
+
+def import_foods(db_session: Session, foods, locale: str = 'en', chunk_size: int = 1000,
+                 dry_run: bool = False) -> ImportReport:
+    """
+    Add or update foods chunk by chunk, one transaction per chunk
+    :param db_session:
+    :param foods: iterable of ImportFood or (line, error message), see read_foods
+    :param locale: language of unit names
+    :param chunk_size:
+    :param dry_run: only report what would be done
+    :return:
+    """
+    report = ImportReport()
+    catalog = get_food_catalog(db_session)
+    food_ids = dict(catalog.food_ids)  # (language, normalized name): food_id, including imported
+    food_units = set(catalog.food_units)  # (food_id, unit_id)
+    gram_unit_id = catalog.gram_unit_id
+    next_dry_run_id = -1
+
+    foods = iter(foods)
+    while True:
+        chunk = list(islice(foods, chunk_size))
+        if not chunk:
+            break
+
+        new_foods = []
+        updated_foods = {}  # food_id: ImportFood
+        pending = {}  # (language, normalized name): ImportFood, names not in the database yet
+        for food in chunk:
+            if isinstance(food, tuple):
+                report.errors.append(food)
+                continue
+            try:
+                unit_ids = {name: catalog.get_unit_id(locale, name) for name in food.units}
+            except NoResultFound:
+                report.errors.append((food.line, 'unknown unit in {}'.format(', '.join(food.units))))
+                continue
+            food.units = {unit_ids[name]: grams for name, grams in food.units.items()}
+            if food.default_unit == 'g':
+                food.default_unit = gram_unit_id
+                food.units.setdefault(gram_unit_id, 1)
+            elif food.default_unit is not None:
+                food.default_unit = unit_ids[food.default_unit]
+
+            keys = [(language, normalize_name(name)) for language, name in food.names.items()]
+            matches = {food_ids[k] for k in keys if k in food_ids} | \
+                      {pending[k].food_id for k in keys if k in pending and pending[k].food_id is not None}
+            earlier = {id(pending[k]): pending[k] for k in keys if k in pending and pending[k].food_id is None}
+            if len(matches) + len(earlier) > 1:
+                report.errors.append((food.line, 'names belong to different foods'))
+                continue
+            if matches:
+                food.food_id = matches.pop()
+                if food.food_id in updated_foods:
+                    food = updated_foods[food.food_id].merge(food)
+                else:
+                    updated_foods[food.food_id] = food
+            elif earlier:
+                food = earlier.popitem()[1].merge(food)
+            else:
+                new_foods.append(food)
+            for k in keys:
+                if k not in food_ids:
+                    pending[k] = food
+
+        if not dry_run:
+            rows = [Food(**{m: food.values[m] / 100.0 for m in MACROS}) for food in new_foods]
+            db_session.add_all(rows)
+            db_session.flush()
+            for food, row in zip(new_foods, rows):
+                food.food_id = row.id
+        else:
+            for food in new_foods:
+                food.food_id = next_dry_run_id
+                next_dry_run_id -= 1
+
+        names = []
+        foods_in_chunk = new_foods + list(updated_foods.values())
+        for food in foods_in_chunk:
+            for language, name in food.names.items():
+                key = (language, normalize_name(name))
+                if key not in food_ids:
+                    food_ids[key] = food.food_id
+                    names.append({'food_id': food.food_id, 'language': language, 'name': name})
+
+        # replaced units are deleted and inserted again: keep the default of a food
+        # which the import doesn't choose a default for
+        keep_default = [food.food_id for food in updated_foods.values() if food.default_unit is None]
+        current_defaults = dict(db_session.query(FoodUnit.food_id, FoodUnit.unit_id).filter(
+            FoodUnit.food_id.in_(keep_default), FoodUnit.is_default.is_(True))) if keep_default else {}
+
+        units = []
+        replaced_units = []
+        defaults = []
+        for food in foods_in_chunk:
+            if food.default_unit is None and current_defaults.get(food.food_id) in food.units:
+                food.default_unit = current_defaults[food.food_id]
+            if food.food_id not in updated_foods and gram_unit_id is not None:
+                # the same as create_food: every food can be measured in grams
+                food.units.setdefault(gram_unit_id, 1)
+                food.default_unit = food.default_unit or gram_unit_id
+            for unit_id, grams in food.units.items():
+                if (food.food_id, unit_id) in food_units:
+                    replaced_units.append((food.food_id, unit_id))
+                food_units.add((food.food_id, unit_id))
+                units.append({'food_id': food.food_id, 'unit_id': unit_id, 'grams': grams,
+                              'is_default': unit_id == food.default_unit})
+            if food.default_unit is not None:
+                defaults.append(food.food_id)
+
+        report.added += len(new_foods)
+        report.updated += len(updated_foods)
+        report.names += len(names)
+        report.units += len(units)
+        if dry_run:
+            continue
+
+        if updated_foods:
+            db_session.execute(update(Food), [
+                dict(id=food.food_id, updated_at=int(time.time()), **{m: food.values[m] / 100.0 for m in MACROS})
+                for food in updated_foods.values()])
+        if names:
+            db_session.execute(insert(FoodName), names)
+        if defaults:
+            db_session.query(FoodUnit).filter(FoodUnit.food_id.in_(defaults)) \
+                .update({FoodUnit.is_default: False}, synchronize_session=False)
+        if replaced_units:
+            db_session.query(FoodUnit).filter(tuple_(FoodUnit.food_id, FoodUnit.unit_id).in_(replaced_units)) \
+                .delete(synchronize_session=False)
+        if units:
+            db_session.execute(insert(FoodUnit), units)
+        db_session.commit()
+        logger.info("Foods added: {}, updated: {}".format(report.added, report.updated))
+
+    if not dry_run:
+        invalidate_food_catalog()
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Import foods from CSV or JSONL')
+    parser.add_argument('path', type=str, help='CSV or JSONL file, - for stdin')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='default: by file extension')
+    parser.add_argument('--locale', type=str, default='en', help='language of unit names')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='foods per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='report only, change nothing')
+    args = parser.parse_args(argv)
+
+    file_format = args.format or ('csv' if args.path.lower().endswith('.csv') else 'jsonl')
+    load_dotenv()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    from db import session_scope
+    source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8', newline='')
+    try:
+        with session_scope() as db_session:
+            report = import_foods(db_session, read_foods(source, file_format), locale=args.locale,
+                                  chunk_size=args.chunk_size, dry_run=args.dry_run)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    print(report)
+    return 1 if report.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,11 @@
 from jobs.future_message_job import future_message_job
 from jobs.daily_report_job import daily_report_job
+from jobs.owner_digest_job import owner_digest_job
+from jobs.metrics_job import metrics_job
 
 __all__ = [
     "future_message_job",
     "daily_report_job",
+    "owner_digest_job",
+    "metrics_job",
 ]
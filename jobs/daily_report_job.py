@@ -1,57 +1,96 @@
 import logging
 import os
-from multiprocessing import Lock
-import time
-import i18n
+from datetime import datetime, timedelta
 
-from sqlalchemy import func, text, and_
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql.functions import concat, current_date
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
 from telegram.ext import ContextTypes
 
-from db import db_engine
-from models import DailyReport, FutureMessage, date_now
-from models.core import daily_report_message
+from db import run_in_db_session
+from models import DailyReport, FutureMessage, date_now, utc_now
+from models.core import daily_report_totals, format_daily_report
 
 logger = logging.getLogger(__name__)
-daily_report_mutex = Lock()
+
+DAILY_REPORT_BATCH_SIZE = int(os.getenv('DAILY_REPORT_BATCH_SIZE', '5000'))
 
 
 async def daily_report_job(context: ContextTypes.DEFAULT_TYPE = None, db_session=None):
     """
     Select users for daily reporting, queue reports for them
     :param context: optional, not used ATM
+    :param db_session: optional, run in this session on the event loop (tests)
     :return:
     """
     if db_session is None:
-        db_session = sessionmaker(bind=db_engine)()
+        await run_in_db_session(queue_daily_reports)
+    else:
+        queue_daily_reports(db_session)
+
+
+def queue_daily_reports(db_session: Session):
+    """
+    Blocking part of daily_report_job: queue reports for all users due, batch by batch
+    :param db_session:
+    :return:
+    """
     today_date = date_now()
+    while queue_daily_reports_batch(db_session, today_date) == DAILY_REPORT_BATCH_SIZE:
+        pass
+
+
+def queue_daily_reports_batch(db_session: Session, today_date: str) -> int:
+    """
+    Claim up to DAILY_REPORT_BATCH_SIZE users due for a report, calculate their totals
+    with one aggregate query and insert their messages at once
+    :param db_session:
+    :param today_date:
+    :return: number of users claimed
+    """
+    # users claimed by a concurrent run are skipped, not waited for
+    user_ids = [r.user_id for r in db_session.query(DailyReport.user_id)
+                .filter(DailyReport.last_report_date < today_date)
+                .order_by(DailyReport.last_report_date)
+                .limit(DAILY_REPORT_BATCH_SIZE)
+                .with_for_update(skip_locked=True)]
+
+    if user_ids:
+        db_session.query(DailyReport) \
+            .filter(DailyReport.user_id.in_(user_ids)) \
+            .update({DailyReport.last_report_date: today_date}, synchronize_session=False)
+
+    db_session.commit()
 
-    with daily_report_mutex:
-        records = db_session.query(DailyReport) \
-            .filter(DailyReport.last_report_date < today_date) \
-            .order_by(DailyReport.last_report_date) \
-            .limit(10) \
-            .all()
+    if not user_ids:
+        return 0
 
-        for r in records:
-            r.last_report_date = today_date
-            db_session.add(r)
+    now = utc_now()
+    expires_at = now + timedelta(days=1)
+    send_at = datetime.strptime(today_date, '%Y-%m-%d').replace(hour=7)  # todo: user's timezone
+    messages = [{
+        'user_id': totals.user_id,
+        'created_at': now,
+        'locked_until': now,
+        'expires_at': expires_at,
+        'send_at': send_at,
+        'message': format_daily_report(totals),
+    } for totals in daily_report_totals(db_session, user_ids, today_date)]
 
+    if messages:
+        db_session.execute(insert(FutureMessage), messages)
         db_session.commit()
 
-    for r in records:
-        logger.info(r)
-        message = daily_report_message(db_session, r.user, today_date)
-        if message:
-            fm = FutureMessage(
-                user_id=r.user_id,
-                created_at=func.now(),
-                locked_until=func.now(),
-                expires_at=text('date_add(now(), interval 1 day)'),
-                send_at='{} 07:00:00'.format(
-                    today_date),  # todo: user's timezone
-                message=message
-            )
-            db_session.add(fm)
-            db_session.commit()
+    logger.info("Daily reports: {} users claimed, {} messages queued".format(len(user_ids), len(messages)))
+    return len(user_ids)
+
+
+def get_daily_report_lag(db_session: Session, today_date: str) -> tuple:
+    """
+    :param db_session:
+    :param today_date:
+    :return: number of users due for a report, the oldest last report date among them or None
+    """
+    count, oldest_date = db_session.query(func.count(DailyReport.id), func.min(DailyReport.last_report_date)) \
+        .filter(DailyReport.last_report_date < today_date) \
+        .one()
+    return count, oldest_date
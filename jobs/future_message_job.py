@@ -1,46 +1,114 @@
 import logging
-from multiprocessing import Lock
+import os
+from datetime import timedelta
 
-from sqlalchemy import func, text, and_
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
 from telegram.ext import ContextTypes
 
-from db import db_engine
-from models import FutureMessage
+from db import run_in_db_session
+from jobs.message_dispatcher import message_dispatcher
+from models import FutureMessage, User, utc_now
 
 logger = logging.getLogger(__name__)
-future_message_mutex = Lock()
+
+FUTURE_MESSAGE_BATCH_SIZE = int(os.getenv('FUTURE_MESSAGE_BATCH_SIZE', '500'))
+# must be longer than it takes to send a batch, otherwise another job picks the messages up again
+FUTURE_MESSAGE_LOCK_SECONDS = int(os.getenv('FUTURE_MESSAGE_LOCK_SECONDS', '300'))
 
 
 async def future_message_job(context: ContextTypes.DEFAULT_TYPE):
     """
-    Select all message queued for sending, send them
+    Claim a batch of messages queued for sending, send them, delete the sent ones.
+    Messages which failed stay in the queue and are retried when their lock expires
     :param context:
     :return:
     """
-    db_session = sessionmaker(bind=db_engine)()
+    messages = await run_in_db_session(lock_future_messages, FUTURE_MESSAGE_BATCH_SIZE)
+    if not messages:
+        return
+
+    done = await message_dispatcher.dispatch(context.bot, messages)
+    if done:
+        await run_in_db_session(delete_future_messages, done)
+
 
-    with future_message_mutex:
-        """
-        Lock messages atomically so other threads won't engage these
-        """
-        db_session.execute(text('DELETE FROM future_message WHERE expires_at < now()'))
-        db_session.commit()
+def lock_future_messages(db_session: Session, limit: int = FUTURE_MESSAGE_BATCH_SIZE) -> list:
+    """
+    :param db_session:
+    :param limit: max number of messages to lock
+    :return: list of (message id, telegram id, message text) locked for sending
+    """
+    now = utc_now()
+    db_session.query(FutureMessage).filter(FutureMessage.expires_at < now).delete(synchronize_session=False)
+    db_session.commit()
 
-        messages = db_session.query(FutureMessage) \
-            .filter(FutureMessage.send_at <= func.now(), FutureMessage.locked_until <= func.now()) \
+    locked_until = now + timedelta(seconds=FUTURE_MESSAGE_LOCK_SECONDS)
+    if db_session.get_bind().dialect.name == 'sqlite':
+        messages = claim_future_messages_sqlite(db_session, now, locked_until, limit)
+    else:
+        # rows locked by another job instance or bot process are skipped, not waited for;
+        # locked_until keeps the claimed ones away from others after the commit
+        messages = db_session.query(FutureMessage.id, FutureMessage.user_id, FutureMessage.message) \
+            .filter(FutureMessage.send_at <= now, FutureMessage.locked_until <= now) \
             .order_by(FutureMessage.created_at) \
-            .limit(3) \
+            .limit(limit) \
+            .with_for_update(skip_locked=True) \
             .all()
 
-        for m in messages:
-            m.locked_until = text('date_add(now(), interval 1 minute)')
-            db_session.add(m)
+        if messages:
+            db_session.query(FutureMessage) \
+                .filter(FutureMessage.id.in_([m.id for m in messages])) \
+                .update({FutureMessage.locked_until: locked_until}, synchronize_session=False)
 
-        db_session.commit()
+    db_session.commit()
 
-    for m in messages:
-        logger.info(m.message)
-        context.bot.send_message(chat_id=m.user.telegram_id, text=m.message)
-        db_session.delete(m)
-        db_session.commit()
+    if not messages:
+        return []
+    telegram_ids = dict(db_session.query(User.id, User.telegram_id)
+                        .filter(User.id.in_({m.user_id for m in messages})))
+    return [(m.id, telegram_ids[m.user_id], m.message) for m in messages]
+
+
+def claim_future_messages_sqlite(db_session: Session, now, locked_until, limit: int) -> list:
+    """
+    SQLite has no SELECT ... FOR UPDATE and starts the transaction only at the UPDATE,
+    so select and claim in one statement: it runs under the database write lock
+    :param db_session:
+    :param now:
+    :param locked_until:
+    :param limit:
+    :return: claimed (id, user_id, message) ordered by created_at
+    """
+    due = select(FutureMessage.id) \
+        .filter(FutureMessage.send_at <= now, FutureMessage.locked_until <= now) \
+        .order_by(FutureMessage.created_at) \
+        .limit(limit)
+    claimed = db_session.execute(
+        update(FutureMessage)
+        .where(FutureMessage.id.in_(due.scalar_subquery()))
+        .values(locked_until=locked_until)
+        .returning(FutureMessage.id, FutureMessage.user_id, FutureMessage.message, FutureMessage.created_at),
+        execution_options={'synchronize_session': False},
+    ).all()
+    return sorted(claimed, key=lambda m: (m.created_at, m.id))
+
+
+def delete_future_messages(db_session: Session, message_ids: list):
+    db_session.query(FutureMessage).filter(FutureMessage.id.in_(message_ids)).delete(synchronize_session=False)
+    db_session.commit()
+
+
+def delete_future_message(db_session: Session, message_id: int):
+    delete_future_messages(db_session, [message_id])
+
+
+def get_future_message_backlog(db_session: Session) -> tuple:
+    """
+    :param db_session:
+    :return: number of messages due, send_at of the oldest one or None
+    """
+    count, oldest_send_at = db_session.query(func.count(FutureMessage.id), func.min(FutureMessage.send_at)) \
+        .filter(FutureMessage.send_at <= utc_now()) \
+        .one()
+    return count, oldest_send_at
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import time
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and 1 message per second per chat
+DISPATCH_RATE = float(os.getenv('DISPATCH_RATE', '25'))
+DISPATCH_CHAT_INTERVAL = float(os.getenv('DISPATCH_CHAT_INTERVAL', '1'))
+DISPATCH_CONCURRENCY = int(os.getenv('DISPATCH_CONCURRENCY', '20'))
+DISPATCH_MAX_RETRIES = int(os.getenv('DISPATCH_MAX_RETRIES', '3'))
+
+
+class RateLimiter:
+    """
+    Hands out send slots respecting the global rate and the per-chat interval.
+    Used from the event loop only, so it doesn't need a lock
+    """
+
+    def __init__(self, rate: float = DISPATCH_RATE, chat_interval: float = DISPATCH_CHAT_INTERVAL):
+        self.interval = 1.0 / rate
+        self.chat_interval = chat_interval
+        self.next_slot = 0.0
+        self.next_chat_slots = {}
+
+    def reserve(self, chat_id, now: float) -> float:
+        """
+        :param chat_id:
+        :param now: monotonic time
+        :return: time when the message may be sent
+        """
+        # the global slot doesn't wait for the chat: a busy chat delays only its own messages
+        global_slot = max(now, self.next_slot)
+        self.next_slot = global_slot + self.interval
+        slot = max(global_slot, self.next_chat_slots.get(chat_id, 0.0))
+        self.next_chat_slots[chat_id] = slot + self.chat_interval
+        if len(self.next_chat_slots) > 10000:
+            self.next_chat_slots = {c: s for c, s in self.next_chat_slots.items() if s > now}
+        return slot
+
+    def delay(self, seconds: float) -> None:
+        """
+        Telegram asked us to slow down: postpone all following slots
+        :param seconds:
+        :return:
+        """
+        self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id) -> None:
+        now = time.monotonic()
+        slot = self.reserve(chat_id, now)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class MessageDispatcher:
+    """
+    Sends batches of messages concurrently under Telegram rate limits
+    """
+
+    def __init__(self, limiter: RateLimiter = None, concurrency: int = DISPATCH_CONCURRENCY,
+                 max_retries: int = DISPATCH_MAX_RETRIES):
+        self.limiter = limiter or RateLimiter()
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+
+    async def dispatch(self, bot: Bot, messages: list) -> list:
+        """
+        :param bot:
+        :param messages: list of (message id, chat id, text)
+        :return: ids of messages which are done with: sent or rejected by Telegram for good
+        """
+        started_at = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        chats = {}  # chat id: [(message id, text)], a queue per chat
+        for message_id, chat_id, text in messages:
+            chats.setdefault(chat_id, []).append((message_id, text))
+        sent = set()
+
+        async def send_chat(chat_id, chat_messages):
+            # one message of a chat at a time, the others don't take a concurrency slot
+            for message_id, text in chat_messages:
+                async with semaphore:
+                    if await self.send(bot, chat_id, text):
+                        sent.add(message_id)
+
+        await asyncio.gather(*[send_chat(chat_id, chat_messages) for chat_id, chat_messages in chats.items()])
+        done = [message_id for message_id, _, _ in messages if message_id in sent]
+
+        self.batches += 1
+        self.last_batch_size = len(messages)
+        self.last_batch_seconds = time.monotonic() - started_at
+        if messages:
+            logger.info("Dispatched {} of {} messages in {:.1f} s".format(
+                len(done), len(messages), self.last_batch_seconds))
+        return done
+
+    async def send(self, bot: Bot, chat_id, text: str) -> bool:
+        """
+        :param bot:
+        :param chat_id:
+        :param text:
+        :return: True if the message shouldn't be sent again
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                self.sent += 1
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() \
+                    if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning("Flood control, retry in {} s".format(retry_after))
+                self.retried += 1
+                self.limiter.delay(retry_after)
+            except (Forbidden, BadRequest) as e:
+                # blocked by the user, chat not found etc: retrying won't help
+                logger.warning("Message to {} dropped: {}".format(chat_id, e))
+                self.dropped += 1
+                return True
+            except TelegramError as e:
+                logger.warning("Message to {} failed: {}".format(chat_id, e))
+                break
+        self.failed += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'retried': self.retried,
+            'batches': self.batches,
+            'last_batch_size': self.last_batch_size,
+            'last_batch_seconds': self.last_batch_seconds,
+            'last_batch_rate': self.last_batch_size / self.last_batch_seconds if self.last_batch_seconds else 0.0,
+        }
+
+
+message_dispatcher = MessageDispatcher()
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+from telegram.ext import ContextTypes
+
+import chart_renderer
+from chart_cache import weight_chart_cache
+from db import get_pool_stats, run_in_db_session
+from jobs.daily_report_job import get_daily_report_lag
+from jobs.future_message_job import get_future_message_backlog
+from jobs.message_dispatcher import message_dispatcher
+from metrics import metrics
+from models import date_now, utc_now
+from models.user_cache import user_cache
+
+DISPATCHER_COUNTERS = ['sent', 'failed', 'dropped', 'retried', 'batches']
+POOL_COUNTERS = ['checkouts', 'connects', 'timeouts', 'wait_seconds']
+
+
+async def metrics_job(context: ContextTypes.DEFAULT_TYPE = None):
+    """
+    Query the queues for the exporter, the rest is collected when scraped
+    :param context: optional, not used
+    :return:
+    """
+    await run_in_db_session(update_queue_stats)
+
+
+def update_queue_stats(db_session: Session) -> None:
+    """
+    Backlog of future_message and lag of daily_report, as gauges
+    :param db_session:
+    :return:
+    """
+    now = utc_now()
+    backlog, oldest_send_at = get_future_message_backlog(db_session)
+    metrics.set('future_message_backlog', backlog)
+    metrics.set('future_message_oldest_seconds', (now - oldest_send_at).total_seconds() if oldest_send_at else 0)
+
+    today_date = date_now()
+    due, oldest_date = get_daily_report_lag(db_session, today_date)
+    metrics.set('daily_report_due_users', due)
+    metrics.set('daily_report_lag_days', (datetime.strptime(today_date, '%Y-%m-%d').date() - oldest_date).days
+                if oldest_date else 0)
+
+
+def collect_process_stats() -> list:
+    """
+    Metrics collector: message dispatcher, database pool, chart renderer and caches
+    :return: [(name, type, labels, value)]
+    """
+    dispatcher_stats = message_dispatcher.stats()
+    pool_stats = get_pool_stats()
+    renderer_stats = chart_renderer.stats()
+    samples = [('messages_{}_total'.format(k), 'counter', (), dispatcher_stats[k]) for k in DISPATCHER_COUNTERS]
+    samples.extend([
+        ('dispatch_last_batch_size', 'gauge', (), dispatcher_stats['last_batch_size']),
+        ('dispatch_last_batch_seconds', 'gauge', (), dispatcher_stats['last_batch_seconds']),
+    ])
+    samples.extend(('db_pool_{}_total'.format(k), 'counter', (), pool_stats[k]) for k in POOL_COUNTERS)
+    samples.extend([
+        ('db_pool_size', 'gauge', (), pool_stats['size']),
+        ('db_pool_checked_out', 'gauge', (), pool_stats['checked_out']),
+        ('db_pool_overflow', 'gauge', (), pool_stats['overflow']),
+        ('db_pool_max_wait_seconds', 'gauge', (), pool_stats['max_wait_seconds']),
+        ('charts_in_flight', 'gauge', (), renderer_stats['in_flight']),
+        ('chart_queue_limit', 'gauge', (), renderer_stats['queue_limit']),
+        ('chart_cache_entries', 'gauge', (), len(weight_chart_cache)),
+        ('chart_cache_bytes', 'gauge', (), weight_chart_cache.total_bytes),
+        ('user_cache_entries', 'gauge', (), len(user_cache)),
+    ])
+    return samples
+
+
+metrics.add_collector(collect_process_stats)
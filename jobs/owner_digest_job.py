@@ -0,0 +1,107 @@
+import logging
+import os
+from collections import deque
+
+from telegram import Bot
+from telegram.ext import ContextTypes
+
+from jobs.message_dispatcher import message_dispatcher
+
+logger = logging.getLogger(__name__)
+
+# seconds between digests
+OWNER_DIGEST_INTERVAL = int(os.getenv('OWNER_DIGEST_INTERVAL', '60'))
+# notifications per digest message; a full digest is sent without waiting for the interval
+OWNER_DIGEST_MAX_SIZE = int(os.getenv('OWNER_DIGEST_MAX_SIZE', '50'))
+# notifications kept while the owner can't be reached, the oldest are dropped
+OWNER_DIGEST_QUEUE_LIMIT = int(os.getenv('OWNER_DIGEST_QUEUE_LIMIT', '1000'))
+# Telegram message length limit
+MAX_MESSAGE_LENGTH = 4096
+
+
+class OwnerDigest:
+    """
+    Queue of notifications for the owner, sent in batches. Used from the event loop only
+    """
+
+    def __init__(self, max_size: int = OWNER_DIGEST_MAX_SIZE, queue_limit: int = OWNER_DIGEST_QUEUE_LIMIT):
+        self.max_size = max_size
+        self.queue = deque(maxlen=queue_limit)
+        self.flushing = False
+
+    def __len__(self):
+        return len(self.queue)
+
+    def is_full(self) -> bool:
+        return len(self.queue) >= self.max_size
+
+    def add(self, notification: str) -> None:
+        self.queue.append(notification)
+
+    def take_digest(self) -> str:
+        """
+        :return: up to max_size oldest notifications joined in one message, removed from the queue
+        """
+        return '\n'.join(self.take_lines())[:MAX_MESSAGE_LENGTH]
+
+    def take_lines(self) -> list:
+        """
+        :return: notifications of the next digest, removed from the queue
+        """
+        lines = []
+        length = 0
+        while self.queue and len(lines) < self.max_size:
+            line = self.queue[0][:MAX_MESSAGE_LENGTH]
+            if lines and length + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                break
+            lines.append(self.queue.popleft())
+            length += len(line) + 1
+        return lines
+
+    def put_back(self, lines: list) -> None:
+        """
+        Return notifications which weren't sent to the head of the queue, the oldest
+        are dropped if it is over the limit
+        :param lines: see take_lines
+        :return:
+        """
+        self.queue = deque(lines + list(self.queue), maxlen=self.queue.maxlen)
+
+    async def flush(self, bot: Bot, owner_tid=None) -> None:
+        if self.flushing:
+            return
+        owner_tid = owner_tid or os.getenv('OWNER_TELEGRAM_ID')
+        self.flushing = True
+        try:
+            while self.queue:
+                lines = self.take_lines()
+                if not await message_dispatcher.send(bot, owner_tid, '\n'.join(lines)[:MAX_MESSAGE_LENGTH]):
+                    # the owner can't be reached now, try again on the next run
+                    self.put_back(lines)
+                    break
+        finally:
+            self.flushing = False
+
+
+owner_digest = OwnerDigest()
+
+
+def notify_owner(context: ContextTypes.DEFAULT_TYPE, notification: str) -> None:
+    """
+    Queue notification for the owner's digest, doesn't wait for Telegram
+    :param context:
+    :param notification:
+    :return:
+    """
+    owner_digest.add(notification)
+    if owner_digest.is_full():
+        context.application.create_task(owner_digest.flush(context.bot))
+
+
+async def owner_digest_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Send notifications queued since the last run
+    :param context:
+    :return:
+    """
+    await owner_digest.flush(context.bot)
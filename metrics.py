@@ -0,0 +1,228 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Optional
+
+from query_stats import query_scope
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text format on this port, disabled if empty
+METRICS_PORT = os.getenv('METRICS_PORT', '')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# seconds between queue backlog queries
+METRICS_INTERVAL = int(os.getenv('METRICS_INTERVAL', '60'))
+METRICS_PREFIX = 'fatbot_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self) -> 'Histogram':
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+    def lines(self, name: str, labels: tuple) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', bound),)), cumulative))
+        lines.append('{}_sum{} {}'.format(name, format_labels(labels), self.sum))
+        lines.append('{}_count{} {}'.format(name, format_labels(labels), self.count))
+        return lines
+
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms of the bot process. Updated from the event loop
+    and from database threads, read by the metrics server and /botstats
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # name: {labels: value}
+        self.gauges = {}  # name: {labels: value}
+        self.histograms = {}  # name: {labels: Histogram}
+        self.collectors = []  # functions returning [(name, type, labels, value)] at collection time
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            self.gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histograms = self.histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = Histogram()
+            histograms[key].observe(value)
+
+    def add_collector(self, collector) -> None:
+        self.collectors.append(collector)
+
+    def get_histogram(self, name: str, **labels) -> Optional[Histogram]:
+        with self.lock:
+            histogram = self.histograms.get(name, {}).get(tuple(sorted(labels.items())))
+            return histogram.copy() if histogram else None
+
+    def collect(self) -> list:
+        """
+        :return: [(name, type, labels, value)], value is Histogram for histograms
+        """
+        samples = []
+        for collector in self.collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                logger.warning("Metrics collector {} failed: {}".format(collector.__name__, e))
+        with self.lock:
+            for metric_type, metrics in [('counter', self.counters), ('gauge', self.gauges),
+                                         ('histogram', self.histograms)]:
+                for name, values in metrics.items():
+                    for labels, value in values.items():
+                        samples.append((name, metric_type, labels,
+                                        value.copy() if metric_type == 'histogram' else value))
+        return samples
+
+    def render(self) -> str:
+        """
+        :return: Prometheus text exposition format
+        """
+        families = {}
+        for name, metric_type, labels, value in self.collect():
+            families.setdefault((METRICS_PREFIX + name, metric_type), []).append((tuple(labels), value))
+
+        lines = []
+        for (name, metric_type), samples in sorted(families.items()):
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for labels, value in sorted(samples, key=lambda sample: sample[0]):
+                if metric_type == 'histogram':
+                    lines.extend(value.lines(name, labels))
+                else:
+                    lines.append('{}{} {}'.format(name, format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+metrics = Metrics()
+
+
+async def observe_handler(name: str, awaitable):
+    """
+    Await a handler, count it and its errors, record its latency and SQL statements
+    :param name: handler name
+    :param awaitable:
+    :return: handler result
+    """
+    started_at = time.monotonic()
+    with query_scope(name) as query_stats:
+        try:
+            return await awaitable
+        except Exception:
+            metrics.inc('handler_errors_total', handler=name)
+            raise
+        finally:
+            metrics.inc('updates_total', handler=name)
+            metrics.observe('handler_seconds', time.monotonic() - started_at, handler=name)
+            metrics.inc('handler_queries_total', query_stats.count, handler=name)
+            metrics.inc('handler_query_seconds_total', query_stats.seconds, handler=name)
+
+
+def instrument_handler(callback):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        return await observe_handler(callback.__name__, callback(update, context))
+    return wrapper
+
+
+def instrument_job(callback):
+    @functools.wraps(callback)
+    async def wrapper(context):
+        started_at = time.monotonic()
+        with query_scope(callback.__name__) as query_stats:
+            try:
+                return await callback(context)
+            except Exception:
+                metrics.inc('job_errors_total', job=callback.__name__)
+                raise
+            finally:
+                metrics.inc('job_runs_total', job=callback.__name__)
+                metrics.observe('job_seconds', time.monotonic() - started_at, job=callback.__name__)
+                metrics.inc('job_queries_total', query_stats.count, job=callback.__name__)
+                metrics.inc('job_query_seconds_total', query_stats.seconds, job=callback.__name__)
+    return wrapper
+
+
+def instrument_handlers(application, skip: list = None) -> None:
+    """
+    Record latency and errors of every handler added to the application
+    :param application:
+    :param skip: callbacks which record metrics themselves
+    :return:
+    """
+    skip = skip or []
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if handler.callback not in skip:
+                handler.callback = instrument_handler(handler.callback)
+
+
+async def handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/', '/metrics'):
+            status, body = '200 OK', metrics.render().encode()
+        else:
+            status, body = '404 Not Found', b'Not found\n'
+        writer.write('HTTP/1.1 {}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                     'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(status, len(body)).encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int, host: str = METRICS_HOST) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(handle_metrics_request, host, port)
+    logger.info("Metrics server listening on {}:{}".format(host, port))
+    return server
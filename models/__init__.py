@@ -1,9 +1,11 @@
-from datetime import datetime
+from datetime import date, datetime
 import time
 
 from pytz import timezone
-from sqlalchemy import MetaData, Date, ForeignKey, Boolean, Column, Integer, Float, String, DateTime, UniqueConstraint
+from sqlalchemy import MetaData, ForeignKey, Boolean, Column, Index, Integer, String, DateTime, UniqueConstraint
+from sqlalchemy import Date as BaseDate, Float as BaseFloat
 from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.types import TypeDecorator
 
 Base = declarative_base(metadata=MetaData())
 UTC = timezone('UTC')
@@ -13,6 +15,45 @@ def date_now():
     return datetime.now(UTC).strftime('%Y-%m-%d')
 
 
+def utc_now() -> datetime:
+    """
+    Current UTC time, naive, as DateTime columns store it. Computed here rather than
+    with now() in SQL, so the same queries run on every backend
+    """
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+class Date(TypeDecorator):
+    """
+    Date which also accepts 'YYYY-MM-DD' strings (see date_now) on SQLite, like MySQL does
+    """
+    impl = BaseDate
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return date.fromisoformat(value)
+        return value
+
+
+class Float(TypeDecorator):
+    """
+    MySQL FLOAT is single precision and is read back with 6 significant digits,
+    SQLite values are rounded the same way, so both backends return the same numbers
+    """
+    impl = BaseFloat
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name != 'sqlite':
+            return value
+        return float('{:.6g}'.format(value))
+
+
+# names are compared case-insensitively, as with the utf8mb4_unicode_ci collation of MySQL
+Name = String(255).with_variant(String(255, collation='NOCASE'), 'sqlite')
+
+
 class Food(Base):
     __tablename__ = 'food'
 
@@ -31,11 +72,17 @@ class Food(Base):
 
 class FoodLog(Base):
     __tablename__ = 'food_log'
+    __table_args__ = (
+        Index('idx-food_log-user_id-date-created_at', 'user_id', 'date', 'created_at'),
+        Index('idx-food_log-command_log_id', 'command_log_id'),
+    )
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    user_id = Column(Integer(), ForeignKey('user.id'), nullable=False)
-    food_id = Column(Integer(), ForeignKey('food.id'), nullable=False)
-    unit_id = Column(Integer(), ForeignKey('unit.id'), nullable=False)
+    user_id = Column(Integer(), ForeignKey('user.id', ondelete='cascade'), nullable=False)
+    food_id = Column(Integer(), ForeignKey('food.id', ondelete='cascade'), nullable=False)
+    unit_id = Column(Integer(), ForeignKey('unit.id', ondelete='restrict'), nullable=False)
+    # the food entry command which logged it, see cancel
+    command_log_id = Column(Integer(), ForeignKey('command_log.id', ondelete='set null'), nullable=True)
     created_at = Column(Integer(), default=time.time, nullable=False)
     date = Column(Date(), nullable=False, default=date_now)
     qty = Column(Float(), nullable=False)
@@ -47,6 +94,7 @@ class FoodLog(Base):
     user = relationship('User', foreign_keys=user_id)
     food = relationship('Food', foreign_keys=food_id)
     unit = relationship('Unit', foreign_keys=unit_id)
+    command_log = relationship('CommandLog', foreign_keys=command_log_id)
 
     def __repr__(self):
         return "<FoodLog(user_id={}, food_id={})>".format(self.user_id, self.food_id)
@@ -54,9 +102,12 @@ class FoodLog(Base):
 
 class WeightLog(Base):
     __tablename__ = 'weight_log'
+    __table_args__ = (
+        Index('idx-weight_log-user_id-created_at', 'user_id', 'created_at'),
+    )
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    user_id = Column(Integer(), ForeignKey('user.id'), nullable=False)
+    user_id = Column(Integer(), ForeignKey('user.id', ondelete='cascade'), nullable=False)
     created_at = Column(Integer(), default=time.time, nullable=False)
     weight = Column(Float(), nullable=False)
 
@@ -73,7 +124,7 @@ class DateLabel(Base):
     )
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    user_id = Column(Integer(), ForeignKey('user.id'), nullable=False)
+    user_id = Column(Integer(), ForeignKey('user.id', ondelete='cascade'), nullable=False)
     created_at = Column(Integer(), default=time.time, nullable=False)
     updated_at = Column(Integer(), default=time.time, nullable=False)
     label_date = Column(Date(), nullable=False)
@@ -88,12 +139,15 @@ class DateLabel(Base):
 
 class CommandLog(Base):
     __tablename__ = 'command_log'
+    __table_args__ = (
+        Index('idx-command_log-user_id-created_at', 'user_id', 'created_at'),
+    )
 
     FOOD_ENTRY = 1
     WEIGHT_ENTRY = 2
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    user_id = Column(Integer(), ForeignKey('user.id'), nullable=False)
+    user_id = Column(Integer(), ForeignKey('user.id', ondelete='cascade'), nullable=False)
     created_at = Column(Integer(), default=time.time, nullable=False)
     command_type = Column(Integer(), nullable=False)
     command = Column(String(255), nullable=False)
@@ -106,10 +160,13 @@ class CommandLog(Base):
 
 class FoodName(Base):
     __tablename__ = 'food_name'
+    __table_args__ = (
+        UniqueConstraint('name', 'language', name='uq-food_name-name-language'),
+    )
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    food_id = Column(Integer(), ForeignKey('food.id'), nullable=False)
-    name = Column(String(255), nullable=False)
+    food_id = Column(Integer(), ForeignKey('food.id', ondelete='cascade'), nullable=False)
+    name = Column(Name, nullable=False)
     language = Column(String(8))
 
     food = relationship('Food', foreign_keys=food_id)
@@ -123,7 +180,7 @@ class FoodRequest(Base):
     __tablename__ = 'food_request'
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    user_id = Column(Integer(), ForeignKey('user.id'), nullable=False)
+    user_id = Column(Integer(), ForeignKey('user.id', ondelete='cascade'), nullable=False)
     created_at = Column(Integer(), default=time.time, nullable=False)
     request = Column(String(255), nullable=False)
 
@@ -135,10 +192,13 @@ class FoodRequest(Base):
 
 class FoodUnit(Base):
     __tablename__ = 'food_unit'
+    __table_args__ = (
+        UniqueConstraint('food_id', 'unit_id', name='uq-food_unit'),
+    )
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    food_id = Column(Integer(), ForeignKey('food.id'), nullable=False)
-    unit_id = Column(Integer(), ForeignKey('unit.id'), nullable=False)
+    food_id = Column(Integer(), ForeignKey('food.id', ondelete='cascade'), nullable=False)
+    unit_id = Column(Integer(), ForeignKey('unit.id', ondelete='cascade'), nullable=False)
     is_default = Column(Boolean(), nullable=False)
     grams = Column(Float(), nullable=False)
 
@@ -160,10 +220,13 @@ class Unit(Base):
 
 class UnitName(Base):
     __tablename__ = 'unit_name'
+    __table_args__ = (
+        UniqueConstraint('name', 'language', name='uq-unit_name-name-language'),
+    )
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    unit_id = Column(Integer(), ForeignKey('unit.id'), nullable=False)
-    name = Column(String(255), nullable=False)
+    unit_id = Column(Integer(), ForeignKey('unit.id', ondelete='cascade'), nullable=False)
+    name = Column(Name, nullable=False)
     language = Column(String(8))
 
     unit = relationship('Unit', foreign_keys=unit_id)
@@ -189,11 +252,27 @@ class User(Base):
         return "<User(id={} telegram_id={})>".format(self.id, self.telegram_id)
 
 
+class DailyTotal(Base):
+    __tablename__ = 'daily_total'
+
+    # running totals of food_log per user and day, maintained by log_food and cancel
+    user_id = Column(Integer(), ForeignKey('user.id', ondelete='cascade'), primary_key=True, nullable=False)
+    date = Column(Date(), primary_key=True, nullable=False)
+    count = Column(Integer(), default=0, nullable=False)
+    calories = Column(Float(), default=0, nullable=False)
+    fat = Column(Float(), default=0, nullable=False)
+    carbs = Column(Float(), default=0, nullable=False)
+    protein = Column(Float(), default=0, nullable=False)
+
+    def __repr__(self):
+        return "<DailyTotal(user_id={}, date={})>".format(self.user_id, self.date)
+
+
 class UserProfile(Base):
     __tablename__ = 'user_profile'
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    user_id = Column(Integer(), ForeignKey('user.id'), nullable=False)
+    user_id = Column(Integer(), ForeignKey('user.id', ondelete='cascade'), nullable=False)
     daily_calories = Column(Float(), default=0, nullable=False)
     daily_fat = Column(Float(), default=0, nullable=False)
     daily_carbs = Column(Float(), default=0, nullable=False)
@@ -208,9 +287,12 @@ class UserProfile(Base):
 
 class DailyReport(Base):
     __tablename__ = 'daily_report'
+    __table_args__ = (
+        Index('idx-daily_report-last_report_date', 'last_report_date'),
+    )
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    user_id = Column(Integer(), ForeignKey('user.id'), nullable=False)
+    user_id = Column(Integer(), ForeignKey('user.id', ondelete='cascade'), unique=True, nullable=False)
     last_report_date = Column(Date(), nullable=False)
 
     user = relationship('User', foreign_keys=user_id,
@@ -222,9 +304,14 @@ class DailyReport(Base):
 
 class FutureMessage(Base):
     __tablename__ = 'future_message'
+    __table_args__ = (
+        Index('idx-future_message-user_id', 'user_id'),
+        Index('idx-future_message-send_at-created_at', 'send_at', 'created_at'),
+        Index('idx-future_message-expires_at', 'expires_at'),
+    )
 
     id = Column(Integer(), primary_key=True, unique=True, nullable=False)
-    user_id = Column(Integer(), ForeignKey('user.id'), nullable=False)
+    user_id = Column(Integer(), ForeignKey('user.id', ondelete='cascade'), nullable=False)
     created_at = Column(DateTime(), nullable=False)
     expires_at = Column(DateTime(), nullable=False)
     send_at = Column(DateTime(), nullable=False)
@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from typing import Optional
+
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import Session
+
+from models import Food, FoodName, FoodUnit, UnitName
+from models.food_index import FoodMatch, FoodNameIndex
+
+# Seconds a loaded catalog is trusted before it is reloaded. Local changes
+# (create_food, create_unit, define_unit_for_food, update_food) invalidate it
+# immediately, the TTL only bounds staleness across several bot processes.
+FOOD_CATALOG_TTL = float(os.getenv('FOOD_CATALOG_TTL', '600'))
+
+CatalogFood = namedtuple('CatalogFood', ['id', 'calories', 'fat', 'carbs', 'protein'])
+
+
+def normalize_name(name: str) -> str:
+    """
+    Names are compared case-insensitively, the same way MySQL compares them
+    with the utf8mb4_unicode_ci collation
+    :param name:
+    :return:
+    """
+    return name.strip().lower()
+
+
+class FoodCatalog:
+    """
+    Immutable snapshot of food and unit names, food units and per-gram macros
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.foods = {}  # food_id: CatalogFood
+        self.food_ids = {}  # (language, normalized name): food_id
+        self.food_names = {}  # (food_id, language): name
+        self.unit_ids = {}  # (language, normalized name): unit_id
+        self.unit_names = {}  # (unit_id, language): name
+        self.food_units = {}  # (food_id, unit_id): grams
+        self.default_units = {}  # food_id: [unit_id, ...]
+        self.gram_unit_id = None
+        self.food_name_indexes = {}  # language: FoodNameIndex, built on first use
+        self.index_lock = threading.Lock()
+
+    def load(self, db_session: Session) -> 'FoodCatalog':
+        for f in db_session.query(Food.id, Food.calories, Food.fat, Food.carbs, Food.protein):
+            self.foods[f.id] = CatalogFood(f.id, f.calories, f.fat, f.carbs, f.protein)
+
+        for fn in db_session.query(FoodName.food_id, FoodName.name, FoodName.language) \
+                .order_by(FoodName.id):
+            self.food_ids[(fn.language, normalize_name(fn.name))] = fn.food_id
+            self.food_names.setdefault((fn.food_id, fn.language), fn.name)
+
+        for un in db_session.query(UnitName.unit_id, UnitName.name, UnitName.language) \
+                .order_by(UnitName.id):
+            self.unit_ids[(un.language, normalize_name(un.name))] = un.unit_id
+            self.unit_names.setdefault((un.unit_id, un.language), un.name)
+
+        for fu in db_session.query(FoodUnit.food_id, FoodUnit.unit_id, FoodUnit.grams, FoodUnit.is_default):
+            self.food_units[(fu.food_id, fu.unit_id)] = fu.grams
+            if fu.is_default:
+                self.default_units.setdefault(fu.food_id, []).append(fu.unit_id)
+
+        self.gram_unit_id = self.unit_ids.get(('en', 'g'))
+        return self
+
+    def is_expired(self) -> bool:
+        return time.monotonic() - self.loaded_at > FOOD_CATALOG_TTL
+
+    def get_food(self, locale: str, food_name: str) -> CatalogFood:
+        """
+        :raises: NoResultFound if no food found with this name
+        """
+        food_id = None if food_name is None else self.food_ids.get((locale, normalize_name(food_name)))
+        if food_id is None or food_id not in self.foods:
+            raise NoResultFound
+        return self.foods[food_id]
+
+    def get_unit_id(self, locale: str, unit_name: str) -> int:
+        """
+        :raises: NoResultFound if no unit found with this name
+        """
+        unit_id = None if unit_name is None else self.unit_ids.get((locale, normalize_name(unit_name)))
+        if unit_id is None:
+            raise NoResultFound
+        return unit_id
+
+    def get_default_unit_id(self, food_id: int) -> int:
+        """
+        :raises: NoResultFound if the food has no default unit
+        """
+        unit_ids = self.default_units.get(food_id, [])
+        if len(unit_ids) != 1:
+            raise NoResultFound
+        return unit_ids[0]
+
+    def get_grams(self, food_id: int, unit_id: int) -> Optional[float]:
+        return self.food_units.get((food_id, unit_id))
+
+    def get_food_name(self, food_id: int, locale: str) -> Optional[str]:
+        return self.food_names.get((food_id, locale))
+
+    def get_unit_name(self, unit_id: int, locale: str) -> Optional[str]:
+        return self.unit_names.get((unit_id, locale))
+
+    def get_food_name_index(self, locale: str) -> FoodNameIndex:
+        index = self.food_name_indexes.get(locale)
+        if index is None:
+            with self.index_lock:
+                index = self.food_name_indexes.get(locale)
+                if index is None:
+                    index = FoodNameIndex((name, food_id) for (language, name), food_id in self.food_ids.items()
+                                          if language == locale and food_id in self.foods)
+                    self.food_name_indexes[locale] = index
+        return index
+
+    def match_food(self, locale: str, food_name: str, limit: int = 3) -> list:
+        """
+        Find foods with names similar to food_name
+        :param locale:
+        :param food_name:
+        :param limit:
+        :return: list of FoodMatch, best first
+        """
+        if food_name is None:
+            return []
+        return [FoodMatch(food_id, self.get_food_name(food_id, locale), score) for food_id, score
+                in self.get_food_name_index(locale).match(normalize_name(food_name), limit)]
+
+
+_catalog = None
+_catalog_version = 0
+_catalog_lock = threading.Lock()
+
+
+def get_food_catalog(db_session: Session) -> FoodCatalog:
+    """
+    Return the current catalog snapshot, loading it if it was invalidated or expired
+    :param db_session:
+    :return:
+    """
+    catalog = _catalog
+    if catalog is not None and not catalog.is_expired():
+        return catalog
+    return _reload_food_catalog(db_session)
+
+
+def _reload_food_catalog(db_session: Session) -> FoodCatalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is not None and not _catalog.is_expired():
+            return _catalog
+        version = _catalog_version
+    catalog = FoodCatalog(version).load(db_session)
+    with _catalog_lock:
+        # don't publish a snapshot if it was invalidated while we were loading
+        if version == _catalog_version:
+            _catalog = catalog
+    return catalog
+
+
+def invalidate_food_catalog() -> None:
+    """
+    Drop the loaded catalog, the next lookup reloads it from the database
+    :return:
+    """
+    global _catalog, _catalog_version
+    with _catalog_lock:
+        _catalog_version += 1
+        _catalog = None
@@ -7,11 +7,11 @@ import i18n
 from sqlalchemy import table, column, Integer, String, insert, func
 from sqlalchemy.exc import NoResultFound, IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy.sql.sqltypes import Date
-from sqlalchemy.sql import text
 
 from exc import FoodNotFound, UnitNotFound, UnitNotDefined
-from models import DailyReport, User, UserProfile, FoodUnit, FoodLog, Food, Unit, FoodName, UnitName, date_now
+from models import CommandLog, DailyReport, DailyTotal, User, UserProfile, FoodUnit, FoodLog, Food, Unit, FoodName, UnitName, date_now
+from models.catalog import get_food_catalog, invalidate_food_catalog
+from models.user_cache import CachedUser, cached_user, user_cache
 from typing import Optional
 
 UTC = timezone('UTC')
@@ -64,6 +64,7 @@ def create_default_units(session: Session):
                     )
                 )
     session.commit()
+    invalidate_food_catalog()
     return gram_unit_id, pc_unit_id
 
 
@@ -73,7 +74,14 @@ def get_gram_unit(db_session: Session) -> Unit:
     :param db_session:
     :return:
     """
-    return db_session.query(UnitName).filter_by(language='en', name='g').one().unit
+    return _get_unit(db_session, get_food_catalog(db_session).gram_unit_id)
+
+
+def _get_unit(db_session: Session, unit_id: int) -> Unit:
+    unit = db_session.get(Unit, unit_id) if unit_id is not None else None
+    if unit is None:
+        raise NoResultFound
+    return unit
 
 
 def get_food_by_name(db_session: Session, locale: str, food_name: str) -> Food:
@@ -84,7 +92,10 @@ def get_food_by_name(db_session: Session, locale: str, food_name: str) -> Food:
     :return:
     :raises: NoResultFound if no food found with this name
     """
-    return db_session.query(FoodName).filter_by(language=locale, name=food_name).one().food
+    food = db_session.get(Food, get_food_catalog(db_session).get_food(locale, food_name).id)
+    if food is None:
+        raise NoResultFound
+    return food
 
 
 def get_or_create_user(db_session: Session, telegram_id) -> Optional[User]:
@@ -112,6 +123,33 @@ def get_or_create_user(db_session: Session, telegram_id) -> Optional[User]:
     return user
 
 
+def get_cached_user(db_session: Session, telegram_id) -> Optional[CachedUser]:
+    """
+    Like get_or_create_user, but the user and the profile are read from the user cache
+    and loaded with one query on a miss
+    :param db_session:
+    :param telegram_id:
+    :return:
+    """
+    telegram_id = int(telegram_id)
+    user = user_cache.get(telegram_id)
+    if user is not None:
+        return user
+
+    row = db_session.query(User, UserProfile) \
+        .join(UserProfile, UserProfile.user_id == User.id) \
+        .filter(User.telegram_id == telegram_id) \
+        .first()
+    if row is None:
+        created = get_or_create_user(db_session, telegram_id)
+        if created is None:
+            return None
+        row = (created, created.profile)
+    user = cached_user(*row)
+    user_cache.put(user)
+    return user
+
+
 def create_unit(db_session: Session, locale: str, unit_name: str) -> Unit:
     """
 
@@ -130,6 +168,7 @@ def create_unit(db_session: Session, locale: str, unit_name: str) -> Unit:
     un = UnitName(unit_id=u.id, language=locale, name=unit_name)
     db_session.add(un)
     db_session.commit()
+    invalidate_food_catalog()
     return u
 
 
@@ -145,9 +184,8 @@ def define_unit_for_food(db_session: Session, food: Food, unit: Unit, grams: flo
     db_session.commit()  # flush?
     if fu.is_default:
         # remove default from other units
-        db_session.execute(text("""UPDATE food_unit SET is_default = :false
-            WHERE food_id = :food_id AND unit_id <> :unit_id"""),
-                           {'false': False, 'food_id': food.id, 'unit_id': unit.id})
+        db_session.query(FoodUnit).filter(FoodUnit.food_id == food.id, FoodUnit.unit_id != unit.id) \
+            .update({FoodUnit.is_default: False}, synchronize_session=False)
         db_session.commit()
     gram_unit = get_gram_unit(db_session)
     if unit.id != gram_unit.id:
@@ -159,6 +197,7 @@ def define_unit_for_food(db_session: Session, food: Food, unit: Unit, grams: flo
                           is_default=False, grams=1)
             db_session.add(fu)
             db_session.commit()
+    invalidate_food_catalog()
 
 
 def get_unit_by_name(db_session: Session, locale: str, unit_name: str) -> Unit:
@@ -169,8 +208,7 @@ def get_unit_by_name(db_session: Session, locale: str, unit_name: str) -> Unit:
     :return:
     :raises: NoResultFound if no unit found with this name
     """
-    return db_session.query(UnitName).filter_by(
-        language=locale, name=unit_name).one().unit
+    return _get_unit(db_session, get_food_catalog(db_session).get_unit_id(locale, unit_name))
 
 
 def get_default_unit_for_food(db_session: Session, food: Food) -> Unit:
@@ -178,9 +216,9 @@ def get_default_unit_for_food(db_session: Session, food: Food) -> Unit:
     :param db_session:
     :param food:
     :return:
+    :raises: NoResultFound if the food has no default unit
     """
-    return db_session.query(FoodUnit).filter_by(
-        food_id=food.id, is_default=True).one().unit
+    return _get_unit(db_session, get_food_catalog(db_session).get_default_unit_id(food.id))
 
 
 def log_food(db_session: Session, locale: str, user: User,
@@ -200,37 +238,114 @@ def log_food(db_session: Session, locale: str, user: User,
     :raises: UnitNotFound if no unit was found with unit_name, locale
     :raises: UnitNotDefined if unit was found but not defined for this food
     """
-    try:
-        food = get_food_by_name(db_session, locale, food_name)
-    except NoResultFound:
-        raise FoodNotFound
+    return log_foods(db_session, locale, user, [(food_name, unit_name, qty)], date)[0]
 
-    if unit_name is None:
-        unit = get_default_unit_for_food(db_session, food)
-    else:
+
+def log_foods(db_session: Session, locale: str, user: User, entries: list, date=None,
+              command_log: CommandLog = None) -> list:
+    """
+    Adds several food log entries for user in one transaction: either all of them or none
+    :param db_session:
+    :param locale:
+    :param user:
+    :param entries: list of (food_name, unit_name, qty)
+    :param date: default: today's date (UTC)
+    :param command_log: the command which logs the entries, added in the same transaction
+    :return: list of FoodLog created log records
+    :raises: FoodNotFound(food_name) if no food was found with food_name, locale
+    :raises: UnitNotFound(food_name, unit_name) if no unit was found with unit_name, locale
+    :raises: UnitNotDefined(food_name, unit_name) if unit was found but not defined for this food
+    """
+    catalog = get_food_catalog(db_session)
+    date = date or date_now()
+    food_logs = []
+    for food_name, unit_name, qty in entries:
         try:
-            unit = get_unit_by_name(db_session, locale, unit_name)
+            food = catalog.get_food(locale, food_name)
         except NoResultFound:
-            raise UnitNotFound
+            raise FoodNotFound(food_name)
 
-    try:
-        food_unit = db_session.query(FoodUnit).filter_by(
-            food_id=food.id,
-            unit_id=unit.id).one()
-    except NoResultFound:
-        raise UnitNotDefined
-
-    multiplier = qty * food_unit.grams
-    food_log = FoodLog(user_id=user.id, food_id=food.id,
-                       unit_id=unit.id, qty=qty,
-                       calories=food.calories * multiplier,
-                       carbs=food.carbs * multiplier,
-                       fat=food.fat * multiplier,
-                       protein=food.protein * multiplier,
-                       date=date)
-    db_session.add(food_log)
+        if unit_name is None:
+            unit_id = catalog.get_default_unit_id(food.id)
+        else:
+            try:
+                unit_id = catalog.get_unit_id(locale, unit_name)
+            except NoResultFound:
+                raise UnitNotFound(food_name, unit_name)
+
+        grams = catalog.get_grams(food.id, unit_id)
+        if grams is None:
+            raise UnitNotDefined(food_name, unit_name)
+
+        multiplier = qty * grams
+        food_logs.append(FoodLog(user_id=user.id, food_id=food.id,
+                                 unit_id=unit_id, qty=qty,
+                                 calories=food.calories * multiplier,
+                                 carbs=food.carbs * multiplier,
+                                 fat=food.fat * multiplier,
+                                 protein=food.protein * multiplier,
+                                 date=date, command_log=command_log))
+    if command_log is not None:
+        db_session.add(command_log)
+    db_session.add_all(food_logs)
+    update_daily_total(db_session, food_logs)
     db_session.commit()
-    return food_log
+    return food_logs
+
+
+def update_daily_total(db_session: Session, food_logs: list, sign: int = 1) -> None:
+    """
+    Add food log entries to (sign=1) or subtract them from (sign=-1) the users' daily totals.
+    Doesn't commit, so the totals change in the same transaction as the entries
+    :param db_session:
+    :param food_logs: list of FoodLog
+    :param sign:
+    :return:
+    """
+    groups = {}
+    for food_log in food_logs:
+        groups.setdefault((food_log.user_id, food_log.date), []).append(food_log)
+    for (user_id, date), group in groups.items():
+        _update_daily_total(db_session, user_id, date, len(group),
+                            sum(f.calories for f in group), sum(f.fat for f in group),
+                            sum(f.carbs for f in group), sum(f.protein for f in group), sign)
+
+
+def _update_daily_total(db_session: Session, user_id: int, date, count: int,
+                        calories: float, fat: float, carbs: float, protein: float, sign: int) -> None:
+    values = {
+        DailyTotal.count: DailyTotal.count + sign * count,
+        DailyTotal.calories: DailyTotal.calories + sign * calories,
+        DailyTotal.fat: DailyTotal.fat + sign * fat,
+        DailyTotal.carbs: DailyTotal.carbs + sign * carbs,
+        DailyTotal.protein: DailyTotal.protein + sign * protein,
+    }
+    query = db_session.query(DailyTotal).filter_by(user_id=user_id, date=date)
+    if query.update(values, synchronize_session=False) > 0:
+        if sign < 0:
+            query.filter(DailyTotal.count <= 0).delete(synchronize_session=False)
+        return
+    if sign < 0:
+        return
+
+    try:
+        with db_session.begin_nested():
+            db_session.execute(insert(DailyTotal).values(
+                user_id=user_id, date=date, count=count,
+                calories=calories, fat=fat, carbs=carbs, protein=protein))
+    except IntegrityError:
+        # the first entry of the day was logged concurrently
+        query.update(values, synchronize_session=False)
+
+
+def get_daily_total(db_session: Session, user_id: int, date) -> Optional[DailyTotal]:
+    """
+    :param db_session:
+    :param user_id:
+    :param date:
+    :return: user's totals for the date or None if nothing is logged
+    """
+    return db_session.get(DailyTotal, (user_id, date))
 
 
 def create_food(db_session: Session, locale: str, food_name: str,
@@ -264,10 +379,34 @@ def create_food(db_session: Session, locale: str, food_name: str,
         db_session).id, grams=1, is_default=True)
     db_session.add(food_unit)
     db_session.commit()
+    invalidate_food_catalog()
 
     return food
 
 
+def update_food(db_session: Session, food: Food,
+                calories: float = 0.0, fat: float = 0.0, carbs: float = 0.0, protein: float = 0.0) -> Food:
+    """
+    Updates food values per 1 gram
+
+    :param db_session:
+    :param food:
+    :param calories:
+    :param fat:
+    :param carbs:
+    :param protein:
+    :return:
+    """
+    food.calories = calories
+    food.fat = fat
+    food.carbs = carbs
+    food.protein = protein
+    db_session.add(food)
+    db_session.commit()
+    invalidate_food_catalog()
+    return food
+
+
 def get_food_name(db_session: Session, food: Food) -> str:
     """
     Return default name for food
@@ -275,9 +414,7 @@ def get_food_name(db_session: Session, food: Food) -> str:
     :param food:
     :return:
     """
-    fn = db_session.query(FoodName).filter_by(
-        food_id=food.id, language=i18n.get('locale')).first()
-    return fn.name if fn else None
+    return get_food_catalog(db_session).get_food_name(food.id, i18n.get('locale'))
 
 
 def get_unit_name(db_session: Session, unit: Unit) -> str:
@@ -287,9 +424,7 @@ def get_unit_name(db_session: Session, unit: Unit) -> str:
     :param unit:
     :return:
     """
-    un = db_session.query(UnitName).filter_by(
-        unit_id=unit.id, language=i18n.get('locale')).first()
-    return un.name if un else None
+    return get_food_catalog(db_session).get_unit_name(unit.id, i18n.get('locale'))
 
 
 def food_log_message(db_session: Session, food_log: FoodLog) -> str:
@@ -298,38 +433,60 @@ def food_log_message(db_session: Session, food_log: FoodLog) -> str:
     :param food_log:
     :return:
     """
-    user_profile = food_log.user.profile
-    query = db_session.query(
-        FoodLog.date,
-        func.sum(FoodLog.calories).label('calories'),
-        func.sum(FoodLog.carbs).label('carbs'),
-        func.sum(FoodLog.fat).label('fat'),
-        func.sum(FoodLog.protein).label('protein')
-    ).filter_by(user_id=food_log.user_id, date=food_log.date).first()
-
-    calories_left = "{:.2f}".format(
-        max(0, user_profile.daily_calories - query.calories))
-    fat_left = "{:.2f}".format(max(0, user_profile.daily_fat - query.fat))
-    carbs_left = "{:.2f}".format(
-        max(0, user_profile.daily_carbs - query.carbs))
-    protein_left = "{:.2f}".format(
-        max(0, user_profile.daily_protein - query.protein))
+    return food_logs_message(db_session, [food_log])
 
-    food_name = get_food_name(db_session, food_log.food)
-    unit_name = get_unit_name(db_session, food_log.unit)
 
-    lines = [
-        i18n.t('Food recorded: %{name} %{qty} %{unit}',
-               name=food_name, qty='{:.1f}'.format(food_log.qty), unit=unit_name),
+def food_logs_message(db_session: Session, food_logs: list) -> str:
+    """
+    Recorded foods, their total and what is left for the day
+    :param db_session:
+    :param food_logs: list of FoodLog of one user and date
+    :return:
+    """
+    user_profile = db_session.query(UserProfile).filter_by(user_id=food_logs[0].user_id).one()
+    calories_left = user_profile.daily_calories
+    fat_left = user_profile.daily_fat
+    carbs_left = user_profile.daily_carbs
+    protein_left = user_profile.daily_protein
+    # no totals if the entries were cancelled in the meantime
+    daily_total = get_daily_total(db_session, food_logs[0].user_id, food_logs[0].date)
+    if daily_total is not None:
+        calories_left -= daily_total.calories
+        fat_left -= daily_total.fat
+        carbs_left -= daily_total.carbs
+        protein_left -= daily_total.protein
+
+    calories_left = "{:.2f}".format(max(0, calories_left))
+    fat_left = "{:.2f}".format(max(0, fat_left))
+    carbs_left = "{:.2f}".format(max(0, carbs_left))
+    protein_left = "{:.2f}".format(max(0, protein_left))
+
+    catalog = get_food_catalog(db_session)
+    lines = []
+    for food_log in food_logs:
+        food_name = catalog.get_food_name(food_log.food_id, i18n.get('locale'))
+        unit_name = catalog.get_unit_name(food_log.unit_id, i18n.get('locale'))
+        lines.append(i18n.t('Food recorded: %{name} %{qty} %{unit}',
+                            name=food_name, qty='{:.1f}'.format(food_log.qty), unit=unit_name))
+
+    if len(food_logs) == 1:
+        calories, fat, carbs, protein = (food_logs[0].calories, food_logs[0].fat,
+                                         food_logs[0].carbs, food_logs[0].protein)
+    else:
+        calories = round(sum(f.calories for f in food_logs), 2)
+        fat = round(sum(f.fat for f in food_logs), 2)
+        carbs = round(sum(f.carbs for f in food_logs), 2)
+        protein = round(sum(f.protein for f in food_logs), 2)
+    lines.extend([
         i18n.t('Calories: %{calories} / %{calories_left}',
-               calories=food_log.calories, calories_left=calories_left),
+               calories=calories, calories_left=calories_left),
         i18n.t('Fat: %{fat} / %{fat_left}',
-               fat=food_log.fat, fat_left=fat_left),
+               fat=fat, fat_left=fat_left),
         i18n.t('Carbs: %{carbs} / %{carbs_left}',
-               carbs=food_log.carbs, carbs_left=carbs_left),
+               carbs=carbs, carbs_left=carbs_left),
         i18n.t('Protein: %{protein} / %{protein_left}',
-               protein=food_log.protein, protein_left=protein_left),
-    ]
+               protein=protein, protein_left=protein_left),
+    ])
     return "\n".join(lines)
 
 
@@ -345,41 +502,68 @@ def daily_report_message(db_session: Session, user: User, date: str) -> str:
     Protein: 10 g (9%)
     ===
     """
-    user_profile = user.profile
+    totals = daily_report_totals(db_session, [user.id], date)
+    if not totals:
+        return None
+    return format_daily_report(totals[0])
+
+
+def daily_report_totals(db_session: Session, user_ids: list, date: str) -> list:
+    """
+    Previous day totals and daily goals of the users, in one query
+    :param db_session:
+    :param user_ids:
+    :param date: report date, totals are calculated for the day before
+    :return: list of rows (user_id, count, calories, fat, carbs, protein, daily_calories, daily_fat,
+        daily_carbs, daily_protein), users who logged nothing are not included
+    """
+    if not user_ids:
+        return []
     datetime_obj = datetime.strptime(date, '%Y-%m-%d')
     yesterday_date = (datetime_obj - timedelta(days=1)).strftime('%Y-%m-%d')
-    query = db_session.query(
-        FoodLog.date,
+    return db_session.query(
+        FoodLog.user_id,
         func.count().label('count'),
         func.sum(FoodLog.calories).label('calories'),
-        func.sum(FoodLog.carbs).label('carbs'),
         func.sum(FoodLog.fat).label('fat'),
-        func.sum(FoodLog.protein).label('protein')
-    ).filter_by(user_id=user.id, date=yesterday_date).first()
-
-    if query is not None and query.count == 0:
-        return None
-
-    calories_percent = 0 if not user_profile.daily_calories \
-        else round(query.calories * 100.0 / user_profile.daily_calories)
-    fat_percent = 0 if not user_profile.daily_fat \
-        else round(query.fat * 100.0 / user_profile.daily_fat)
-    carbs_percent = 0 if not user_profile.daily_carbs \
-        else round(query.carbs * 100.0 / user_profile.daily_carbs)
-    protein_percent = 0 if not user_profile.daily_protein \
-        else round(query.protein * 100.0 / user_profile.daily_protein)
+        func.sum(FoodLog.carbs).label('carbs'),
+        func.sum(FoodLog.protein).label('protein'),
+        UserProfile.daily_calories,
+        UserProfile.daily_fat,
+        UserProfile.daily_carbs,
+        UserProfile.daily_protein
+    ).join(UserProfile, UserProfile.user_id == FoodLog.user_id) \
+        .filter(FoodLog.user_id.in_(user_ids), FoodLog.date == yesterday_date) \
+        .group_by(FoodLog.user_id, UserProfile.daily_calories, UserProfile.daily_fat,
+                  UserProfile.daily_carbs, UserProfile.daily_protein) \
+        .all()
+
+
+def format_daily_report(totals) -> str:
+    """
+    :param totals: row of daily_report_totals
+    :return:
+    """
+    calories_percent = 0 if not totals.daily_calories \
+        else round(totals.calories * 100.0 / totals.daily_calories)
+    fat_percent = 0 if not totals.daily_fat \
+        else round(totals.fat * 100.0 / totals.daily_fat)
+    carbs_percent = 0 if not totals.daily_carbs \
+        else round(totals.carbs * 100.0 / totals.daily_carbs)
+    protein_percent = 0 if not totals.daily_protein \
+        else round(totals.protein * 100.0 / totals.daily_protein)
 
     lines = [
         i18n.t('Time for your daily statistics!'),
         i18n.t('Yesterday you consumed:'),
         i18n.t('Calories: %{calories} (%{percent}%)',
-               calories=round(query.calories), percent=calories_percent),
+               calories=round(totals.calories), percent=calories_percent),
         i18n.t('Fat: %{fat} (%{percent}%)',
-               fat=round(query.fat), percent=fat_percent),
+               fat=round(totals.fat), percent=fat_percent),
         i18n.t('Carbs: %{carbs} (%{percent}%)',
-               carbs=round(query.carbs), percent=carbs_percent),
+               carbs=round(totals.carbs), percent=carbs_percent),
         i18n.t('Protein: %{protein} (%{percent}%)',
-               protein=round(query.protein), percent=protein_percent),
+               protein=round(totals.protein), percent=protein_percent),
     ]
 
     return "\n".join(lines)
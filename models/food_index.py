@@ -0,0 +1,122 @@
+import heapq
+import math
+import os
+from collections import Counter, namedtuple
+from itertools import chain
+from operator import itemgetter
+
+# similarity (Dice coefficient of name trigrams) needed to show a food as a suggestion
+FOOD_MATCH_MIN_SCORE = float(os.getenv('FOOD_MATCH_MIN_SCORE', '0.4'))
+# similarity needed to log the best match instead of the unknown name...
+FOOD_MATCH_AUTO_SCORE = float(os.getenv('FOOD_MATCH_AUTO_SCORE', '0.75'))
+# ...if the second best food is at least this much worse
+FOOD_MATCH_MARGIN = float(os.getenv('FOOD_MATCH_MARGIN', '0.1'))
+# names counted per lookup in the postings of the rarest trigrams, see FoodNameIndex.match...
+MAX_COUNTED_NAMES = 1000
+# ...and the most of them scored
+MAX_SCORED_NAMES = 100
+
+FoodMatch = namedtuple('FoodMatch', ['food_id', 'name', 'score'])
+
+
+def trigrams(name: str) -> set:
+    """
+    :param name: normalized name
+    :return: set of trigrams, padded the same way as pg_trgm does
+    """
+    padded = '  {} '.format(' '.join(name.split()))
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def is_confident_match(matches: list) -> bool:
+    """
+    :param matches: result of FoodNameIndex.match
+    :return: True if the best match can be used without asking the user
+    """
+    if not matches or matches[0].score < FOOD_MATCH_AUTO_SCORE:
+        return False
+    return len(matches) == 1 or matches[0].score - matches[1].score >= FOOD_MATCH_MARGIN
+
+
+class FoodNameIndex:
+    """
+    Trigram index over food names of one language
+    """
+
+    def __init__(self, names):
+        """
+        :param names: iterable of (normalized name, food_id)
+        """
+        self.food_ids = []
+        self.sizes = []
+        self.postings = {}  # trigram: [name number, ...]
+        self.posting_sets = {}  # trigram: {name number, ...} for frequent trigrams, built on use
+        for name, food_id in names:
+            grams = trigrams(name)
+            number = len(self.food_ids)
+            self.food_ids.append(food_id)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(number)
+
+    def __len__(self):
+        return len(self.food_ids)
+
+    def get_posting_set(self, gram: str) -> set:
+        posting_set = self.posting_sets.get(gram)
+        if posting_set is None:
+            posting_set = self.posting_sets[gram] = set(self.postings.get(gram, ()))
+        return posting_set
+
+    def match(self, name: str, limit: int = 3, min_score: float = FOOD_MATCH_MIN_SCORE) -> list:
+        """
+        :param name: normalized name
+        :param limit:
+        :param min_score:
+        :return: list of (food_id, score) of the most similar foods, best first
+        """
+        grams = trigrams(name)
+        if not grams:
+            return []
+        # a name shares no more trigrams than it has, so it needs at least min_common shared
+        # trigrams to reach min_score. Names are found by the rarest trigrams of the query, up to
+        # MAX_COUNTED_NAMES postings; the frequent ones (like the first letter) are only looked up
+        # for the names found. A name which shares only frequent trigrams is missed: it is hardly
+        # the misspelled one
+        size = len(grams)
+        min_common = max(1, math.ceil(min_score * size / (2.0 - min_score)))
+        grams = sorted(grams, key=lambda gram: len(self.postings.get(gram, ())))
+        rare = 0
+        counted = 0
+        for gram in grams:
+            counted += len(self.postings.get(gram, ()))
+            if rare and counted > MAX_COUNTED_NAMES:
+                break
+            rare += 1
+        common = Counter(chain.from_iterable(self.postings.get(gram, ()) for gram in grams[:rare]))
+        frequent = [self.get_posting_set(gram) for gram in grams[rare:]]
+
+        # names sharing more counted trigrams first, at most MAX_SCORED_NAMES of them: a name which
+        # shares k trigrams scores at most 2k / (size + k), stop when the rest can't beat the foods found
+        scores = {}
+        worst_score = min_score
+        last_count = None
+        for number, count in sorted(common.items(), key=itemgetter(1), reverse=True)[:MAX_SCORED_NAMES]:
+            if count != last_count:
+                last_count = count
+                if len(scores) >= limit:
+                    worst_score = heapq.nlargest(limit, scores.values())[-1]
+                best_common = count + len(frequent)
+                if best_common < min_common or 2.0 * best_common / (size + best_common) < worst_score:
+                    break
+            for posting_set in frequent:
+                if number in posting_set:
+                    count += 1
+            if count < min_common:
+                continue
+            score = 2.0 * count / (size + self.sizes[number])
+            food_id = self.food_ids[number]
+            # a food can have several names, keep the best one
+            if score >= min_score and score > scores.get(food_id, 0.0):
+                scores[food_id] = score
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
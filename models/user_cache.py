@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Optional
+
+from sqlalchemy import event
+
+from models import User, UserProfile
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+# Seconds a cached user is trusted. Profile changes made through the ORM invalidate
+# the entry immediately, the TTL only bounds staleness across several bot processes.
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+
+CachedProfile = namedtuple('CachedProfile', ['daily_calories', 'daily_fat', 'daily_carbs', 'daily_protein'])
+# has the attributes of User which commands use
+CachedUser = namedtuple('CachedUser', ['id', 'telegram_id', 'profile'])
+
+
+class UserCache:
+    """
+    LRU cache of telegram_id: CachedUser with expiration
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # telegram_id: (CachedUser, loaded_at)
+        self.telegram_ids = {}  # user_id: telegram_id
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, telegram_id: int) -> Optional[CachedUser]:
+        with self.lock:
+            entry = self.entries.get(telegram_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                self._remove(telegram_id)
+                return None
+            self.entries.move_to_end(telegram_id)
+            return entry[0]
+
+    def put(self, user: CachedUser) -> None:
+        with self.lock:
+            self._remove(user.telegram_id)
+            self.entries[user.telegram_id] = (user, time.monotonic())
+            self.telegram_ids[user.id] = user.telegram_id
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, user_id: int) -> None:
+        with self.lock:
+            telegram_id = self.telegram_ids.get(user_id)
+            if telegram_id is not None:
+                self._remove(telegram_id)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.telegram_ids.clear()
+
+    def _remove(self, telegram_id: int) -> None:
+        entry = self.entries.pop(telegram_id, None)
+        if entry is not None:
+            self.telegram_ids.pop(entry[0].id, None)
+
+
+user_cache = UserCache()
+
+
+def cached_user(user: User, profile: UserProfile) -> CachedUser:
+    return CachedUser(user.id, user.telegram_id, CachedProfile(
+        profile.daily_calories, profile.daily_fat, profile.daily_carbs, profile.daily_protein))
+
+
+@event.listens_for(UserProfile, 'after_update')
+@event.listens_for(UserProfile, 'after_delete')
+def _invalidate_profile(mapper, connection, target: UserProfile):
+    user_cache.invalidate(target.user_id)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user(mapper, connection, target: User):
+    user_cache.invalidate(target.id)
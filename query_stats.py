@@ -0,0 +1,126 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# an update or a job over any of these is logged with its statements
+SLOW_UPDATE_QUERIES = int(os.getenv('SLOW_UPDATE_QUERIES', '30'))
+SLOW_UPDATE_SECONDS = float(os.getenv('SLOW_UPDATE_SECONDS', '1.0'))
+# SELECTs slower than this get EXPLAIN in the log, disabled if empty
+SLOW_QUERY_EXPLAIN_SECONDS = os.getenv('SLOW_QUERY_EXPLAIN_SECONDS', '')
+# distinct statements listed in the log
+SLOW_UPDATE_LOG_STATEMENTS = 10
+
+
+class QueryStats:
+    """
+    Statements executed on behalf of one update or job, see query_scope
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = {}  # statement: [count, seconds]
+        self.explains = {}  # statement: EXPLAIN output
+
+    def add(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        stats = self.statements.setdefault(statement, [0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+
+    def format(self, elapsed: float) -> str:
+        lines = ['{}: {} queries, {:.3f} s in SQL, {:.3f} s total'.format(
+            self.name, self.count, self.seconds, elapsed)]
+        top = sorted(self.statements.items(), key=lambda item: (item[1][0], item[1][1]), reverse=True)
+        for statement, (count, seconds) in top[:SLOW_UPDATE_LOG_STATEMENTS]:
+            lines.append('  {} × {:.3f} s: {}'.format(count, seconds, ' '.join(statement.split())))
+            if statement in self.explains:
+                lines.append('    EXPLAIN: {}'.format(self.explains[statement]))
+        return '\n'.join(lines)
+
+
+# run_in_db_session copies the context into the database thread, so statements
+# executed there are counted too
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar('current_query_stats', default=None)
+
+
+@contextmanager
+def query_scope(name: str):
+    """
+    with query_scope('today_command') as stats: ... count the statements executed in the block
+    and log the block if it is slow or issues too many of them
+    :param name: update handler or job name
+    :return:
+    """
+    stats = QueryStats(name)
+    token = current_query_stats.set(stats)
+    started_at = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        current_query_stats.reset(token)
+        elapsed = time.perf_counter() - started_at
+        if stats.count > SLOW_UPDATE_QUERIES or elapsed > SLOW_UPDATE_SECONDS:
+            logger.warning("Slow update {}".format(stats.format(elapsed)))
+
+
+def explain(conn, statement: str, parameters) -> str:
+    """
+    :param conn: connection the statement ran on
+    :param statement:
+    :param parameters:
+    :return: query plan, one row per line
+    """
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return ' | '.join(', '.join(str(value) for value in row) for row in cursor.fetchall())
+    except Exception as e:
+        return 'failed: {}'.format(e)
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_query_stats.get() is not None:
+        conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_query_stats.get()
+    if stats is None or not conn.info.get('query_started_at'):
+        return
+    seconds = time.perf_counter() - conn.info['query_started_at'].pop()
+    stats.add(statement, seconds)
+    if SLOW_QUERY_EXPLAIN_SECONDS and seconds > float(SLOW_QUERY_EXPLAIN_SECONDS) and not executemany \
+            and statement not in stats.explains and statement.lstrip().upper().startswith('SELECT'):
+        stats.explains[statement] = explain(conn, statement, parameters)
+
+
+def _handle_error(exception_context):
+    # the failed statement has no after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started_at'):
+        connection.info['query_started_at'].pop()
+
+
+def track_queries(engine: Engine) -> None:
+    """
+    Attribute the statements executed on the engine to the current query_scope
+    :param engine:
+    :return:
+    """
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
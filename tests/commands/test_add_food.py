@@ -249,3 +249,29 @@ def test_valid_request_grams(db_session, owner_user, no_food, default_units):
         assert food_log.fat == 0.24
         assert food_log.carbs == 16.8
         assert food_log.protein == 0.36
+
+
+def test_request_with_suggestions(db_session, owner_user, no_food, default_units):
+    """
+    The repeated request still doesn't find the food, but there are similar ones:
+    the replies are plain messages
+    """
+    with do_test_setup(db_session, owner_user, no_food, default_units):
+        owner_user = db_session.query(User).one()
+        owner_tid = str(owner_user.telegram_id)
+        user = get_or_create_user(db_session, 12345)
+        tid = str(user.telegram_id)
+        create_food(db_session, i18n.get('locale'), 'Apple pie', 2.37, 0.11, 0.34, 0.02)
+        create_food(db_session, i18n.get('locale'), 'Apple juice', 0.46, 0.001, 0.11, 0.001)
+
+        food_entry(db_session, user, 'Apple 100 g')
+        request = db_session.query(FoodRequest).one()
+
+        messages = add_food(
+            db_session, owner_user,
+            '/add_food Pear --calories=57 --fat=0.1 --carbs=15 --protein=0.4 --request={}'.format(request.id))
+        assert all(isinstance(message, str) for message in messages.values())
+        assert messages[owner_tid].startswith(i18n.t('Food added'))
+        assert messages[tid].startswith(i18n.t('The food was not found, forwarding request to the owner'))
+        assert 'Apple pie 100 g' in messages[tid]
+        assert db_session.query(FoodLog).count() == 0
@@ -0,0 +1,32 @@
+import os
+from datetime import datetime, timedelta
+
+import i18n
+
+from commands.botstats_command import botstats
+from models import DailyReport, FutureMessage, User, utc_now
+from models.core import get_or_create_user
+
+
+def test_botstats(db_session, owner_user):
+    db_session.query(FutureMessage).delete()
+    db_session.query(DailyReport).delete()
+    owner = db_session.query(User).filter_by(telegram_id=os.environ['OWNER_TELEGRAM_ID']).one()
+    for minutes in [5, 1, -10]:
+        send_at = utc_now() - timedelta(minutes=minutes)
+        db_session.add(FutureMessage(user_id=owner.id, created_at=send_at, expires_at=datetime(2100, 1, 1),
+                                     send_at=send_at, locked_until=send_at, message='Hi'))
+    db_session.add(DailyReport(user_id=owner.id, last_report_date=utc_now().date() - timedelta(days=2)))
+    db_session.commit()
+
+    messages = botstats(db_session, owner, '/botstats')
+    message = messages[os.environ['OWNER_TELEGRAM_ID']]
+    assert 'Future messages due: 2, oldest: 3' in message
+    assert 'Daily reports due: 1, lag: 2 days' in message
+
+    user = get_or_create_user(db_session, telegram_id='12345')
+    assert botstats(db_session, user, '/botstats') == {'12345': i18n.t('Invalid user id')}
+
+    db_session.query(FutureMessage).delete()
+    db_session.query(DailyReport).delete()
+    db_session.commit()
@@ -7,8 +7,8 @@ from sqlalchemy import desc
 from commands.cancel_command import cancel
 from commands.food_entry_command import food_entry
 from commands.weight_entry_command import weight_entry
-from models import User, CommandLog, WeightLog, FoodLog
-from models.core import get_or_create_user, create_food
+from models import User, CommandLog, WeightLog, FoodLog, DailyTotal, date_now
+from models.core import get_or_create_user, create_food, get_daily_total, log_food
 
 
 @contextmanager
@@ -31,6 +31,7 @@ def test_cancel_last(db_session, no_food, no_users):
         food_entry(db_session, user, 'Chicken soup 100 g')
         assert db_session.query(CommandLog).count() == 1
         assert db_session.query(FoodLog).count() == 1
+        assert get_daily_total(db_session, user.id, date_now()).count == 1
 
         command_log = db_session.query(CommandLog).order_by(desc('id')).first()
         assert command_log.command_type == CommandLog.FOOD_ENTRY
@@ -60,7 +61,48 @@ def test_cancel_last(db_session, no_food, no_users):
         assert db_session.query(WeightLog).count() == 0
         assert db_session.query(CommandLog).count() == 0
         assert db_session.query(FoodLog).count() == 0
+        assert db_session.query(DailyTotal).count() == 0
 
         messages = cancel(db_session, user, '/cancel')
         assert tid in messages
         assert i18n.t('Nothing to cancel') == messages[tid]
+
+
+def test_cancel_several_foods(db_session, no_food, no_users):
+    with do_test_setup(db_session, no_food, no_users):
+        user = get_or_create_user(db_session, 12345)
+        create_food(db_session, i18n.get('locale'), 'Chicken soup',
+                    0.36, 0.012, 0.035, 0.025)
+        create_food(db_session, i18n.get('locale'), 'Bread', 2.65, 0.032, 0.49, 0.09)
+
+        food_entry(db_session, user, 'Bread 30 g')
+        food_entry(db_session, user, 'Chicken soup 100 g, bread 50 g')
+        assert db_session.query(FoodLog).count() == 3
+        assert get_daily_total(db_session, user.id, date_now()).count == 3
+
+        cancel(db_session, user, '/cancel')
+        food_log = db_session.query(FoodLog).one()
+        assert food_log.qty == 30
+        assert get_daily_total(db_session, user.id, date_now()).count == 1
+
+
+def test_cancel_deletes_only_logged_by_command(db_session, no_food, no_users):
+    with do_test_setup(db_session, no_food, no_users):
+        user = get_or_create_user(db_session, 12345)
+        create_food(db_session, i18n.get('locale'), 'Chicken soup',
+                    0.36, 0.012, 0.035, 0.025)
+        create_food(db_session, i18n.get('locale'), 'Bread', 2.65, 0.032, 0.49, 0.09)
+
+        food_entry(db_session, user, 'Bread 30 g; chicken soup 100 g')
+        command_log = db_session.query(CommandLog).one()
+        assert [f.command_log_id for f in db_session.query(FoodLog)] == [command_log.id, command_log.id]
+
+        # logged without a command, e.g. by another session in the meantime
+        log_food(db_session, i18n.get('locale'), user, 'Bread', 'g', 50)
+
+        cancel(db_session, user, '/cancel')
+        food_log = db_session.query(FoodLog).one()
+        assert food_log.qty == 50
+        assert food_log.command_log_id is None
+        assert db_session.query(CommandLog).count() == 0
+        assert get_daily_total(db_session, user.id, date_now()).count == 1
@@ -6,6 +6,7 @@ from datetime import datetime
 
 import i18n
 
+from chart_cache import weight_chart_cache
 from commands.date_label_command import MAX_LABEL_LENGTH, date_label
 from models import DateLabel, User, WeightLog
 from models.core import get_or_create_user
@@ -48,8 +49,8 @@ def test_add_and_remove_date_label_redraw_charts(db_session, no_users):
             date=label_date,
             label='Vacation',
         )
-        assert os.path.exists(messages[tid]['plot_file'])
-        assert os.path.exists(messages[owner_id]['plot_file'])
+        assert messages[tid]['chart'] is messages[owner_id]['chart']
+        assert [label for _, label in messages[tid]['chart']['date_labels']] == ['Vacation']
 
         messages = date_label(db_session, user, '/label {} Workout'.format(label_date))
 
@@ -63,8 +64,8 @@ def test_add_and_remove_date_label_redraw_charts(db_session, no_users):
             date=label_date,
             label='Workout',
         )
-        assert os.path.exists(messages[tid]['plot_file'])
-        assert os.path.exists(messages[owner_id]['plot_file'])
+        assert messages[tid]['chart'] is messages[owner_id]['chart']
+        assert [label for _, label in messages[tid]['chart']['date_labels']] == ['Workout']
 
         messages = date_label(db_session, user, '/unlabel {}'.format(label_date))
 
@@ -74,8 +75,8 @@ def test_add_and_remove_date_label_redraw_charts(db_session, no_users):
             date=label_date,
             label='Workout',
         )
-        assert os.path.exists(messages[tid]['plot_file'])
-        assert os.path.exists(messages[owner_id]['plot_file'])
+        assert messages[tid]['chart'] is messages[owner_id]['chart']
+        assert [label for _, label in messages[tid]['chart']['date_labels']] == []
 
 
 def test_date_label_validates_label_length(db_session, no_users):
@@ -93,3 +94,22 @@ def test_date_label_validates_label_length(db_session, no_users):
             count=MAX_LABEL_LENGTH,
         )
         assert db_session.query(DateLabel).count() == 0
+
+
+def test_unchanged_chart_is_taken_from_cache(db_session, no_users, no_weight_charts):
+    with do_test_setup(db_session, no_users):
+        user = get_or_create_user(db_session, 12345)
+        tid = str(user.telegram_id)
+        label_date = create_weight_logs(db_session, user)
+
+        messages = date_label(db_session, user, '/unlabel {}'.format(label_date))
+        chart = messages[tid]['chart']
+        assert 'weights' in chart
+        weight_chart_cache.put(chart['key'], png=b'png')
+
+        messages = date_label(db_session, user, '/unlabel {}'.format(label_date))
+        assert messages[tid]['chart'] == {'key': chart['key'], 'cached': {'png': b'png', 'file_id': None}}
+
+        messages = date_label(db_session, user, '/label {} Vacation'.format(label_date))
+        assert messages[tid]['chart']['key'] != chart['key']
+        assert 'weights' in messages[tid]['chart']
@@ -4,10 +4,10 @@ from contextlib import contextmanager
 import i18n
 from sqlalchemy import desc
 
-from commands.food_entry_command import food_entry, parse_food_entry_message
-from models import FoodLog, date_now, User, FoodRequest
+from commands.food_entry_command import food_entry, food_entry_replies, parse_food_entries, parse_food_entry_message
+from models import FoodLog, date_now, User, FoodRequest, CommandLog
 from models.core import create_food, create_unit, define_unit_for_food, get_or_create_user, \
-    get_gram_unit
+    get_gram_unit, get_daily_total
 
 
 @contextmanager
@@ -39,6 +39,23 @@ def test_parse_food_entry():
         assert (food_name, unit_name, qty) == parse_food_entry_message(entry)
 
 
+def test_parse_food_entries():
+    data = [
+        ('', []),
+        ('Apple 2', [('Apple', 2.0, None)]),
+        ('Oatmeal 60 g, milk 200 ml, banana 1',
+         [('Oatmeal', 60.0, 'g'), ('milk', 200.0, 'ml'), ('banana', 1.0, None)]),
+        ('Bread, white 1 slice', [('Bread, white', 1.0, 'slice')]),
+        ('Apple, 4,6 g', [('Apple', 4.6, 'g')]),
+        ('Tea; sugar 2 tsp', [('Tea', 1.0, None), ('sugar', 2.0, 'tsp')]),
+        ('Tea\n\nCake 1, cheese 20 g;', [('Tea', 1.0, None), ('Cake', 1.0, None), ('cheese', 20.0, 'g')]),
+        ('Yoghurt 3%, muesli 40', [('Yoghurt 3%, muesli', 40.0, None)]),
+        ('Каша 200 г, молоко 100 мл', [('Каша', 200.0, 'г'), ('молоко', 100.0, 'мл')]),
+    ]
+    for message, entries in data:
+        assert parse_food_entries(message) == entries
+
+
 def test_invalid_command(db_session, no_users, no_food, default_units):
     with do_test_setup(db_session, no_users, no_food, default_units):
         assert db_session.query(User).count() == 0
@@ -203,3 +220,57 @@ def test_success(db_session, no_users, no_food, default_units):
         assert food_log.fat == 2.1
         assert food_log.carbs == 6.125
         assert food_log.protein == 4.375
+
+
+def test_similar_food(db_session, no_users, no_food, default_units):
+    with do_test_setup(db_session, no_users, no_food, default_units):
+        create_food(db_session, i18n.get('locale'), 'Chicken soup', 0.36, 0.012, 0.035, 0.025)
+        create_food(db_session, i18n.get('locale'), 'Apple pie', 2.37, 0.11, 0.34, 0.02)
+        create_food(db_session, i18n.get('locale'), 'Apple juice', 0.46, 0.001, 0.11, 0.001)
+        user = get_or_create_user(db_session, 12345)
+        tid = str(user.telegram_id)
+        owner_id = os.getenv('OWNER_TELEGRAM_ID')
+
+        # a typo is resolved to the only similar food
+        messages = food_entry(db_session, user, 'Chiken soup 200 g')
+        assert i18n.t('Food added') in messages[tid]
+        assert i18n.t('Recognized as: %{name}', name='Chicken soup') in messages[tid]
+        food_log = db_session.query(FoodLog).one()
+        assert food_log.qty == 200
+        assert db_session.query(FoodRequest).count() == 0
+
+        # several similar foods are suggested, the request still goes to the owner
+        messages, suggestions = food_entry_replies(db_session, user, 'Apple 100 g')
+        assert messages[tid].startswith(i18n.t('The food was not found, forwarding request to the owner'))
+        assert sorted(suggestions) == ['Apple juice 100 g', 'Apple pie 100 g']
+        assert i18n.t('Please add new food (values per 100 g)') in messages[owner_id]
+        assert db_session.query(FoodLog).count() == 1
+        assert db_session.query(FoodRequest).count() == 1
+
+        # without a keyboard the suggestions are listed in the message
+        messages = food_entry(db_session, user, 'Apple 100 g')
+        assert 'Apple juice 100 g' in messages[tid] and 'Apple pie 100 g' in messages[tid]
+
+
+def test_several_foods(db_session, no_users, no_food, default_units):
+    with do_test_setup(db_session, no_users, no_food, default_units):
+        create_food(db_session, i18n.get('locale'), 'Oatmeal', 3.7, 0.06, 0.6, 0.13)
+        create_food(db_session, i18n.get('locale'), 'Milk', 0.5, 0.025, 0.05, 0.03)
+        user = get_or_create_user(db_session, 12345)
+        tid = str(user.telegram_id)
+
+        # nothing is logged when one of the foods is unknown
+        messages = food_entry(db_session, user, 'Oatmeal 60 g, milk 200 g, dragonfruit 1')
+        assert messages[tid] == i18n.t('The food was not found, forwarding request to the owner')
+        assert db_session.query(FoodLog).count() == 0
+        assert db_session.query(FoodRequest).count() == 1
+
+        messages = food_entry(db_session, user, 'Oatmeal 60 g, milk 200 g')
+        # one reply: both foods and one remainder
+        assert i18n.t('Food added') in messages[tid]
+        assert len(messages[tid].splitlines()) == 7
+        assert db_session.query(FoodLog).count() == 2
+        assert db_session.query(CommandLog).count() == 1
+        daily_total = get_daily_total(db_session, user.id, date_now())
+        assert daily_total.count == 2
+        assert round(daily_total.calories) == 322
@@ -1,7 +1,9 @@
 from contextlib import contextmanager
 
 import i18n
-from commands.router import router
+from commands.cancel_command import get_cancel_pattern
+from commands.router import route, router
+from commands.weight_entry_command import get_weight_entry_pattern
 from commands import weight_entry_command, food_entry_command, today_command, cancel_command, date_label_command
 
 
@@ -48,3 +50,24 @@ def test_router(db_session, no_users):
         ]
         for row in data:
             assert row[1] == router(row[0]), 'Failed for {}'.format(row[0])
+
+
+def test_route_pre_parses(db_session, no_users):
+    with do_test_setup(db_session, no_users):
+        handler, match = route(' /weight 60,5 ')
+        assert handler == weight_entry_command
+        assert match.groups()[2] == '60,5'
+
+        handler, match = route(i18n.t('Cancel'))
+        assert handler == cancel_command
+        assert match is not None
+
+        # the label is parsed by the handler
+        assert route('/label 2026-07-16 Vacation') == (date_label_command, None)
+        assert route('/today') == (today_command, None)
+        assert route('Apple 1') == (food_entry_command, None)
+
+        # compiled once per locale, parsed once per message
+        assert get_weight_entry_pattern() is get_weight_entry_pattern(i18n.get('locale'))
+        assert get_cancel_pattern() is get_cancel_pattern()
+        assert route('/weight 61') is route('/weight 61')
@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+
+import i18n
+
+from commands.today_command import today
+from models.catalog import get_food_catalog
+from models.core import create_food, get_or_create_user, log_food
+
+
+@contextmanager
+def do_test_setup(db_session, no_users, no_food, default_units):
+    yield
+
+
+def test_today(db_session, no_users, no_food, default_units):
+    with do_test_setup(db_session, no_users, no_food, default_units):
+        user = get_or_create_user(db_session, telegram_id='12345')
+        assert today(db_session, user).startswith(i18n.t('No entries today'))
+
+        create_food(db_session, 'en', 'Apple',
+                    calories=0.5, fat=0.25, carbs=0.125, protein=0.0625)
+        log_food(db_session, locale='en', user=user,
+                 food_name='Apple', unit_name='g', qty=100)
+
+        lines = today(db_session, user).split("\n")
+        assert lines[1].endswith('| Apple 100.0 g | 50 | 25.00 | 12.50 | 6.25')
+        assert lines[-1] == '{:.0f} | {:.2f} | {:.2f} | {:.2f}'.format(
+            user.profile.daily_calories - 50, user.profile.daily_fat - 25,
+            user.profile.daily_carbs - 12.5, user.profile.daily_protein - 6.25)
+
+
+def test_today_query_count_does_not_grow(db_session, no_users, no_food, default_units, recorded_statements):
+    with do_test_setup(db_session, no_users, no_food, default_units):
+        user = get_or_create_user(db_session, telegram_id='12345')
+        create_food(db_session, 'en', 'Apple',
+                    calories=0.5, fat=0.25, carbs=0.125, protein=0.0625)
+
+        counts = []
+        for entries in [1, 9]:
+            for _ in range(entries):
+                log_food(db_session, locale='en', user=user,
+                         food_name='Apple', unit_name='g', qty=100)
+            get_food_catalog(db_session)
+            db_session.expire_all()
+            with recorded_statements() as statements:
+                today(db_session, user)
+            counts.append(len(statements))
+
+        assert counts[0] == counts[1]
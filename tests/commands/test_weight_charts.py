@@ -1,15 +1,20 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from types import SimpleNamespace
 
+import numpy as np
 import pandas as pd
 
 from weight_charts import (
     CHART_HEIGHT_INCHES,
+    MAX_LINE_POINTS,
     close_weight_chart_figure,
     create_weight_chart_figure,
+    downsample_lttb,
     get_weight_axis_limits,
     get_smoothed_weight_line,
     get_weight_chart_ranges,
+    render_weight_chart,
 )
 
 
@@ -62,6 +67,30 @@ def test_weight_line_is_smoothed_when_enough_points_are_available():
     assert len(line_weights) == len(line_dates)
 
 
+def test_lttb_keeps_ends_and_peaks():
+    x = np.arange(10000, dtype=float)
+    y = np.sin(x / 500)
+    y[4321] = 10
+
+    indices = downsample_lttb(x, y, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 9999
+    assert np.all(np.diff(indices) > 0)
+    assert 4321 in indices
+    assert list(downsample_lttb(x[:50], y[:50], 100)) == list(range(50))
+
+
+def test_weight_line_is_capped_at_figure_width():
+    now = datetime(2026, 6, 11, 12)
+    df = pd.DataFrame({
+        'created_at': [now - timedelta(hours=hours) for hours in range(5000, 0, -1)],
+        'weight': [70 + (hours % 7) / 10 for hours in range(5000)],
+    })
+
+    dates, weights = get_smoothed_weight_line(df)
+    assert len(dates) == len(weights) == MAX_LINE_POINTS
+
+
 def test_weight_axis_limits_include_padding_around_rendered_line():
     low, high = get_weight_axis_limits([70, 72], [69.5, 73])
 
@@ -88,3 +117,33 @@ def test_weight_chart_renders_date_labels_with_legend():
         assert all(not handle.get_visible() for handle in legend.legend_handles)
     finally:
         close_weight_chart_figure(fig)
+
+
+def test_weight_chart_templates_are_reused_in_place():
+    now = datetime(2026, 6, 11, 12)
+    labelled = [(now - timedelta(days=days)).timestamp() for days in [30, 20, 3, 1]]
+    labelled = [(created_at, 70 + index) for index, created_at in enumerate(labelled)]
+    other = [((now - timedelta(days=days)).timestamp(), 90 - days / 10) for days in [25, 6, 2, 0]]
+    date_labels = [((now - timedelta(days=2)).date(), 'Start')]
+
+    first = render_weight_chart(labelled, date_labels, now)
+    fig = create_weight_chart_figure([('Month', weight_df(now, [2, 0]))])
+    try:
+        assert fig.get_axes()[0].get_legend() is None
+        assert render_weight_chart(other, [], now) != first
+    finally:
+        close_weight_chart_figure(fig)
+    assert render_weight_chart(labelled, date_labels, now) == first
+
+
+def test_weight_charts_render_concurrently():
+    now = datetime(2026, 6, 11, 12)
+    histories = [
+        [((now - timedelta(days=days)).timestamp(), 60 + seed + days % (seed + 2)) for days in range(200, -1, -seed)]
+        for seed in range(1, 9)
+    ]
+    expected = [render_weight_chart(weights, [], now) for weights in histories]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        rendered = list(executor.map(lambda weights: render_weight_chart(weights, [], now), histories * 3))
+    assert rendered == expected * 3
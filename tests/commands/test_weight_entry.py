@@ -1,12 +1,18 @@
+import importlib
 import os
 import shutil
 from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
 
 import i18n
+import pytest
 from sqlalchemy import desc
 from sqlalchemy.sql import text
 
-from commands.weight_entry_command import weight_entry
+from chart_cache import weight_chart_cache
+from commands.weight_entry_command import send_weight_chart, send_weight_replies, weight_entry
+from exc import ChartRendererBusy
 from models import User, WeightLog
 from models.core import get_or_create_user
 from utils import TEMP_PATH
@@ -80,13 +86,12 @@ def test_valid_command(db_session, no_users):
             assert messages[tid]['message'] == reply
             assert messages[owner_id]['message'] == reply
             if log_count == 1:
-                assert 'plot_file' not in messages[tid]
-                assert 'plot_file' not in messages[owner_id]
+                assert 'chart' not in messages[tid]
+                assert 'chart' not in messages[owner_id]
             else:
-                assert 'plot_file' in messages[tid]
-                assert 'plot_file' in messages[owner_id]
-                assert os.path.exists(messages[tid]['plot_file'])
-                assert os.path.exists(messages[owner_id]['plot_file'])
+                assert 'chart' in messages[tid]
+                assert messages[owner_id]['chart'] is messages[tid]['chart']
+                assert len(messages[tid]['chart']['weights']) == log_count
             assert db_session.query(WeightLog).count() == log_count
             weight_log = db_session.query(
                 WeightLog).order_by(desc('id')).first()
@@ -99,3 +104,46 @@ def test_valid_command(db_session, no_users):
 
         db_session.execute(text("""DELETE FROM weight_log"""))
         db_session.commit()
+
+
+@pytest.mark.asyncio
+async def test_chart_is_delayed_when_renderer_is_busy(monkeypatch):
+    async def busy_renderer(*args, **kwargs):
+        raise ChartRendererBusy
+
+    weight_entry_module = importlib.import_module('commands.weight_entry_command')
+    monkeypatch.setattr(weight_entry_module, 'render_weight_chart', busy_renderer)
+    context = MagicMock()
+    context.bot.send_message = AsyncMock()
+    context.bot.send_photo = AsyncMock()
+    chart_data = {'weights': [], 'date_labels': [], 'current_time': None}
+    messages = {
+        '1': {'message': 'Weight recorded: 50.0', 'chart': chart_data},
+        '2': {'message': 'Weight recorded: 50.0', 'chart': chart_data},
+    }
+
+    await send_weight_replies(context, messages)
+
+    sent = [call.args for call in context.bot.send_message.await_args_list]
+    assert sent == [
+        ('1', 'Weight recorded: 50.0'),
+        ('2', 'Weight recorded: 50.0'),
+        ('1', i18n.t('Chart is coming shortly')),
+        ('2', i18n.t('Chart is coming shortly')),
+    ]
+    context.bot.send_photo.assert_not_awaited()
+    context.application.create_task.assert_called_once()
+    context.application.create_task.call_args.args[0].close()
+
+
+@pytest.mark.asyncio
+async def test_chart_is_uploaded_once(no_weight_charts):
+    bot = MagicMock()
+    bot.send_photo = AsyncMock(return_value=SimpleNamespace(
+        photo=[SimpleNamespace(file_id='small'), SimpleNamespace(file_id='large')]))
+
+    await send_weight_chart(bot, ['1', '2'], 'test-chart', b'png')
+
+    sent = [call.args for call in bot.send_photo.await_args_list]
+    assert sent == [('1', b'png'), ('2', 'large')]
+    assert weight_chart_cache.get('test-chart') == {'png': None, 'file_id': 'large'}
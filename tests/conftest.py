@@ -1,13 +1,21 @@
 import os
+from contextlib import contextmanager
 
 import i18n
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
-from db import get_db_url
-from models import User, FoodName, Food, UnitName, Unit, FoodRequest, FoodLog
+if os.getenv('DB_BACKEND') == 'sqlite':
+    # DB_BACKEND=sqlite pytest runs without the MySQL container, on a fresh in-memory database
+    os.environ.setdefault('DB_PATH', ':memory:')
+
+from chart_cache import weight_chart_cache
+from db import create_schema, db_engine, get_db_url, is_sqlite
+from models import User, FoodName, Food, UnitName, Unit, FoodRequest, FoodLog, DailyTotal
+from models.catalog import invalidate_food_catalog
 from models.core import create_default_units, get_or_create_user
+from models.user_cache import user_cache
 
 i18n.load_path.append('./translations')
 i18n.set('filename_format', '{locale}.{format}')
@@ -27,7 +35,12 @@ def db_credentials():
 
 @pytest.fixture(scope='module')
 def db_session(db_credentials):
-    engine = create_engine(get_db_url())
+    if is_sqlite():
+        # the same engine as the commands use, an in-memory database exists only in it
+        engine = db_engine
+        create_schema(engine)
+    else:
+        engine = create_engine(get_db_url())
     session = sessionmaker(bind=engine)()
     yield session
 
@@ -37,6 +50,7 @@ def no_users(db_session):
     os.environ['ALLOW_NEW_USERS'] = '1'
     db_session.query(User).delete()
     db_session.commit()
+    user_cache.clear()
 
 
 @pytest.fixture(scope='function')
@@ -44,6 +58,7 @@ def no_users_disabled(db_session):
     os.environ['ALLOW_NEW_USERS'] = '0'
     db_session.query(User).delete()
     db_session.commit()
+    user_cache.clear()
 
 
 @pytest.fixture(scope='function')
@@ -52,16 +67,27 @@ def owner_user(db_session):
     os.environ['OWNER_TELEGRAM_ID'] = '111222333'
     db_session.query(User).delete()
     db_session.commit()
+    user_cache.clear()
     get_or_create_user(db_session, telegram_id=os.environ['OWNER_TELEGRAM_ID'])
 
 
+@pytest.fixture(scope='function')
+def no_weight_charts():
+    # the chart cache is global, a chart cached by one test must not be a cache hit in another
+    weight_chart_cache.clear()
+    yield
+    weight_chart_cache.clear()
+
+
 @pytest.fixture(scope='function')
 def no_food(db_session):
+    db_session.query(DailyTotal).delete()
     db_session.query(FoodLog).delete()
     db_session.query(FoodRequest).delete()
     db_session.query(FoodName).delete()
     db_session.query(Food).delete()
     db_session.commit()
+    invalidate_food_catalog()
 
 
 @pytest.fixture(scope='function')
@@ -69,4 +95,27 @@ def default_units(db_session):
     db_session.query(UnitName).delete()
     db_session.query(Unit).delete()
     db_session.commit()
+    invalidate_food_catalog()
     gram_unit_id, pc_unit_id = create_default_units(session=db_session)
+
+
+@pytest.fixture(scope='function')
+def recorded_statements(db_session):
+    """
+    with recorded_statements() as statements: ... collects SQL statements executed in the block
+    """
+    @contextmanager
+    def record():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = db_session.get_bind()
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    return record
@@ -78,3 +78,35 @@ async def test_daily_report(db_session, no_users, no_food, default_units):
         assert report_message is not None
         await daily_report_job(db_session=db_session)
         assert len(db_session.query(FutureMessage).all()) == 1
+
+
+@pytest.mark.asyncio
+async def test_daily_report_batch(db_session, no_users, no_food, default_units):
+    with do_test_setup(db_session, no_users, no_food, default_units):
+        today_date = date_now()
+        yesterday_date = (datetime.strptime(today_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+        create_food(db_session, 'en', 'Apple',
+                    calories=0.52, fat=0.002, carbs=0.14, protein=0.003)
+
+        users = []
+        for i in range(3):
+            user = get_or_create_user(db_session, telegram_id=str(12345 + i))
+            user.daily_report.last_report_date = yesterday_date
+            db_session.add(user.daily_report)
+            db_session.commit()
+            users.append(user)
+
+        # the third user logged nothing yesterday
+        for qty, user in zip([100, 200], users):
+            log_food(db_session, locale='en', user=user,
+                     food_name='Apple', unit_name='g', qty=qty,
+                     date=yesterday_date)
+
+        expected = {u.id: daily_report_message(db_session=db_session, user=u, date=today_date) for u in users[:2]}
+
+        await daily_report_job(db_session=db_session)
+
+        messages = {m.user_id: m.message for m in db_session.query(FutureMessage).all()}
+        assert messages == expected
+        assert db_session.query(DailyReport) \
+            .filter(DailyReport.last_report_date < today_date).count() == 0
@@ -0,0 +1,86 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from db import create_db_engine, create_schema, get_db_url, is_sqlite
+from jobs.future_message_job import delete_future_messages, lock_future_messages
+from models import FutureMessage
+from models.core import get_or_create_user
+
+
+@contextmanager
+def do_test_setup(db_session, no_users):
+    db_session.query(FutureMessage).delete()
+    db_session.commit()
+    yield
+
+
+def test_messages_are_claimed_once(db_session, no_users):
+    with do_test_setup(db_session, no_users):
+        user = get_or_create_user(db_session, telegram_id='12345')
+        for i in range(5):
+            db_session.add(FutureMessage(user_id=user.id, created_at=func.now(), expires_at=datetime(2100, 1, 1),
+                                         send_at=func.now(), locked_until=func.now(), message=str(i)))
+        db_session.commit()
+
+        # a second job instance, possibly in another bot process
+        other_session = Session(bind=db_session.get_bind())
+        try:
+            first = lock_future_messages(db_session, limit=3)
+            second = lock_future_messages(other_session, limit=3)
+            third = lock_future_messages(other_session, limit=3)
+        finally:
+            other_session.close()
+
+        assert len(first) == 3
+        assert len(second) == 2
+        assert third == []
+        assert {m[0] for m in first}.isdisjoint({m[0] for m in second})
+        assert {m[1] for m in first + second} == {12345}
+
+        delete_future_messages(db_session, [m[0] for m in first + second])
+        assert db_session.query(FutureMessage).count() == 0
+
+
+def test_concurrent_jobs_claim_messages_once(db_session, no_users, tmp_path):
+    with do_test_setup(db_session, no_users):
+        # a file: every connection to the in-memory test database is the same one
+        engine = create_db_engine('sqlite:///{}'.format(tmp_path / 'fatbot.sqlite') if is_sqlite() else get_db_url())
+        if is_sqlite():
+            create_schema(engine)
+        with Session(bind=engine) as setup_session:
+            user_id = get_or_create_user(setup_session, telegram_id='12345').id
+
+        jobs = 4
+        for round_number in range(20):
+            with Session(bind=engine) as setup_session:
+                for i in range(3):
+                    setup_session.add(FutureMessage(user_id=user_id, created_at=datetime(2000, 1, 1, 0, 0, i),
+                                                    expires_at=datetime(2100, 1, 1), send_at=datetime(2000, 1, 1),
+                                                    locked_until=datetime(2000, 1, 1), message=str(i)))
+                setup_session.commit()
+
+            barrier = threading.Barrier(jobs)
+            claimed = []
+
+            def job():
+                with Session(bind=engine) as job_session:
+                    barrier.wait()
+                    claimed.append(lock_future_messages(job_session, limit=3))
+
+            threads = [threading.Thread(target=job) for _ in range(jobs)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            ids = [m[0] for messages in claimed for m in messages]
+            with Session(bind=engine) as cleanup_session:
+                delete_future_messages(cleanup_session, ids)
+            assert sorted(ids) == sorted(set(ids)), 'round {}'.format(round_number)
+            assert len(ids) == 3
+
+        engine.dispose()
@@ -0,0 +1,66 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from telegram.error import Forbidden, NetworkError, RetryAfter
+
+from jobs.message_dispatcher import MessageDispatcher, RateLimiter
+
+
+def test_rate_limiter_slots():
+    limiter = RateLimiter(rate=10, chat_interval=1)
+    assert limiter.reserve('1', 100.0) == 100.0
+    # global rate: next message for another chat in 1/10 s
+    assert limiter.reserve('2', 100.0) == pytest.approx(100.1)
+    # per-chat interval: the same chat waits a second
+    assert limiter.reserve('1', 100.0) == pytest.approx(101.0)
+    # other chats are not held up by it
+    assert limiter.reserve('3', 100.0) == pytest.approx(100.3)
+    assert limiter.reserve('1', 100.0) == pytest.approx(102.0)
+    assert limiter.reserve('4', 100.0) == pytest.approx(100.5)
+
+
+@pytest.mark.asyncio
+async def test_dispatch():
+    bot = MagicMock()
+    bot.send_message = AsyncMock(side_effect=[
+        None,
+        RetryAfter(0),
+        None,
+        Forbidden('Forbidden: bot was blocked by the user'),
+        NetworkError('Bad Gateway'),
+    ])
+    dispatcher = MessageDispatcher(limiter=RateLimiter(rate=1000, chat_interval=0), concurrency=1,
+                                   max_retries=3)
+
+    done = await dispatcher.dispatch(bot, [(1, '1', 'one'), (2, '2', 'two'), (3, '3', 'three'), (4, '4', 'four')])
+
+    # 2 is retried after RetryAfter, 3 is dropped for good, 4 stays queued
+    assert done == [1, 2, 3]
+    assert bot.send_message.await_count == 5
+    stats = dispatcher.stats()
+    assert stats['sent'] == 2
+    assert stats['retried'] == 1
+    assert stats['dropped'] == 1
+    assert stats['failed'] == 1
+    assert stats['last_batch_size'] == 4
+
+
+@pytest.mark.asyncio
+async def test_dispatch_busy_chat_does_not_delay_others():
+    sent_at = {}
+
+    async def send_message(chat_id, text):
+        sent_at[text] = asyncio.get_running_loop().time()
+
+    bot = MagicMock()
+    bot.send_message = AsyncMock(side_effect=send_message)
+    dispatcher = MessageDispatcher(limiter=RateLimiter(rate=1000, chat_interval=0.5), concurrency=2)
+    started_at = asyncio.get_running_loop().time()
+
+    messages = [(i, 'owner', 'owner {}'.format(i)) for i in range(3)] + [(10 + i, str(i), str(i)) for i in range(3)]
+    done = await dispatcher.dispatch(bot, messages)
+
+    assert done == [m[0] for m in messages]
+    assert max(sent_at[str(i)] for i in range(3)) - started_at < 0.25
+    assert sent_at['owner 2'] - sent_at['owner 0'] >= 0.9
@@ -0,0 +1,64 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from telegram.error import TelegramError
+
+from jobs.owner_digest_job import MAX_MESSAGE_LENGTH, OwnerDigest
+
+
+def test_take_digest():
+    digest = OwnerDigest(max_size=2, queue_limit=4)
+    for i in range(5):
+        digest.add('message {}'.format(i))
+    # the oldest one is dropped
+    assert len(digest) == 4
+    assert digest.is_full()
+    assert digest.take_digest() == 'message 1\nmessage 2'
+    assert digest.take_digest() == 'message 3\nmessage 4'
+    assert digest.take_digest() == ''
+
+    digest.add('a' * (MAX_MESSAGE_LENGTH - 10))
+    digest.add('b' * 20)
+    assert digest.take_digest() == 'a' * (MAX_MESSAGE_LENGTH - 10)
+    assert digest.take_digest() == 'b' * 20
+
+
+@pytest.mark.asyncio
+async def test_flush():
+    bot = MagicMock()
+    bot.send_message = AsyncMock()
+    digest = OwnerDigest(max_size=2)
+    for i in range(3):
+        digest.add('message {}'.format(i))
+
+    await digest.flush(bot, owner_tid='1')
+
+    assert len(digest) == 0
+    assert [c.kwargs['text'] for c in bot.send_message.await_args_list] == ['message 0\nmessage 1', 'message 2']
+
+
+@pytest.mark.asyncio
+async def test_flush_keeps_notifications_when_sending_fails():
+    bot = MagicMock()
+    bot.send_message = AsyncMock(side_effect=TelegramError('Network error'))
+    digest = OwnerDigest(max_size=2, queue_limit=4)
+    for i in range(3):
+        digest.add('message {}'.format(i))
+
+    await digest.flush(bot, owner_tid='1')
+
+    # one attempt per flush, nothing lost
+    assert bot.send_message.await_count == 1
+    assert list(digest.queue) == ['message 0', 'message 1', 'message 2']
+
+    # still unreachable: the oldest are dropped over the limit
+    digest.add('message 3')
+    digest.add('message 4')
+    await digest.flush(bot, owner_tid='1')
+    assert list(digest.queue) == ['message 1', 'message 2', 'message 3', 'message 4']
+
+    bot.send_message = AsyncMock()
+    await digest.flush(bot, owner_tid='1')
+    assert len(digest) == 0
+    assert [c.kwargs['text'] for c in bot.send_message.await_args_list] == [
+        'message 1\nmessage 2', 'message 3\nmessage 4']
@@ -1,4 +1,4 @@
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 
 import i18n
 import pytest
@@ -36,3 +36,44 @@ async def test_register_bot_commands_sets_telegram_command_panel(fatbot_module):
     await fatbot_module.register_bot_commands(application)
 
     application.bot.set_my_commands.assert_awaited_once_with(fatbot_module.BOT_COMMANDS)
+
+
+def test_allowed_updates_cover_registered_handlers(fatbot_module, monkeypatch):
+    from telegram import Update
+    from telegram.ext import CallbackQueryHandler, ChatMemberHandler
+
+    monkeypatch.setenv('FUTURE_MESSAGE_JOBS', '1')
+    application = fatbot_module.create_application('123:token')
+    assert fatbot_module.get_allowed_updates(application) == [Update.MESSAGE]
+
+    application.add_handler(ChatMemberHandler(AsyncMock()))
+    assert fatbot_module.get_allowed_updates(application) == [
+        Update.MESSAGE, Update.MY_CHAT_MEMBER, Update.CHAT_MEMBER]
+
+    # nothing is filtered out if a handler of unknown kind is registered
+    application.add_handler(CallbackQueryHandler(AsyncMock()))
+    assert fatbot_module.get_allowed_updates(application) == Update.ALL_TYPES
+
+
+def test_main_runs_webhook(fatbot_module, monkeypatch):
+    from telegram.ext import Application
+
+    monkeypatch.setenv('FUTURE_MESSAGE_JOBS', '1')
+    create_application = fatbot_module.create_application
+    monkeypatch.setattr(fatbot_module, 'create_application', lambda: create_application('123:token'))
+    monkeypatch.setattr(fatbot_module, 'WEBHOOK_URL', 'https://bot.example.com/fatbot/updates')
+    monkeypatch.setattr(fatbot_module, 'WEBHOOK_SECRET_TOKEN', 'secret')
+    run_webhook = MagicMock()
+    run_polling = MagicMock()
+    monkeypatch.setattr(Application, 'run_webhook', run_webhook)
+    monkeypatch.setattr(Application, 'run_polling', run_polling)
+
+    fatbot_module.main()
+
+    run_polling.assert_not_called()
+    run_webhook.assert_called_once()
+    kwargs = run_webhook.call_args.kwargs
+    assert kwargs['url_path'] == 'fatbot/updates'
+    assert kwargs['webhook_url'] == 'https://bot.example.com/fatbot/updates'
+    assert kwargs['secret_token'] == 'secret'
+    assert kwargs['allowed_updates'] == ['message']
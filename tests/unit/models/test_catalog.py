@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy.exc import NoResultFound
+
+from models.catalog import get_food_catalog
+from models.core import create_food, create_unit, define_unit_for_food, get_food_by_name, get_or_create_user, \
+    log_food, update_food, get_unit_by_name
+
+
+@contextmanager
+def do_test_setup(db_session, no_users, no_food, default_units):
+    yield
+
+
+def test_catalog_is_invalidated_by_changes(db_session, no_users, no_food, default_units):
+    with do_test_setup(db_session, no_users, no_food, default_units):
+        catalog = get_food_catalog(db_session)
+        with pytest.raises(NoResultFound):
+            catalog.get_food('en', 'Bread')
+
+        bread = create_food(db_session, 'en', 'Bread',
+                            calories=2.65, fat=0.032, carbs=0.49, protein=0.09)
+        assert get_food_catalog(db_session) is not catalog
+        assert get_food_catalog(db_session).get_food('en', 'bread').id == bread.id
+        assert get_food_by_name(db_session, 'en', 'BREAD').id == bread.id
+
+        slice_unit = create_unit(db_session, 'en', 'Slice')
+        assert get_unit_by_name(db_session, 'en', 'slice').id == slice_unit.id
+        assert get_food_catalog(db_session).get_grams(bread.id, slice_unit.id) is None
+
+        define_unit_for_food(db_session, bread, slice_unit, grams=30, is_default=True)
+        catalog = get_food_catalog(db_session)
+        assert catalog.get_grams(bread.id, slice_unit.id) == 30
+        assert catalog.get_default_unit_id(bread.id) == slice_unit.id
+
+        update_food(db_session, bread, calories=2.5, fat=0.03, carbs=0.5, protein=0.1)
+        assert get_food_catalog(db_session).get_food('en', 'Bread').calories == 2.5
+
+
+def test_log_food_with_loaded_catalog_only_writes(db_session, no_users, no_food, default_units, recorded_statements):
+    with do_test_setup(db_session, no_users, no_food, default_units):
+        create_food(db_session, 'en', 'Apple',
+                    calories=0.52, fat=0.002, carbs=0.14, protein=0.003)
+        user = get_or_create_user(db_session, telegram_id='12345')
+        assert user.id is not None
+        get_food_catalog(db_session)
+        log_food(db_session, locale='en', user=user,
+                 food_name='Apple', unit_name='g', qty=100)
+        assert user.id is not None
+
+        with recorded_statements() as statements:
+            log_food(db_session, locale='en', user=user,
+                     food_name='Apple', unit_name='g', qty=100)
+
+        # the entry and the daily total, nothing is read
+        assert len(statements) == 2
+        assert statements[0].lstrip().upper().startswith('INSERT INTO FOOD_LOG')
+        assert statements[1].lstrip().upper().startswith('UPDATE DAILY_TOTAL')
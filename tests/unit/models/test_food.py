@@ -5,9 +5,9 @@ import pytest
 from sqlalchemy.exc import NoResultFound
 
 from exc import FoodNotFound, UnitNotFound, UnitNotDefined
-from models import Food, FoodName, FoodLog, date_now, FoodUnit
+from models import DailyTotal, Food, FoodName, FoodLog, date_now, FoodUnit
 from models.core import get_food_by_name, create_food, get_or_create_user, log_food, create_unit, define_unit_for_food, \
-    get_gram_unit
+    get_gram_unit, get_daily_total, food_log_message
 
 
 @contextmanager
@@ -91,3 +91,42 @@ def test_log_food(db_session, no_food, default_units):
             unit_id=get_gram_unit(db_session).id).one()
         assert bread_gram_unit.grams == 1
         assert not bread_gram_unit.is_default
+
+
+def test_daily_total(db_session, no_food, default_units):
+    with do_test_setup(db_session, no_food, default_units):
+        user = get_or_create_user(db_session, telegram_id='12345')
+        create_food(db_session, 'en', 'Apple',
+                    calories=0.5, fat=0.25, carbs=0.125, protein=0.0625)
+        assert get_daily_total(db_session, user.id, date_now()) is None
+
+        for qty in [100, 200]:
+            log_food(db_session, locale='en', user=user,
+                     food_name='Apple', unit_name='g', qty=qty)
+        log_food(db_session, locale='en', user=user,
+                 food_name='Apple', unit_name='g', qty=400,
+                 date='2000-01-01')
+
+        totals = get_daily_total(db_session, user.id, date_now())
+        assert totals.count == 2
+        assert totals.calories == 150
+        assert totals.fat == 75
+        assert totals.carbs == 37.5
+        assert totals.protein == 18.75
+        assert get_daily_total(db_session, user.id, '2000-01-01').calories == 200
+
+
+def test_food_log_message_without_daily_total(db_session, no_food, default_units):
+    with do_test_setup(db_session, no_food, default_units):
+        user = get_or_create_user(db_session, telegram_id='12345')
+        create_food(db_session, 'en', 'Apple',
+                    calories=0.5, fat=0.25, carbs=0.125, protein=0.0625)
+        food_log = log_food(db_session, locale='en', user=user,
+                            food_name='Apple', unit_name='g', qty=100)
+
+        # the entry is cancelled by another update before the reply is made
+        db_session.query(DailyTotal).delete()
+        db_session.commit()
+        assert get_daily_total(db_session, user.id, date_now()) is None
+
+        assert food_log_message(db_session, food_log)
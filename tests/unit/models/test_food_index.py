@@ -0,0 +1,30 @@
+from models.food_index import FoodMatch, FoodNameIndex, is_confident_match, trigrams
+
+
+def test_trigrams():
+    assert trigrams('tea') == {'  t', ' te', 'tea', 'ea '}
+    assert trigrams('green  tea') == trigrams('green tea')
+
+
+def test_match():
+    index = FoodNameIndex([('apple', 1), ('apple pie', 2), ('pineapple', 3), ('chicken soup', 4), ('apples', 1)])
+    assert len(index) == 5
+
+    matches = index.match('aple')
+    assert [food_id for food_id, score in matches] == [1, 2]
+    assert matches[0][1] > matches[1][1]
+    assert [food_id for food_id, score in index.match('aple', min_score=0.2)] == [1, 2, 3]
+
+    # the best of several names of one food counts
+    assert index.match('apples')[0] == (1, 1.0)
+    assert index.match('chiken soup', limit=1)[0][0] == 4
+    assert index.match('bread') == []
+    assert index.match('') == []
+
+
+def test_is_confident_match():
+    assert not is_confident_match([])
+    assert is_confident_match([FoodMatch(1, 'Apple', 0.8)])
+    assert not is_confident_match([FoodMatch(1, 'Apple', 0.5)])
+    assert not is_confident_match([FoodMatch(1, 'Apple', 0.8), FoodMatch(2, 'Apple pie', 0.75)])
+    assert is_confident_match([FoodMatch(1, 'Apple', 0.9), FoodMatch(2, 'Apple pie', 0.6)])
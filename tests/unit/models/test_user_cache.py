@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+
+from models.core import get_cached_user, get_or_create_user
+from models.user_cache import CachedProfile, CachedUser, UserCache, user_cache
+
+
+@contextmanager
+def do_test_setup(db_session, no_users):
+    yield
+
+
+def test_user_cache():
+    cache = UserCache(max_size=2, ttl=60)
+    profile = CachedProfile(1538, 44, 205, 94)
+    for i in range(1, 4):
+        cache.put(CachedUser(i, 100 + i, profile))
+    assert len(cache) == 2
+    assert cache.get(101) is None
+    assert cache.get(102).id == 2
+
+    cache.invalidate(2)
+    assert cache.get(102) is None
+    assert cache.get(103).id == 3
+
+    cache.ttl = -1
+    assert cache.get(103) is None
+    assert len(cache) == 0
+
+
+def test_get_cached_user(db_session, no_users, recorded_statements):
+    with do_test_setup(db_session, no_users):
+        user = get_cached_user(db_session, '12345')
+        assert user.telegram_id == 12345
+        assert user.profile.daily_calories > 0
+
+        with recorded_statements() as statements:
+            assert get_cached_user(db_session, 12345) == user
+        assert statements == []
+
+        profile = get_or_create_user(db_session, 12345).profile
+        profile.daily_calories = 2000
+        db_session.add(profile)
+        db_session.commit()
+        assert user_cache.get(12345) is None
+        assert get_cached_user(db_session, 12345).profile.daily_calories == 2000
+
+
+def test_get_cached_user_disabled(db_session, no_users_disabled):
+    assert get_cached_user(db_session, 12345) is None
+    assert user_cache.get(12345) is None
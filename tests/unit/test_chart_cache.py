@@ -0,0 +1,32 @@
+from chart_cache import ChartCache
+
+
+def test_least_recently_used_chart_is_evicted():
+    cache = ChartCache(max_size=2, max_bytes=1000)
+    cache.put('a', png=b'a')
+    cache.put('b', png=b'b')
+    assert cache.get('a') == {'png': b'a', 'file_id': None}
+    cache.put('c', png=b'c')
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_cache_size_is_limited_in_bytes():
+    cache = ChartCache(max_size=10, max_bytes=10)
+    cache.put('a', png=b'x' * 6)
+    cache.put('b', png=b'x' * 6)
+
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+    assert cache.total_bytes == 6
+
+
+def test_uploaded_chart_keeps_only_file_id():
+    cache = ChartCache(max_size=10, max_bytes=10)
+    cache.put('a', png=b'x' * 6)
+    cache.put('a', file_id='file')
+
+    assert cache.get('a') == {'png': None, 'file_id': 'file'}
+    assert cache.total_bytes == 0
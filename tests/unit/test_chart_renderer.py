@@ -0,0 +1,31 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import chart_renderer
+from exc import ChartRendererBusy
+
+
+def chart_data(now):
+    return {
+        'weights': [(int((now - timedelta(days=days)).timestamp()), 70 + days) for days in [20, 3, 0]],
+        'date_labels': [(now.date(), 'Start')],
+        'current_time': now,
+    }
+
+
+@pytest.mark.asyncio
+async def test_render_weight_chart_in_worker_process():
+    try:
+        chart = await chart_renderer.render_weight_chart(chart_data(datetime.now()))
+        assert chart.startswith(b'\x89PNG')
+    finally:
+        chart_renderer.stop_chart_renderer()
+
+
+@pytest.mark.asyncio
+async def test_render_weight_chart_rejects_requests_when_saturated(monkeypatch):
+    monkeypatch.setattr(chart_renderer, '_slots', asyncio.Semaphore(0))
+    with pytest.raises(ChartRendererBusy):
+        await chart_renderer.render_weight_chart(chart_data(datetime.now()))
@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.orm import Session
+
+from db import TimedQueuePool, create_db_engine, create_schema, get_db_url, get_pool_stats, pool_stats, \
+    run_in_db_session, session_scope
+from models import Unit
+
+
+@pytest.mark.asyncio
+async def test_run_in_db_session_runs_off_the_event_loop():
+    calls = []
+
+    def func(db_session, value):
+        calls.append((db_session, threading.current_thread()))
+        return value * 2
+
+    assert await run_in_db_session(func, 21) == 42
+    db_session, thread = calls[0]
+    assert thread is not threading.current_thread()
+    assert not db_session.in_transaction()
+
+
+def test_session_scope_closes_on_error():
+    sessions = []
+    with pytest.raises(ValueError):
+        with session_scope() as db_session:
+            sessions.append(db_session)
+            db_session.execute(text('SELECT 1'))
+            assert db_session.in_transaction()
+            raise ValueError
+    assert not sessions[0].in_transaction()
+
+
+def test_pool_stats(tmp_path):
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'pool.db'), poolclass=TimedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.1)
+    checkouts = pool_stats.checkouts
+    timeouts = pool_stats.timeouts
+    with engine.connect():
+        assert pool_stats.checkouts == checkouts + 1
+        with pytest.raises(TimeoutError):
+            engine.connect()
+    assert pool_stats.timeouts == timeouts + 1
+    assert pool_stats.max_wait_seconds >= 0.1
+    assert set(get_pool_stats()) >= {'size', 'checked_out', 'overflow', 'checkouts', 'wait_seconds'}
+
+
+
+def test_sqlite_url(monkeypatch):
+    monkeypatch.setenv('DB_BACKEND', 'sqlite')
+    monkeypatch.setenv('DB_PATH', '/var/lib/fatbot/fatbot.sqlite')
+    assert get_db_url() == 'sqlite:////var/lib/fatbot/fatbot.sqlite'
+    monkeypatch.setenv('DB_PATH', ':memory:')
+    assert get_db_url() == 'sqlite://'
+    monkeypatch.setenv('DB_BACKEND', 'mysql')
+    assert get_db_url().startswith('mysql://')
+
+
+def test_sqlite_engine(tmp_path):
+    engine = create_db_engine('sqlite:///{}'.format(tmp_path / 'fatbot.sqlite'))
+    with engine.connect() as connection:
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert connection.execute(text('PRAGMA foreign_keys')).scalar() == 1
+
+    create_schema(engine)
+    create_schema(engine)
+    with Session(bind=engine) as db_session:
+        # created once, gram and pc
+        assert db_session.query(Unit).count() == 2
@@ -0,0 +1,115 @@
+import io
+import json
+
+import pytest
+
+from import_foods import import_foods, read_foods
+from models import Food, FoodName, FoodUnit, User
+from models.catalog import get_food_catalog
+from models.core import create_food, log_food
+
+CSV = """name_en,name_ru,calories,fat,carbs,protein,units,default_unit
+Apple,Яблоко,52,0.2,14,0.3,pc=180,pc
+Bread,,265,3.2,49,9,,
+Egg,Яйцо,155,11,1.1,13,pc=50;tbsp=15,pc
+Salt,,0,0,0,0,,
+"""
+
+
+def test_read_csv():
+    foods = list(read_foods(io.StringIO(CSV), 'csv'))
+    assert foods[0].names == {'en': 'Apple', 'ru': 'Яблоко'}
+    assert foods[0].values == {'calories': 52, 'fat': 0.2, 'carbs': 14, 'protein': 0.3}
+    assert foods[0].units == {'pc': 180}
+    assert foods[0].default_unit == 'pc'
+    assert foods[1].names == {'en': 'Bread'}
+    assert foods[1].units == {}
+    assert foods[1].default_unit is None
+    assert foods[2].units == {'pc': 50, 'tbsp': 15}
+
+
+def test_read_jsonl_errors():
+    lines = [
+        json.dumps({'names': {'en': 'Apple'}, 'calories': 52, 'units': {'pc': 180}, 'default_unit': 'pc'}),
+        '',
+        json.dumps({'names': {}, 'calories': 52}),
+        '{"names": ',
+        json.dumps({'names': {'en': 'Tea'}, 'calories': -1}),
+        json.dumps({'names': {'en': 'Tea'}, 'default_unit': 'cup'}),
+    ]
+    foods = list(read_foods(lines, 'jsonl'))
+    assert foods[0].names == {'en': 'Apple'}
+    assert foods[0].values['calories'] == 52
+    assert foods[0].values['fat'] == 0
+    assert [f[0] for f in foods[1:]] == [3, 4, 5, 6]
+
+
+def test_import(db_session, no_food, default_units):
+    create_food(db_session, 'en', 'Apple', calories=0.5)
+    report = import_foods(db_session, read_foods(io.StringIO(CSV), 'csv'), chunk_size=2)
+
+    # Egg has an unknown unit
+    assert (report.added, report.updated, len(report.errors)) == (2, 1, 1)
+    assert report.errors[0][0] == 4
+
+    catalog = get_food_catalog(db_session)
+    apple = catalog.get_food('ru', 'яблоко')
+    assert apple.id == catalog.get_food('en', 'apple').id
+    assert apple.calories == pytest.approx(0.52)
+    pc_unit_id = catalog.get_unit_id('en', 'pc')
+    assert catalog.get_grams(apple.id, pc_unit_id) == 180
+    assert catalog.get_default_unit_id(apple.id) == pc_unit_id
+
+    bread = catalog.get_food('en', 'bread')
+    assert bread.carbs == pytest.approx(0.49)
+    assert catalog.get_default_unit_id(bread.id) == catalog.gram_unit_id
+    assert catalog.get_grams(bread.id, catalog.gram_unit_id) == 1
+
+    # importing again updates everything and adds nothing
+    report = import_foods(db_session, read_foods(io.StringIO(CSV), 'csv'))
+    assert (report.added, report.updated, report.names) == (0, 3, 0)
+    assert db_session.query(Food).count() == 3
+    assert db_session.query(FoodName).count() == 4
+    assert db_session.query(FoodUnit).filter_by(food_id=apple.id).count() == 2
+
+
+def test_duplicates_in_file(db_session, no_food, default_units):
+    lines = [
+        json.dumps({'names': {'en': 'Tea'}, 'calories': 1}),
+        json.dumps({'names': {'en': 'tea', 'ru': 'Чай'}, 'calories': 2, 'units': {'pc': 200}}),
+    ]
+    report = import_foods(db_session, read_foods(lines, 'jsonl'))
+    assert (report.added, report.updated, report.names) == (1, 0, 2)
+
+    catalog = get_food_catalog(db_session)
+    tea = catalog.get_food('ru', 'чай')
+    assert tea.calories == pytest.approx(0.02)
+    assert catalog.get_grams(tea.id, catalog.get_unit_id('en', 'pc')) == 200
+    assert catalog.get_default_unit_id(tea.id) == catalog.gram_unit_id
+
+
+def test_dry_run(db_session, no_food, default_units):
+    report = import_foods(db_session, read_foods(io.StringIO(CSV), 'csv'), dry_run=True)
+    assert (report.added, report.updated, report.names, len(report.errors)) == (3, 0, 4, 1)
+    assert 'Foods added: 3' in str(report)
+    assert db_session.query(Food).count() == 0
+
+
+def test_reimport_keeps_default_unit(db_session, owner_user, no_food, default_units):
+    lines = [json.dumps({'names': {'en': 'Apple'}, 'calories': 52, 'units': {'pc': 180}, 'default_unit': 'pc'})]
+    import_foods(db_session, read_foods(lines, 'jsonl'))
+
+    # the default unit is listed again, without default_unit
+    lines = [json.dumps({'names': {'en': 'Apple'}, 'calories': 50, 'units': {'pc': 200}})]
+    report = import_foods(db_session, read_foods(lines, 'jsonl'))
+    assert report.updated == 1
+
+    catalog = get_food_catalog(db_session)
+    apple = catalog.get_food('en', 'apple')
+    pc_unit_id = catalog.get_unit_id('en', 'pc')
+    assert catalog.get_default_unit_id(apple.id) == pc_unit_id
+    assert catalog.get_grams(apple.id, pc_unit_id) == 200
+
+    user = db_session.query(User).first()
+    food_log = log_food(db_session, 'en', user, 'apple', None, 1)
+    assert food_log.unit_id == pc_unit_id
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from metrics import Metrics, instrument_handler, metrics, start_metrics_server
+
+
+def test_render_prometheus_text():
+    registry = Metrics()
+    registry.inc('updates_total', handler='today_command')
+    registry.inc('updates_total', 2, handler='today_command')
+    registry.set('future_message_backlog', 7)
+    registry.observe('handler_seconds', 0.02, handler='today_command')
+    registry.observe('handler_seconds', 3, handler='today_command')
+    registry.add_collector(lambda: [('user_cache_entries', 'gauge', (), 5)])
+
+    lines = registry.render().splitlines()
+    assert '# TYPE fatbot_updates_total counter' in lines
+    assert 'fatbot_updates_total{handler="today_command"} 3' in lines
+    assert 'fatbot_future_message_backlog 7' in lines
+    assert 'fatbot_user_cache_entries 5' in lines
+    assert '# TYPE fatbot_handler_seconds histogram' in lines
+    assert 'fatbot_handler_seconds_bucket{handler="today_command",le="0.025"} 1' in lines
+    assert 'fatbot_handler_seconds_bucket{handler="today_command",le="+Inf"} 2' in lines
+    assert 'fatbot_handler_seconds_count{handler="today_command"} 2' in lines
+
+
+@pytest.mark.asyncio
+async def test_instrumented_handler_counts_errors():
+    metrics.clear()
+
+    async def failing_command(update, context):
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        await instrument_handler(failing_command)(None, None)
+
+    samples = {(name, labels): value for name, _, labels, value in metrics.collect()}
+    assert samples[('updates_total', (('handler', 'failing_command'),))] == 1
+    assert samples[('handler_errors_total', (('handler', 'failing_command'),))] == 1
+    assert metrics.get_histogram('handler_seconds', handler='failing_command').count == 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_server():
+    metrics.clear()
+    metrics.set('future_message_backlog', 3)
+    server = await start_metrics_server(0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        await writer.drain()
+        response = (await reader.read()).decode()
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    assert response.startswith('HTTP/1.1 200 OK')
+    assert 'fatbot_future_message_backlog 3\n' in response
@@ -0,0 +1,48 @@
+import logging
+
+import pytest
+
+import query_stats
+from db import run_in_db_session
+from models import Unit
+from query_stats import query_scope
+
+
+def count_units(db_session, times: int):
+    return [db_session.query(Unit).filter(Unit.id > i).count() for i in range(times)]
+
+
+@pytest.mark.asyncio
+async def test_statements_in_db_threads_are_counted():
+    with query_scope('today_command') as stats:
+        await run_in_db_session(count_units, 3)
+    assert stats.count == 3
+    assert list(stats.statements.values())[0][0] == 3
+
+    # outside of a scope nothing is recorded
+    await run_in_db_session(count_units, 1)
+    assert stats.count == 3
+
+
+@pytest.mark.asyncio
+async def test_slow_update_is_logged_with_statements(monkeypatch, caplog):
+    monkeypatch.setattr(query_stats, 'SLOW_UPDATE_QUERIES', 2)
+    monkeypatch.setattr(query_stats, 'SLOW_QUERY_EXPLAIN_SECONDS', '0')
+    with caplog.at_level(logging.WARNING, logger='query_stats'):
+        with query_scope('today_command'):
+            await run_in_db_session(count_units, 3)
+
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert message.startswith('Slow update today_command: 3 queries')
+    assert '3 × ' in message
+    assert 'EXPLAIN: ' in message
+    assert 'EXPLAIN: failed' not in message
+
+
+@pytest.mark.asyncio
+async def test_fast_update_is_not_logged(caplog):
+    with caplog.at_level(logging.WARNING, logger='query_stats'):
+        with query_scope('today_command'):
+            await run_in_db_session(count_units, 1)
+    assert caplog.records == []
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# seconds to import the bot, e.g. 1.5: the chart stack alone used to take longer.
+# Timing depends on the machine and its load, checked only when set
+IMPORT_TIME_BUDGET = os.getenv('IMPORT_TIME_BUDGET')
+CHART_MODULES = ['matplotlib', 'numpy', 'pandas', 'scipy']
+
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import fatbot
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'modules': [m for m in {modules!r} if m in sys.modules],
+}}))
+"""
+
+
+def import_fatbot() -> dict:
+    """
+    Import the bot in a fresh interpreter, other tests have already imported everything here
+    :return: {'seconds': import time, 'modules': chart modules loaded}
+    """
+    env = dict(os.environ, DB_BACKEND='sqlite', DB_PATH=':memory:')
+    result = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(modules=CHART_MODULES)],
+                            cwd=ROOT, env=env, capture_output=True, text=True, timeout=60, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_bot_starts_without_chart_stack():
+    result = import_fatbot()
+    assert result['modules'] == []
+
+
+@pytest.mark.skipif(not IMPORT_TIME_BUDGET, reason='IMPORT_TIME_BUDGET is not set')
+def test_bot_import_time():
+    # the first import compiles the bytecode
+    import_fatbot()
+    result = import_fatbot()
+    assert result['seconds'] < float(IMPORT_TIME_BUDGET)
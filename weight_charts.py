@@ -1,19 +1,20 @@
 from datetime import datetime, timedelta
+from io import BytesIO
 import os
 import tempfile
+import threading
 
 os.environ.setdefault('MPLCONFIGDIR', os.path.join(tempfile.gettempdir(), 'matplotlib'))
 os.environ.setdefault('XDG_CACHE_HOME', tempfile.gettempdir())
-import matplotlib
-matplotlib.use('Agg')  # non-interactive backend
 import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from scipy.interpolate import PchipInterpolator
 
-MIN_CHART_POINTS = 2
+from chart_renderer import MIN_CHART_POINTS
 FIGURE_WIDTH_INCHES = 8
 CHART_HEIGHT_INCHES = 2
 FIGURE_DPI = 100
@@ -23,6 +24,14 @@ DATE_LABEL_LINE_WIDTH = 1.2
 DATE_LABEL_COLOR = 'dimgray'
 Y_AXIS_PADDING_RATIO = 0.12
 MIN_Y_AXIS_PADDING = 0.35
+# fixed margins in inches instead of solving constrained layout for every chart
+LEFT_MARGIN_INCHES = 0.6
+RIGHT_MARGIN_INCHES = 0.15
+TOP_MARGIN_INCHES = 0.3
+BOTTOM_MARGIN_INCHES = 0.3
+PANEL_GAP_INCHES = 0.55
+# lines never have more vertices than the figure has pixels across
+MAX_LINE_POINTS = FIGURE_WIDTH_INCHES * FIGURE_DPI
 
 
 def get_weight_chart_ranges(df: pd.DataFrame, current_time: datetime) -> list:
@@ -42,18 +51,61 @@ def get_weight_chart_ranges(df: pd.DataFrame, current_time: datetime) -> list:
     ]
 
 
-def get_smoothed_weight_line(df: pd.DataFrame):
+def downsample_lttb(x, y, max_points: int):
+    """
+    Largest-Triangle-Three-Buckets: choose max_points points which keep the visual shape
+    of the line, peaks included. The first and the last points are always kept
+    :param x: sorted
+    :param y:
+    :param max_points:
+    :return: indices of the points to keep
+    """
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+
+    # max_points - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    edges[-1] = n - 1
+    indices = np.empty(max_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    selected = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        # the point making the largest triangle with the selected point and the next bucket average
+        areas = np.abs((x[selected] - next_x) * (y[start:end] - y[selected])
+                       - (x[selected] - x[start:end]) * (next_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+    return indices
+
+
+def get_smoothed_weight_line(df: pd.DataFrame, max_points: int = MAX_LINE_POINTS):
+    """
+    :param df:
+    :param max_points: max number of line vertices
+    :return: dates, weights
+    """
     dates = pd.to_datetime(df['created_at']).to_numpy()
     x = mdates.date2num(dates)
     y = df['weight'].astype(float).to_numpy()
     unique_x, unique_indices = np.unique(x, return_index=True)
+    unique_y = y[unique_indices]
+
+    if len(unique_x) > max_points:
+        # more weigh-ins than pixels: interpolating between all of them adds nothing visible
+        keep = downsample_lttb(unique_x, unique_y, max_points)
+        unique_x, unique_y = unique_x[keep], unique_y[keep]
 
     if len(unique_x) < 3:
-        return dates, y
+        return mdates.num2date(unique_x), unique_y
 
-    unique_y = y[unique_indices]
     interpolator = PchipInterpolator(unique_x, unique_y)
-    smooth_x = np.linspace(unique_x[0], unique_x[-1], max(100, len(unique_x) * 20))
+    smooth_x = np.linspace(unique_x[0], unique_x[-1], min(max(100, len(unique_x) * 20), max_points))
     smooth_y = interpolator(smooth_x)
     return mdates.num2date(smooth_x), smooth_y
 
@@ -94,22 +146,29 @@ def get_visible_date_labels(date_labels, df: pd.DataFrame):
     return list(visible_date_labels_by_date.values())
 
 
-def plot_date_labels(ax: Axes, date_labels, df: pd.DataFrame):
+def plot_date_labels(ax: Axes, date_labels, df: pd.DataFrame) -> list:
+    """
+    :param ax:
+    :param date_labels:
+    :param df:
+    :return: added lines
+    """
     visible_date_labels = get_visible_date_labels(date_labels, df)
     if not visible_date_labels:
-        return
+        return []
 
+    lines = []
     for date_label in visible_date_labels:
         label_date = pd.to_datetime(get_date_label_attr(date_label, 'label_date')).to_pydatetime()
         label = get_date_label_attr(date_label, 'label')
         legend_label = '{}: {}'.format(label_date.strftime('%Y-%m-%d'), label)
-        ax.axvline(
+        lines.append(ax.axvline(
             label_date,
             linestyle=':',
             color=DATE_LABEL_COLOR,
             linewidth=DATE_LABEL_LINE_WIDTH,
             label=legend_label,
-        )
+        ))
 
     legend = ax.legend(
         loc='upper right',
@@ -120,48 +179,153 @@ def plot_date_labels(ax: Axes, date_labels, df: pd.DataFrame):
     )
     for handle in legend.legend_handles:
         handle.set_visible(False)
-
-
-def plot_data(ax: Axes, df: pd.DataFrame, title: str, date_labels=None):
-    line_dates, line_weights = get_smoothed_weight_line(df)
-    ax.plot(line_dates, line_weights, linewidth=MAIN_LINE_WIDTH)
-    ax.set_title(title)
-    ax.set_ylim(get_weight_axis_limits(df['weight'], line_weights))
-
-    ax.set_xticks([df['created_at'].iloc[0], df['created_at'].iloc[-1]])
-
-    x = mdates.date2num(pd.to_datetime(df['created_at']).to_numpy())
-    y = df['weight']
-    m, b = np.polyfit(x, y, 1)
-    trend_line = m * x + b
-    trend_value = trend_line[-1] - trend_line[0]
-    trend_dates = mdates.num2date(x)
-    trend_color = 'red' if trend_value >= 0 else 'green'
-    ax.plot(trend_dates, trend_line, linestyle='--', color=trend_color, linewidth=TREND_LINE_WIDTH)
-    trend_text = f"Trend: {'+' if trend_value >= 0 else ''}{trend_value:.2f}"
-    ax.text(0.02, 0.95, trend_text, transform=ax.transAxes, fontsize=8, verticalalignment='top')
-    plot_date_labels(ax, date_labels, df)
+    return lines
+
+
+def get_layout_margins(panel_count: int) -> dict:
+    """
+    :param panel_count:
+    :return: Figure.subplots_adjust arguments
+    """
+    height = CHART_HEIGHT_INCHES * panel_count
+    panel_height = (height - TOP_MARGIN_INCHES - BOTTOM_MARGIN_INCHES
+                    - PANEL_GAP_INCHES * (panel_count - 1)) / panel_count
+    return {
+        'left': LEFT_MARGIN_INCHES / FIGURE_WIDTH_INCHES,
+        'right': 1 - RIGHT_MARGIN_INCHES / FIGURE_WIDTH_INCHES,
+        'top': 1 - TOP_MARGIN_INCHES / height,
+        'bottom': BOTTOM_MARGIN_INCHES / height,
+        'hspace': PANEL_GAP_INCHES / panel_height,
+    }
+
+
+class WeightChartTemplate:
+    """
+    Figure of one layout (1, 2 or 3 panels) with its artists, updated in place for every chart.
+    Uses no pyplot state; one chart at a time, see acquire_template
+    """
+
+    def __init__(self, panel_count: int):
+        self.figure = Figure(figsize=(FIGURE_WIDTH_INCHES, CHART_HEIGHT_INCHES * panel_count), dpi=FIGURE_DPI)
+        FigureCanvasAgg(self.figure)
+        self.figure.subplots_adjust(**get_layout_margins(panel_count))
+        self.axes = list(self.figure.subplots(panel_count, 1, squeeze=False)[:, 0])
+        self.weight_lines = []
+        self.trend_lines = []
+        self.trend_texts = []
+        self.date_label_lines = [[] for _ in self.axes]
+        for ax in self.axes:
+            ax.xaxis_date()
+            self.weight_lines.append(ax.plot([], [], linewidth=MAIN_LINE_WIDTH)[0])
+            self.trend_lines.append(ax.plot([], [], linestyle='--', linewidth=TREND_LINE_WIDTH)[0])
+            self.trend_texts.append(ax.text(0.02, 0.95, '', transform=ax.transAxes, fontsize=8,
+                                            verticalalignment='top'))
+
+    def plot(self, chart_ranges: list, date_labels=None):
+        for index, (title, chart_df) in enumerate(chart_ranges):
+            self.plot_data(index, chart_df, title, date_labels)
+
+    def plot_data(self, index: int, df: pd.DataFrame, title: str, date_labels=None):
+        ax = self.axes[index]
+        for line in self.date_label_lines[index]:
+            line.remove()
+        if ax.get_legend() is not None:
+            ax.get_legend().remove()
+
+        line_dates, line_weights = get_smoothed_weight_line(df)
+        self.weight_lines[index].set_data(line_dates, line_weights)
+        ax.set_title(title)
+
+        x = mdates.date2num(pd.to_datetime(df['created_at']).to_numpy())
+        y = df['weight']
+        m, b = np.polyfit(x, y, 1)
+        trend_line = m * x + b
+        trend_value = trend_line[-1] - trend_line[0]
+        # a straight line: its ends are enough however long the history is
+        self.trend_lines[index].set_data(x[[0, -1]], trend_line[[0, -1]])
+        self.trend_lines[index].set_color('red' if trend_value >= 0 else 'green')
+        self.trend_texts[index].set_text(f"Trend: {'+' if trend_value >= 0 else ''}{trend_value:.2f}")
+
+        ax.relim()
+        ax.autoscale_view(scaley=False)
+        ax.set_ylim(get_weight_axis_limits(df['weight'], line_weights))
+        ax.set_xticks([x[0], x[-1]])
+        self.date_label_lines[index] = plot_date_labels(ax, date_labels, df)
+
+
+_free_templates = {}  # panel count: [WeightChartTemplate]
+_used_templates = {}  # Figure: WeightChartTemplate
+_templates_lock = threading.Lock()
+
+
+def acquire_template(panel_count: int) -> WeightChartTemplate:
+    """
+    Take a template nobody is drawing on, so charts can be rendered from several threads
+    :param panel_count:
+    :return:
+    """
+    with _templates_lock:
+        free_templates = _free_templates.get(panel_count)
+        template = free_templates.pop() if free_templates else None
+    if template is None:
+        template = WeightChartTemplate(panel_count)
+    with _templates_lock:
+        _used_templates[template.figure] = template
+    return template
+
+
+def release_template(template: WeightChartTemplate):
+    with _templates_lock:
+        _used_templates.pop(template.figure, None)
+        _free_templates.setdefault(len(template.axes), []).append(template)
 
 
 def create_weight_chart_figure(chart_ranges: list, date_labels=None):
+    """
+    :param chart_ranges: see get_weight_chart_ranges
+    :param date_labels:
+    :return: Figure, give it back with close_weight_chart_figure
+    """
     if not chart_ranges:
         return None
 
-    fig, axes = plt.subplots(
-        len(chart_ranges),
-        1,
-        figsize=(FIGURE_WIDTH_INCHES, CHART_HEIGHT_INCHES * len(chart_ranges)),
-        dpi=FIGURE_DPI,
-        constrained_layout=True,
-    )
-    if len(chart_ranges) == 1:
-        axes = [axes]
+    template = acquire_template(len(chart_ranges))
+    try:
+        template.plot(chart_ranges, date_labels)
+    except Exception:
+        release_template(template)
+        raise
+    return template.figure
 
-    for ax, (title, chart_df) in zip(axes, chart_ranges):
-        plot_data(ax, chart_df, title, date_labels)
 
-    return fig
+def close_weight_chart_figure(fig):
+    with _templates_lock:
+        template = _used_templates.get(fig)
+    if template is not None:
+        release_template(template)
+
+
+def render_weight_chart(weights: list, date_labels: list, current_time: datetime):
+    """
+    Render weight chart from plain data, so it can run in a worker process or thread
+    :param weights: list of (created_at timestamp, weight) ordered by created_at
+    :param date_labels: list of (label_date, label)
+    :param current_time:
+    :return: PNG image bytes or None if there is nothing to draw
+    """
+    df = pd.DataFrame(weights, columns=['created_at', 'weight'])
+    if df.empty:
+        return None
 
+    df['created_at'] = pd.to_datetime(df['created_at'], unit='s')
+    date_labels = [{'label_date': label_date, 'label': label} for label_date, label in date_labels]
+    fig = create_weight_chart_figure(get_weight_chart_ranges(df, current_time), date_labels)
+    if not fig:
+        return None
 
-def close_weight_chart_figure(fig):
-    plt.close(fig)
+    buffer = BytesIO()
+    try:
+        fig.savefig(buffer, format='png')
+    finally:
+        close_weight_chart_figure(fig)
+    return buffer.getvalue()